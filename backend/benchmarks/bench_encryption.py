@@ -0,0 +1,81 @@
+"""
+Field encryption microbenchmark: per-field cost of encrypt_text/decrypt_text
+in a loop versus the batch API, at BENCH_VALUES values shaped like chat
+rows (titles, prompts, SQL, model responses).
+
+    cd backend && python -m benchmarks.bench_encryption
+"""
+import os
+import time
+import random
+import statistics
+
+from utils import encryption
+from utils.encryption import encrypt_text, decrypt_text, encrypt_many, decrypt_many
+
+VALUES = int(os.getenv("BENCH_VALUES", "10000"))
+REPEATS = int(os.getenv("BENCH_REPEATS", "5"))
+
+# (share of values, length range) per kind of field
+SHAPES = [
+    (0.25, (8, 40)),      # chat titles, names
+    (0.35, (40, 200)),    # prompts, short SQL
+    (0.30, (200, 800)),   # rewritten SQL
+    (0.10, (800, 4000)),  # model responses
+]
+
+
+def _values():
+    rng = random.Random(42)
+    alphabet = "abcdefghijklmnopqrstuvwxyz SELECT*,=()'0123456789é"
+    values = []
+    for share, (lo, hi) in SHAPES:
+        for _ in range(int(VALUES * share)):
+            values.append("".join(rng.choice(alphabet) for _ in range(rng.randint(lo, hi))))
+    rng.shuffle(values)
+    return values
+
+
+def _us_per_field(fn, values):
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter_ns()
+        fn(values)
+        samples.append((time.perf_counter_ns() - start) / len(values) / 1000)
+    return statistics.median(samples)
+
+
+def main():
+    values = _values()
+    ciphertexts = [encrypt_text(v) for v in values]
+    assert decrypt_many(encrypt_many(values)) == values
+    assert decrypt_many(ciphertexts) == values
+
+    print(f"{len(values)} values, median of {REPEATS} runs, {encryption.ENCRYPTION_WORKERS} workers\n")
+    print(f"{'variant':<22}{'encrypt us/field':>18}{'decrypt us/field':>18}")
+
+    loop_enc = _us_per_field(lambda vs: [encrypt_text(v) for v in vs], values)
+    loop_dec = _us_per_field(lambda vs: [decrypt_text(v) for v in ciphertexts], values)
+    print(f"{'per-field loop':<22}{loop_enc:>18.2f}{loop_dec:>18.2f}")
+
+    parallel_min = encryption.ENCRYPTION_PARALLEL_MIN
+    encryption.ENCRYPTION_PARALLEL_MIN = len(values) + 1
+    serial_enc = _us_per_field(encrypt_many, values)
+    serial_dec = _us_per_field(lambda vs: decrypt_many(ciphertexts), values)
+    print(f"{'batch':<22}{serial_enc:>18.2f}{serial_dec:>18.2f}")
+
+    encryption.ENCRYPTION_PARALLEL_MIN = 1
+    pool_enc = _us_per_field(encrypt_many, values)
+    pool_dec = _us_per_field(lambda vs: decrypt_many(ciphertexts), values)
+    print(f"{'batch + worker pool':<22}{pool_enc:>18.2f}{pool_dec:>18.2f}")
+    encryption.ENCRYPTION_PARALLEL_MIN = parallel_min
+
+    # A typical page: 50 messages x 4 encrypted fields
+    page = ciphertexts[:200]
+    loop_page = _us_per_field(lambda vs: [decrypt_text(v) for v in vs], page)
+    batch_page = _us_per_field(decrypt_many, page)
+    print(f"\n200-field page decrypt: loop {loop_page:.2f} us/field, batch {batch_page:.2f} us/field")
+
+
+if __name__ == "__main__":
+    main()
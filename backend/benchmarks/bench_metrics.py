@@ -0,0 +1,111 @@
+"""
+Instrumentation overhead microbenchmark: what one stage() block, counter
+increment and histogram observation cost on the request path, alone and
+with BENCH_THREADS threads updating the same series.
+
+    cd backend && python -m benchmarks.bench_metrics
+"""
+import os
+import time
+import threading
+import statistics
+
+from utils.metrics import Counter, Histogram, render
+from utils.timing import stage, collect_stages
+
+ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "200000"))
+THREADS = int(os.getenv("BENCH_THREADS", "8"))
+REPEATS = int(os.getenv("BENCH_REPEATS", "5"))
+
+COUNTER = Counter("bench_events_total", "benchmark counter", ["kind"])
+HISTOGRAM = Histogram("bench_seconds", "benchmark histogram", ["stage"])
+
+
+class _bare:
+    """A context manager that does nothing: the floor for any with-block."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _empty_stage():
+    with _bare():
+        pass
+
+
+def _timed_stage():
+    with stage("bench"):
+        pass
+
+
+def _collected_stage():
+    with collect_stages():
+        with stage("bench"):
+            pass
+
+
+def _counter():
+    COUNTER.inc("bench")
+
+
+def _histogram():
+    HISTOGRAM.observe(0.0123, "bench")
+
+
+def _ns_per_op(fn, iterations=ITERATIONS):
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            fn()
+        samples.append((time.perf_counter_ns() - start) / iterations)
+    return statistics.median(samples)
+
+
+def _threaded_ns_per_op(fn):
+    per_thread = ITERATIONS // THREADS
+
+    def work():
+        for _ in range(per_thread):
+            fn()
+
+    threads = [threading.Thread(target=work) for _ in range(THREADS)]
+    start = time.perf_counter_ns()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return (time.perf_counter_ns() - start) / (per_thread * THREADS)
+
+
+def main():
+    print(f"{ITERATIONS} ops, median of {REPEATS} runs\n")
+    print(f"{'operation':<34}{'ns/op':>10}{f'ns/op ({THREADS} thr)':>20}")
+
+    floor = _ns_per_op(_empty_stage)
+    for name, fn in [
+        ("empty with-block (floor)", _empty_stage),
+        ("stage() -> histogram", _timed_stage),
+        ("stage() inside collect_stages()", _collected_stage),
+        ("Counter.inc", _counter),
+        ("Histogram.observe", _histogram),
+    ]:
+        single = _ns_per_op(fn)
+        threaded = _threaded_ns_per_op(fn)
+        print(f"{name:<34}{single:>10.0f}{threaded:>20.0f}")
+
+    stage_cost = _ns_per_op(_timed_stage) - floor
+    print(f"\nstage() instrumentation over a bare with-block: {stage_cost / 1000:.2f} us")
+
+    start = time.perf_counter()
+    text = render()
+    print(f"render(): {len(text.splitlines())} lines in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
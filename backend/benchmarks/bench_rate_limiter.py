@@ -0,0 +1,104 @@
+"""
+Rate limiter microbenchmark: cost of one decision with many active keys.
+
+Fills the limiter with BENCH_KEYS active keys, then times random hits for
+each policy, single-threaded and from BENCH_THREADS threads, against the
+previous fixed-window dict with its O(n) cleanup scan.
+
+    cd backend && python -m benchmarks.bench_rate_limiter
+"""
+import os
+import time
+import random
+import threading
+import statistics
+
+from utils.rate_limiter import RateLimiter, RatePolicy
+
+KEYS = int(os.getenv("BENCH_KEYS", "100000"))
+HITS = int(os.getenv("BENCH_HITS", "200000"))
+THREADS = int(os.getenv("BENCH_THREADS", "8"))
+REPEATS = int(os.getenv("BENCH_REPEATS", "5"))
+
+POLICY = {
+    "token_bucket": RatePolicy(5, 60),
+    "sliding_window": RatePolicy(5, 60, "sliding_window"),
+}
+
+
+class LegacyFixedWindow:
+    """The old limiter: one dict, full scan once it holds more than 1000 keys."""
+
+    def __init__(self, limit=5, window=60, cleanup_threshold=1000):
+        self.state = {}
+        self.limit = limit
+        self.window = window
+        self.cleanup_threshold = cleanup_threshold
+
+    def hit(self, key):
+        now = time.time()
+        if len(self.state) > self.cleanup_threshold:
+            for k in [k for k, d in self.state.items() if now >= d["reset"]]:
+                del self.state[k]
+
+        data = self.state.get(key)
+        if data is None or now >= data["reset"]:
+            data = self.state[key] = {"count": 0, "reset": now + self.window}
+        if data["count"] >= self.limit:
+            return False
+        data["count"] += 1
+        return True
+
+
+def _keys():
+    rng = random.Random(42)
+    return [("bench", rng.randrange(KEYS)) for _ in range(HITS)]
+
+
+def _ns_per_hit(fn, keys):
+    samples = []
+    for _ in range(REPEATS):
+        start = time.perf_counter_ns()
+        for key in keys:
+            fn(key)
+        samples.append((time.perf_counter_ns() - start) / len(keys))
+    return statistics.median(samples)
+
+
+def _threaded_ns_per_hit(fn, keys):
+    chunks = [keys[i::THREADS] for i in range(THREADS)]
+    threads = [threading.Thread(target=lambda c=c: [fn(k) for k in c]) for c in chunks]
+    start = time.perf_counter_ns()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return (time.perf_counter_ns() - start) / len(keys)
+
+
+def main():
+    keys = _keys()
+    print(f"{KEYS} active keys, {HITS} hits, median of {REPEATS} runs\n")
+    print(f"{'limiter':<18}{'ns/hit':>12}{f'ns/hit ({THREADS} thr)':>22}{'keys held':>12}")
+
+    for name, policy in POLICY.items():
+        limiter = RateLimiter()
+        for i in range(KEYS):
+            limiter.hit(("bench", i), policy)
+
+        fn = lambda key, limiter=limiter, policy=policy: limiter.hit(key, policy)
+        single = _ns_per_hit(fn, keys)
+        threaded = _threaded_ns_per_hit(fn, keys)
+        print(f"{name:<18}{single:>12.0f}{threaded:>22.0f}{limiter.stats()['keys']:>12}")
+
+    legacy = LegacyFixedWindow()
+    for i in range(KEYS):
+        legacy.state[("bench", i)] = {"count": 0, "reset": time.time() + 60}
+    # Every call scans all keys; time a small slice so the run finishes
+    legacy_keys = keys[:max(1, HITS // 1000)]
+    single = _ns_per_hit(legacy.hit, legacy_keys)
+    print(f"{'legacy (fixed)':<18}{single:>12.0f}{'n/a':>22}{len(legacy.state):>12}")
+
+
+if __name__ == "__main__":
+    main()
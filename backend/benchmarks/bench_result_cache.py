@@ -0,0 +1,77 @@
+"""
+Result cache microbenchmark: key derivation (first sight and repeat),
+store and hit cost, and cached bytes per row for TPC-H-shaped results of
+BENCH_SIZES rows. Runs without a database; table versions are faked.
+
+    cd backend && python -m benchmarks.bench_result_cache
+"""
+import os
+import time
+import random
+import decimal
+import datetime
+import statistics
+
+from utils import result_cache
+
+SIZES = [int(n) for n in os.getenv("BENCH_SIZES", "10,1000,20000").split(",")]
+REPEATS = int(os.getenv("BENCH_REPEATS", "5"))
+
+QUERY = """
+    SELECT l_returnflag, l_linestatus, SUM(l_quantity) AS sum_qty,
+           AVG(l_extendedprice) AS avg_price, MIN(l_shipdate) AS first_ship
+    FROM lineitem
+    WHERE l_shipdate <= DATE '1998-09-02'
+    GROUP BY l_returnflag, l_linestatus
+    ORDER BY l_returnflag, l_linestatus
+"""
+
+
+def _result(rows):
+    rng = random.Random(7)
+    columns = ["l_returnflag", "l_linestatus", "sum_qty", "avg_price", "first_ship"]
+    return {
+        "success": True,
+        "columns": columns,
+        "rows": [
+            {
+                "l_returnflag": rng.choice("ANR"),
+                "l_linestatus": rng.choice("OF"),
+                "sum_qty": decimal.Decimal(rng.randint(1, 10 ** 7)),
+                "avg_price": decimal.Decimal(f"{rng.uniform(900, 105000):.2f}"),
+                "first_ship": datetime.date(1992, 1, 2) + datetime.timedelta(days=rng.randint(0, 2400)),
+            }
+            for _ in range(rows)
+        ],
+        "time_ms": 250.0,
+    }
+
+
+def _us(fn, repeats=REPEATS):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    result_cache._read_versions = lambda: {"lineitem": 1}
+
+    first = _us(lambda: (result_cache._analyze.cache_clear(), result_cache.cache_key(QUERY)))
+    repeat = _us(lambda: result_cache.cache_key(QUERY), repeats=1000)
+    print(f"cache_key: {first:.0f} us first sight (parse), {repeat:.1f} us repeat\n")
+
+    print(f"{'rows':>8}{'put us':>12}{'get us':>12}{'bytes/row':>12}")
+    for n in SIZES:
+        result = _result(n)
+        key = f"bench-{n}"
+        put = _us(lambda: result_cache.put(key, result))
+        get = _us(lambda: result_cache.get(key))
+        size = len(result_cache.RESULT_CACHE.local.get(key))
+        print(f"{n:>8}{put:>12.0f}{get:>12.0f}{size / n:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
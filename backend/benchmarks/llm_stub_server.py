@@ -0,0 +1,74 @@
+"""
+Stand-in LLM server for load tests.
+
+Answers POST /generate {"prompt": ...} with {"response": ...} after a
+configurable delay, using the offline TPC-H responder (recorded responses,
+NL fixtures, identity rewrites). Point the backend at it with:
+
+    cd backend
+    python -m benchmarks.llm_stub_server --port 8089 --latency-ms 800
+    LLM_PROVIDER=stub LLM_STUB_URL=http://127.0.0.1:8089 uvicorn main:app
+"""
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.tpch.responder import ReplayResponder
+
+
+def make_handler(responder, latency_ms, jitter_ms):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, so clients reuse connections
+
+        def do_POST(self):
+            if self.path != "/generate":
+                self.send_error(404)
+                return
+
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            delay = latency_ms + (random.uniform(-jitter_ms, jitter_ms) if jitter_ms else 0)
+            if delay > 0:
+                time.sleep(delay / 1000)
+
+            try:
+                payload, status = {"response": responder(body["prompt"])}, 200
+            except KeyError as e:
+                payload, status = {"error": str(e)}, 404
+
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before every response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform ± jitter added to the delay")
+    parser.add_argument("--recording", help="responses recorded with benchmarks.tpch.run --record")
+    args = parser.parse_args(argv)
+
+    handler = make_handler(ReplayResponder(args.recording), args.latency_ms, args.jitter_ms)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"LLM stub listening on http://{args.host}:{args.port} (latency {args.latency_ms}±{args.jitter_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
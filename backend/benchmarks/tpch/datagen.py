@@ -0,0 +1,399 @@
+"""
+TPC-H schema and data loader.
+
+Either loads dbgen output (`*.tbl` files) with COPY, or generates a
+dbgen-shaped dataset inside Postgres with a seeded generate_series: same
+cardinalities per scale factor, same value domains (nations, regions,
+p_type syllables, containers, segments, priorities, ship modes, 1992–1998
+dates, phone country codes, the custkey % 3 gap) so all 22 queries select
+realistic row counts. Generation is deterministic for a given scale/seed.
+"""
+import os
+import time
+
+from utils.db import connection
+
+TABLES = ["region", "nation", "part", "supplier", "partsupp", "customer", "orders", "lineitem"]
+
+SCHEMA_DDL = """
+CREATE TABLE region (
+    r_regionkey INTEGER PRIMARY KEY,
+    r_name VARCHAR(25) NOT NULL,
+    r_comment TEXT
+);
+CREATE TABLE nation (
+    n_nationkey INTEGER PRIMARY KEY,
+    n_name VARCHAR(25) NOT NULL,
+    n_regionkey INTEGER NOT NULL,
+    n_comment TEXT
+);
+CREATE TABLE part (
+    p_partkey INTEGER PRIMARY KEY,
+    p_name VARCHAR(55) NOT NULL,
+    p_mfgr VARCHAR(25) NOT NULL,
+    p_brand VARCHAR(10) NOT NULL,
+    p_type VARCHAR(25) NOT NULL,
+    p_size INTEGER NOT NULL,
+    p_container VARCHAR(10) NOT NULL,
+    p_retailprice NUMERIC(15, 2) NOT NULL,
+    p_comment TEXT
+);
+CREATE TABLE supplier (
+    s_suppkey INTEGER PRIMARY KEY,
+    s_name VARCHAR(25) NOT NULL,
+    s_address VARCHAR(40) NOT NULL,
+    s_nationkey INTEGER NOT NULL,
+    s_phone VARCHAR(15) NOT NULL,
+    s_acctbal NUMERIC(15, 2) NOT NULL,
+    s_comment TEXT
+);
+CREATE TABLE partsupp (
+    ps_partkey INTEGER NOT NULL,
+    ps_suppkey INTEGER NOT NULL,
+    ps_availqty INTEGER NOT NULL,
+    ps_supplycost NUMERIC(15, 2) NOT NULL,
+    ps_comment TEXT,
+    PRIMARY KEY (ps_partkey, ps_suppkey)
+);
+CREATE TABLE customer (
+    c_custkey INTEGER PRIMARY KEY,
+    c_name VARCHAR(25) NOT NULL,
+    c_address VARCHAR(40) NOT NULL,
+    c_nationkey INTEGER NOT NULL,
+    c_phone VARCHAR(15) NOT NULL,
+    c_acctbal NUMERIC(15, 2) NOT NULL,
+    c_mktsegment VARCHAR(10) NOT NULL,
+    c_comment TEXT
+);
+CREATE TABLE orders (
+    o_orderkey INTEGER PRIMARY KEY,
+    o_custkey INTEGER NOT NULL,
+    o_orderstatus CHAR(1) NOT NULL,
+    o_totalprice NUMERIC(15, 2) NOT NULL,
+    o_orderdate DATE NOT NULL,
+    o_orderpriority VARCHAR(15) NOT NULL,
+    o_clerk VARCHAR(15) NOT NULL,
+    o_shippriority INTEGER NOT NULL,
+    o_comment TEXT
+);
+CREATE TABLE lineitem (
+    l_orderkey INTEGER NOT NULL,
+    l_partkey INTEGER NOT NULL,
+    l_suppkey INTEGER NOT NULL,
+    l_linenumber INTEGER NOT NULL,
+    l_quantity NUMERIC(15, 2) NOT NULL,
+    l_extendedprice NUMERIC(15, 2) NOT NULL,
+    l_discount NUMERIC(15, 2) NOT NULL,
+    l_tax NUMERIC(15, 2) NOT NULL,
+    l_returnflag CHAR(1) NOT NULL,
+    l_linestatus CHAR(1) NOT NULL,
+    l_shipdate DATE NOT NULL,
+    l_commitdate DATE NOT NULL,
+    l_receiptdate DATE NOT NULL,
+    l_shipinstruct VARCHAR(25) NOT NULL,
+    l_shipmode VARCHAR(10) NOT NULL,
+    l_comment TEXT,
+    PRIMARY KEY (l_orderkey, l_linenumber)
+);
+"""
+
+# Secondary indexes commonly used for TPC-H on Postgres (FK columns + dates)
+INDEX_DDL = """
+CREATE INDEX ON nation (n_regionkey);
+CREATE INDEX ON supplier (s_nationkey);
+CREATE INDEX ON partsupp (ps_suppkey);
+CREATE INDEX ON customer (c_nationkey);
+CREATE INDEX ON orders (o_custkey);
+CREATE INDEX ON orders (o_orderdate);
+CREATE INDEX ON lineitem (l_partkey, l_suppkey);
+CREATE INDEX ON lineitem (l_shipdate);
+"""
+
+REGIONS = ["AFRICA", "AMERICA", "ASIA", "EUROPE", "MIDDLE EAST"]
+
+# (name, regionkey) in nationkey order, as in the spec
+NATIONS = [
+    ("ALGERIA", 0), ("ARGENTINA", 1), ("BRAZIL", 1), ("CANADA", 1), ("EGYPT", 4),
+    ("ETHIOPIA", 0), ("FRANCE", 3), ("GERMANY", 3), ("INDIA", 2), ("INDONESIA", 2),
+    ("IRAN", 4), ("IRAQ", 4), ("JAPAN", 2), ("JORDAN", 4), ("KENYA", 0),
+    ("MOROCCO", 0), ("MOZAMBIQUE", 0), ("PERU", 1), ("CHINA", 2), ("ROMANIA", 3),
+    ("SAUDI ARABIA", 4), ("VIETNAM", 2), ("RUSSIA", 3), ("UNITED KINGDOM", 3), ("UNITED STATES", 1),
+]
+
+# Spec value domains, as SQL array literals
+_COLORS = """ARRAY['almond','antique','aquamarine','azure','beige','bisque','black','blanched',
+    'blue','blush','brown','burlywood','burnished','chartreuse','chiffon','chocolate','coral',
+    'cornflower','cornsilk','cream','cyan','dark','deep','dim','dodger','drab','firebrick',
+    'floral','forest','frosted','gainsboro','ghost','goldenrod','green','grey','honeydew',
+    'hot','indian','ivory','khaki','lace','lavender','lawn','lemon','light','lime','linen',
+    'magenta','maroon','medium','metallic','midnight','mint','misty','moccasin','navajo',
+    'navy','olive','orange','orchid','pale','papaya','peach','peru','pink','plum','powder',
+    'puff','purple','red','rose','rosy','royal','saddle','salmon','sandy','seashell','sienna',
+    'sky','slate','smoke','snow','spring','steel','tan','thistle','tomato','turquoise',
+    'violet','wheat','white','yellow']"""
+_WORDS = """ARRAY['furiously','quickly','carefully','blithely','slyly','fluffily','ironic',
+    'final','regular','express','pending','bold','even','special','unusual','silent','idle',
+    'requests','deposits','packages','accounts','instructions','theodolites','pinto','beans',
+    'foxes','ideas','dependencies','excuses','platelets','asymptotes','courts','dolphins',
+    'sleep','wake','nag','haggle','cajole','boost','detect','integrate','use','are','among',
+    'above','along','across','after','against']"""
+_TYPE_1 = "ARRAY['STANDARD','SMALL','MEDIUM','LARGE','ECONOMY','PROMO']"
+_TYPE_2 = "ARRAY['ANODIZED','BURNISHED','PLATED','POLISHED','BRUSHED']"
+_TYPE_3 = "ARRAY['TIN','NICKEL','BRASS','STEEL','COPPER']"
+_CONTAINER_1 = "ARRAY['SM','LG','MED','JUMBO','WRAP']"
+_CONTAINER_2 = "ARRAY['CASE','BOX','BAG','JAR','PKG','PACK','CAN','DRUM']"
+_SEGMENTS = "ARRAY['AUTOMOBILE','BUILDING','FURNITURE','MACHINERY','HOUSEHOLD']"
+_PRIORITIES = "ARRAY['1-URGENT','2-HIGH','3-MEDIUM','4-NOT SPECIFIED','5-LOW']"
+_INSTRUCTIONS = "ARRAY['DELIVER IN PERSON','COLLECT COD','NONE','TAKE BACK RETURN']"
+_MODES = "ARRAY['REG AIR','AIR','RAIL','SHIP','TRUCK','MAIL','FOB']"
+
+# Dates: orders are placed between STARTDATE and ENDDATE - 151 days
+START_DATE = "1992-01-01"
+ORDER_DATE_SPAN = 2405 - 151
+CURRENT_DATE = "1995-06-17"
+
+_HELPERS = f"""
+CREATE OR REPLACE FUNCTION pg_temp.pick(arr TEXT[]) RETURNS TEXT AS $$
+    SELECT arr[1 + floor(random() * array_length(arr, 1))::int]
+$$ LANGUAGE sql VOLATILE;
+
+CREATE OR REPLACE FUNCTION pg_temp.words(n INT) RETURNS TEXT AS $$
+    SELECT string_agg(pg_temp.pick({_WORDS}), ' ') FROM generate_series(1, n)
+$$ LANGUAGE sql VOLATILE;
+
+CREATE OR REPLACE FUNCTION pg_temp.phone(nationkey INT) RETURNS TEXT AS $$
+    SELECT (nationkey + 10)::text
+        || '-' || (100 + floor(random() * 900))::int
+        || '-' || (100 + floor(random() * 900))::int
+        || '-' || (1000 + floor(random() * 9000))::int
+$$ LANGUAGE sql VOLATILE;
+
+CREATE OR REPLACE FUNCTION pg_temp.retailprice(partkey INT) RETURNS NUMERIC AS $$
+    SELECT ((90000 + ((partkey / 10) % 20001) + 100 * (partkey % 1000)) / 100.0)::numeric(15, 2)
+$$ LANGUAGE sql IMMUTABLE;
+"""
+
+
+def _sizes(scale: float):
+    return {
+        "supplier": max(1, int(10000 * scale)),
+        "part": max(1, int(200000 * scale)),
+        "customer": max(1, int(150000 * scale)),
+        "orders": max(1, int(1500000 * scale)),
+    }
+
+
+def _generate_sql(scale: float):
+    n = _sizes(scale)
+    S, P, C, O = n["supplier"], n["part"], n["customer"], n["orders"]
+    # Customers with custkey % 3 = 0 never place orders (Q13 / Q22 rely on it)
+    ordering_customers = max(1, (2 * C) // 3)
+
+    return [
+        ("region", "INSERT INTO region VALUES " + ", ".join(
+            f"({i}, '{name}', pg_temp.words(8))" for i, name in enumerate(REGIONS))),
+        ("nation", "INSERT INTO nation VALUES " + ", ".join(
+            f"({i}, '{name}', {region}, pg_temp.words(10))" for i, (name, region) in enumerate(NATIONS))),
+        ("part", f"""
+            INSERT INTO part
+            SELECT p,
+                   pg_temp.pick({_COLORS}) || ' ' || pg_temp.pick({_COLORS}) || ' ' || pg_temp.pick({_COLORS})
+                       || ' ' || pg_temp.pick({_COLORS}) || ' ' || pg_temp.pick({_COLORS}),
+                   'Manufacturer#' || m,
+                   'Brand#' || m || (1 + floor(random() * 5))::int,
+                   pg_temp.pick({_TYPE_1}) || ' ' || pg_temp.pick({_TYPE_2}) || ' ' || pg_temp.pick({_TYPE_3}),
+                   1 + floor(random() * 50)::int,
+                   pg_temp.pick({_CONTAINER_1}) || ' ' || pg_temp.pick({_CONTAINER_2}),
+                   pg_temp.retailprice(p),
+                   pg_temp.words(3)
+            FROM (SELECT p, 1 + floor(random() * 5)::int AS m FROM generate_series(1, {P}) AS p) AS g
+        """),
+        ("supplier", f"""
+            INSERT INTO supplier
+            SELECT s,
+                   'Supplier#' || lpad(s::text, 9, '0'),
+                   pg_temp.words(2),
+                   nationkey,
+                   pg_temp.phone(nationkey),
+                   round((-999.99 + random() * 10999.98)::numeric, 2),
+                   CASE WHEN s % 200 = 7 THEN 'slyly Customer ' || pg_temp.words(2) || ' Complaints'
+                        ELSE pg_temp.words(8) END
+            FROM (SELECT s, floor(random() * 25)::int AS nationkey FROM generate_series(1, {S}) AS s) AS g
+        """),
+        ("partsupp", f"""
+            INSERT INTO partsupp
+            SELECT p,
+                   (p + i * ({S} / 4 + (p - 1) / {S})) % {S} + 1,
+                   1 + floor(random() * 9999)::int,
+                   round((1 + random() * 999)::numeric, 2),
+                   pg_temp.words(12)
+            FROM generate_series(1, {P}) AS p, generate_series(0, {min(3, S - 1)}) AS i
+            ON CONFLICT DO NOTHING
+        """),
+        ("customer", f"""
+            INSERT INTO customer
+            SELECT c,
+                   'Customer#' || lpad(c::text, 9, '0'),
+                   pg_temp.words(2),
+                   nationkey,
+                   pg_temp.phone(nationkey),
+                   round((-999.99 + random() * 10999.98)::numeric, 2),
+                   pg_temp.pick({_SEGMENTS}),
+                   pg_temp.words(10)
+            FROM (SELECT c, floor(random() * 25)::int AS nationkey FROM generate_series(1, {C}) AS c) AS g
+        """),
+        ("orders", f"""
+            INSERT INTO orders
+            SELECT o,
+                   j + (j - 1) / 2,
+                   'O', 0,
+                   DATE '{START_DATE}' + floor(random() * {ORDER_DATE_SPAN})::int,
+                   pg_temp.pick({_PRIORITIES}),
+                   'Clerk#' || lpad((1 + floor(random() * {max(1, int(1000 * scale))}))::int::text, 9, '0'),
+                   0,
+                   pg_temp.words(6)
+            FROM (SELECT o, 1 + floor(random() * {ordering_customers})::int AS j
+                  FROM generate_series(1, {O}) AS o) AS g
+        """),
+        ("lineitem", f"""
+            INSERT INTO lineitem
+            SELECT l_orderkey, l_partkey,
+                   (l_partkey + supp_i * ({S} / 4 + (l_partkey - 1) / {S})) % {S} + 1,
+                   l_linenumber, l_quantity,
+                   l_quantity * pg_temp.retailprice(l_partkey),
+                   l_discount, l_tax,
+                   CASE WHEN shipdate + receipt_off <= DATE '{CURRENT_DATE}'
+                        THEN CASE WHEN flag_r < 0.5 THEN 'R' ELSE 'A' END
+                        ELSE 'N' END,
+                   CASE WHEN shipdate > DATE '{CURRENT_DATE}' THEN 'O' ELSE 'F' END,
+                   shipdate, commitdate, shipdate + receipt_off,
+                   instruction, mode, comment
+            FROM (
+                SELECT o_orderkey AS l_orderkey,
+                       n AS l_linenumber,
+                       1 + floor(random() * {P})::int AS l_partkey,
+                       floor(random() * {min(4, S)})::int AS supp_i,
+                       (1 + floor(random() * 50))::numeric AS l_quantity,
+                       (floor(random() * 11) / 100)::numeric AS l_discount,
+                       (floor(random() * 9) / 100)::numeric AS l_tax,
+                       o_orderdate + 1 + floor(random() * 121)::int AS shipdate,
+                       o_orderdate + 30 + floor(random() * 61)::int AS commitdate,
+                       1 + floor(random() * 30)::int AS receipt_off,
+                       random() AS flag_r,
+                       pg_temp.pick({_INSTRUCTIONS}) AS instruction,
+                       pg_temp.pick({_MODES}) AS mode,
+                       pg_temp.words(4) AS comment
+                FROM orders,
+                     generate_series(1, 1 + (o_orderkey::bigint * 2654435761) % 7) AS n
+            ) AS g
+        """),
+        # Order status / total are derived from the line items, as in dbgen
+        ("orders", """
+            UPDATE orders o
+            SET o_orderstatus = t.status, o_totalprice = t.total
+            FROM (
+                SELECT l_orderkey,
+                       CASE WHEN bool_and(l_linestatus = 'F') THEN 'F'
+                            WHEN bool_and(l_linestatus = 'O') THEN 'O'
+                            ELSE 'P' END AS status,
+                       round(SUM(l_extendedprice * (1 + l_tax) * (1 - l_discount)), 2) AS total
+                FROM lineitem GROUP BY l_orderkey
+            ) AS t
+            WHERE o.o_orderkey = t.l_orderkey
+        """),
+    ]
+
+
+def create_schema(cur):
+    cur.execute("DROP TABLE IF EXISTS " + ", ".join(TABLES) + " CASCADE")
+    cur.execute(SCHEMA_DDL)
+
+
+def generate(scale: float = 0.01, seed: float = 0.42):
+    """Create the TPC-H tables and fill them with generated data. Returns row counts."""
+    with connection() as conn:
+        cur = conn.cursor()
+        create_schema(cur)
+
+        # random() is only reproducible without parallel workers
+        cur.execute("SET LOCAL max_parallel_workers_per_gather = 0")
+        cur.execute(_HELPERS)
+        cur.execute("SELECT setseed(%s)", (seed,))
+
+        for table, sql in _generate_sql(scale):
+            start = time.perf_counter()
+            cur.execute(sql)
+            print(f"  {table:<10} {cur.rowcount:>10} rows  {time.perf_counter() - start:6.2f}s")
+
+        cur.execute(INDEX_DDL)
+        conn.commit()
+
+        counts = _row_counts(cur)
+        cur.close()
+
+    _analyze()
+    return counts
+
+
+class _TblReader:
+    """File-like view of a dbgen .tbl file with the trailing '|' of each line removed."""
+
+    def __init__(self, f):
+        self._lines = (line.rstrip("\n").rstrip("|") + "\n" for line in f)
+        self._buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    readline = read
+
+
+def load_dbgen(directory: str):
+    """Create the TPC-H tables and COPY dbgen's <table>.tbl files into them."""
+    with connection() as conn:
+        cur = conn.cursor()
+        create_schema(cur)
+
+        for table in TABLES:
+            path = os.path.join(directory, f"{table}.tbl")
+            start = time.perf_counter()
+            with open(path) as f:
+                cur.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT text, DELIMITER '|')", _TblReader(f))
+            print(f"  {table:<10} {cur.rowcount:>10} rows  {time.perf_counter() - start:6.2f}s")
+
+        cur.execute(INDEX_DDL)
+        conn.commit()
+
+        counts = _row_counts(cur)
+        cur.close()
+
+    _analyze()
+    return counts
+
+
+def _row_counts(cur):
+    counts = {}
+    for table in TABLES:
+        cur.execute(f"SELECT COUNT(*) AS n FROM {table}")
+        counts[table] = cur.fetchone()["n"]
+    return counts
+
+
+def _analyze():
+    # ANALYZE can't share the load transaction's snapshot usefully; run it after commit
+    with connection() as conn:
+        conn.autocommit = True
+        cur = conn.cursor()
+        for table in TABLES:
+            cur.execute(f"ANALYZE {table}")
+        cur.close()
+        conn.autocommit = False
@@ -0,0 +1,80 @@
+"""
+Deterministic LLM stand-ins for offline benchmark runs.
+
+ReplayResponder answers, in order of preference:
+  1. a recorded response for the exact prompt (sha256 → text, JSON file),
+  2. NL→SQL prompts: the fixture SQL for the normalized user request,
+  3. rewrite prompts: the input SQL unchanged (identity rewrite).
+Anything else raises, so an unexpected prompt never silently reaches Gemini.
+
+RecordingResponder calls a real provider and stores every response in the same
+JSON format, so a live run can be replayed offline later.
+"""
+import os
+import re
+import json
+import threading
+
+from services.llm_providers import get_provider, prompt_hash
+from services.nl_to_sql_service import normalize_prompt
+
+from benchmarks.tpch.queries import NL_PROMPTS
+
+_REWRITE_SQL = re.compile(r"Rewrite this SQL:\n(.*?)\n\nOutput only", re.S)
+_NL_REQUEST = re.compile(r"User request:\n(.*?)\n\nDatabase schema:", re.S)
+
+
+def _load(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+class ReplayResponder:
+    def __init__(self, recording_path=None, nl_fixtures=NL_PROMPTS):
+        self.recorded = _load(recording_path)
+        self.nl_fixtures = {normalize_prompt(p): sql for p, sql in nl_fixtures}
+        self.calls = {"recorded": 0, "nl_fixture": 0, "identity_rewrite": 0}
+
+    def __call__(self, prompt: str) -> str:
+        response = self.recorded.get(prompt_hash(prompt))
+        if response is not None:
+            self.calls["recorded"] += 1
+            return response
+
+        match = _NL_REQUEST.search(prompt)
+        if match:
+            sql = self.nl_fixtures.get(normalize_prompt(match.group(1)))
+            if sql is not None:
+                self.calls["nl_fixture"] += 1
+                return sql
+
+        match = _REWRITE_SQL.search(prompt)
+        if match:
+            self.calls["identity_rewrite"] += 1
+            return match.group(1)
+
+        raise KeyError(f"No offline response for prompt {prompt_hash(prompt)[:12]}")
+
+
+class RecordingResponder:
+    """Live provider calls, saved as prompt hash → response for later replay."""
+
+    def __init__(self, recording_path, model=None):
+        self._provider = get_provider(model)
+        self.path = recording_path
+        self.recorded = _load(recording_path)
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str) -> str:
+        text = self._provider.generate(prompt)
+        with self._lock:
+            self.recorded[prompt_hash(prompt)] = text
+        return text
+
+    def save(self):
+        with self._lock:
+            with open(self.path, "w") as f:
+                json.dump(self.recorded, f, indent=2, sort_keys=True)
+        return len(self.recorded)
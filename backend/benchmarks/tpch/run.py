@@ -0,0 +1,335 @@
+"""
+TPC-H benchmark for the rewrite and NL→SQL pipelines.
+
+Loads a scaled TPC-H dataset, runs the 22 TPC-H queries through
+rewrite_sql_pipeline_async and the NL prompts through the /nl-to-sql
+handler, and reports per-stage latency (llm, validation, execution,
+verification, plan, persistence, signing), throughput and rewrite speedups.
+
+LLM calls are answered by a deterministic offline responder unless
+--record is given, so runs are repeatable and need no API key.
+
+    cd backend
+    python -m benchmarks.tpch.run --scale 0.01 --output tpch-results.json
+    python -m benchmarks.tpch.run --skip-load --baseline tpch-results.json
+    python -m benchmarks.tpch.run --record tpch-recording.json   # live LLM_PROVIDER
+"""
+import sys
+import math
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+from datetime import datetime, timezone
+
+from services import llm_providers
+from services.llm_service import rewrite_sql_pipeline_async, REWRITE_CACHE
+from services.nl_to_sql_service import PROMPT_CACHE
+from services.auth_service.auth_service import find_user_by_email, create_user
+from utils import rate_limiter
+from utils.db import connection, close_pool
+from utils.async_db import async_connection, close_async_pool
+from utils.timing import collect_stages
+
+from benchmarks.tpch import datagen
+from benchmarks.tpch.queries import QUERIES, NL_PROMPTS
+from benchmarks.tpch.responder import ReplayResponder, RecordingResponder
+
+BENCH_USER_EMAIL = "tpch-bench@promptsmith.local"
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """samples: list of {stage: ms} dicts → {stage: {p50, p95, mean, max, n}}."""
+    by_stage = {}
+    for sample in samples:
+        for name, ms in sample.items():
+            by_stage.setdefault(name, []).append(ms)
+
+    return {
+        name: {
+            "p50": round(_percentile(values, 50), 3),
+            "p95": round(_percentile(values, 95), 3),
+            "mean": round(statistics.fmean(values), 3),
+            "max": round(max(values), 3),
+            "n": len(values),
+        }
+        for name, values in sorted(by_stage.items())
+    }
+
+
+async def _timed(coro_fn):
+    """Run one request with stage collection; returns (stage timings incl. total, result, error)."""
+    with collect_stages() as timings:
+        start = time.perf_counter()
+        try:
+            result, error = await coro_fn(), None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {getattr(e, 'detail', e)}"
+        timings["total"] = (time.perf_counter() - start) * 1000
+    return dict(timings), result, error
+
+
+async def _run_phase(jobs, concurrency):
+    """Run (label, coroutine factory) jobs with bounded concurrency; returns (records, wall seconds)."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(label, coro_fn):
+        async with semaphore:
+            return (label, *await _timed(coro_fn))
+
+    start = time.perf_counter()
+    records = await asyncio.gather(*(run(label, fn) for label, fn in jobs))
+    return records, time.perf_counter() - start
+
+
+async def bench_rewrite(query_numbers, iterations, concurrency):
+    samples, per_query, errors = [], {}, []
+    wall = 0.0
+
+    for _ in range(iterations):
+        # Every iteration measures the full pipeline, not the rewrite cache
+        REWRITE_CACHE.clear(shared=True)
+        jobs = [(n, lambda n=n: rewrite_sql_pipeline_async(QUERIES[n])) for n in query_numbers]
+        records, elapsed = await _run_phase(jobs, concurrency)
+        wall += elapsed
+
+        for number, timings, result, error in records:
+            samples.append(timings)
+            entry = per_query.setdefault(f"Q{number}", {"total_ms": [], "speedups": []})
+            entry["total_ms"].append(timings["total"])
+            if error:
+                errors.append({"query": f"Q{number}", "error": error})
+                entry["error"] = error
+                continue
+
+            entry["valid"] = result["comparison"]["valid"]
+            entry["accepted"] = result["accepted"]
+            entry["decision"] = result["decision"]
+            speedup = (result["performance"] or {}).get("speedup")
+            if speedup:
+                entry["speedups"].append(speedup["speedup"])
+
+    queries = {}
+    for label, entry in per_query.items():
+        speedups = entry.pop("speedups")
+        queries[label] = {
+            **entry,
+            "total_ms": round(statistics.median(entry["total_ms"]), 3),
+            "speedup": round(statistics.median(speedups), 4) if speedups else None,
+        }
+
+    requests = len(samples)
+    return {
+        "requests": requests,
+        "wall_sec": round(wall, 3),
+        "throughput_rps": round(requests / wall, 3) if wall else None,
+        "accepted": sum(1 for q in queries.values() if q.get("accepted")),
+        "stages": summarize(samples),
+        "queries": queries,
+        "errors": errors,
+    }
+
+
+async def bench_nl_to_sql(user, iterations, concurrency):
+    # Imported here: main builds the FastAPI app and its routers on import
+    from main import nl_to_sql, NLQuery
+
+    async def call(prompt):
+        async with async_connection() as conn:
+            return await nl_to_sql(NLQuery(prompt=prompt), user=user, db=conn)
+
+    samples, errors = [], []
+    wall = 0.0
+    for _ in range(iterations):
+        PROMPT_CACHE.clear(shared=True)
+        jobs = [(prompt, lambda p=prompt: call(p)) for prompt, _ in NL_PROMPTS]
+        records, elapsed = await _run_phase(jobs, concurrency)
+        wall += elapsed
+
+        for prompt, timings, result, error in records:
+            samples.append(timings)
+            if error:
+                errors.append({"prompt": prompt, "error": error})
+            elif not result["data"]["result"]["success"]:
+                errors.append({"prompt": prompt, "error": result["data"]["result"]["error"]})
+
+    requests = len(samples)
+    return {
+        "requests": requests,
+        "wall_sec": round(wall, 3),
+        "throughput_rps": round(requests / wall, 3) if wall else None,
+        "stages": summarize(samples),
+        "errors": errors,
+    }
+
+
+def bench_user():
+    user = find_user_by_email(BENCH_USER_EMAIL)
+    if user is None:
+        user = create_user("TPC-H Bench", BENCH_USER_EMAIL, "tpch-bench-password")
+    return dict(user)
+
+
+def cleanup_chats(user_id):
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM chat_messages WHERE chat_id IN (SELECT id FROM chats WHERE user_id = %s)",
+            (user_id,)
+        )
+        cur.execute("DELETE FROM chats WHERE user_id = %s", (user_id,))
+        conn.commit()
+        cur.close()
+
+
+def compare_to_baseline(results, baseline):
+    """Percent change per phase of p50 stage latency (+ is slower) and throughput (+ is faster)."""
+    delta = {}
+    for phase in ("rewrite", "nl_to_sql"):
+        current, previous = results.get(phase), baseline.get(phase)
+        if not current or not previous:
+            continue
+
+        stages = {}
+        for name, stats in current["stages"].items():
+            old = previous["stages"].get(name)
+            if old and old["p50"]:
+                stages[name] = round((stats["p50"] - old["p50"]) / old["p50"] * 100, 2)
+
+        throughput = None
+        if current["throughput_rps"] and previous.get("throughput_rps"):
+            throughput = round(
+                (current["throughput_rps"] - previous["throughput_rps"]) / previous["throughput_rps"] * 100, 2
+            )
+        delta[phase] = {"p50_pct": stages, "throughput_pct": throughput}
+    return delta
+
+
+def _print_phase(title, phase):
+    print(f"\n{title}: {phase['requests']} requests in {phase['wall_sec']}s "
+          f"({phase['throughput_rps']} req/s), {len(phase['errors'])} errors")
+    print(f"  {'stage':<14}{'p50 ms':>12}{'p95 ms':>12}{'mean ms':>12}")
+    for name, stats in phase["stages"].items():
+        print(f"  {name:<14}{stats['p50']:>12}{stats['p95']:>12}{stats['mean']:>12}")
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="TPC-H benchmark for the PromptSmith pipelines")
+    parser.add_argument("--scale", type=float, default=0.01, help="TPC-H scale factor to generate")
+    parser.add_argument("--seed", type=float, default=0.42, help="setseed() value for data generation")
+    parser.add_argument("--dbgen-dir", help="load dbgen .tbl files from this directory instead of generating")
+    parser.add_argument("--skip-load", action="store_true", help="reuse the TPC-H tables already in the database")
+    parser.add_argument("--queries", help="comma-separated TPC-H query numbers (default: all 22)")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0,
+                        help="simulated LLM latency added to every offline response")
+    parser.add_argument("--recording", help="replay responses recorded with --record")
+    parser.add_argument("--record", metavar="PATH", help="call the configured LLM provider and record its responses to PATH")
+    parser.add_argument("--skip-nl", action="store_true", help="only run the rewrite benchmark")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--max-regression-pct", type=float,
+                        help="exit non-zero if any p50 stage regresses by more than this vs --baseline")
+    return parser.parse_args(argv)
+
+
+async def _run(args):
+    query_numbers = [int(q) for q in args.queries.split(",")] if args.queries else sorted(QUERIES)
+
+    if args.record:
+        responder = RecordingResponder(args.record)
+    else:
+        responder = ReplayResponder(args.recording)
+    llm_providers.set_llm_responder(responder, latency_ms=args.llm_latency_ms)
+
+    # The benchmark user issues far more requests than an interactive one
+    rate_limiter.ENABLED = False
+
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "scale": args.scale,
+            "dataset": "dbgen" if args.dbgen_dir else ("existing" if args.skip_load else "generated"),
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "llm": f"{llm_providers.DEFAULT_PROVIDER} (recording)" if args.record else "offline",
+            "llm_latency_ms": args.llm_latency_ms,
+            "queries": query_numbers,
+            "python": platform.python_version(),
+        }
+    }
+
+    if not args.skip_load:
+        print(f"Loading TPC-H data ({'dbgen: ' + args.dbgen_dir if args.dbgen_dir else f'SF {args.scale}'})")
+        start = time.perf_counter()
+        if args.dbgen_dir:
+            counts = datagen.load_dbgen(args.dbgen_dir)
+        else:
+            counts = datagen.generate(args.scale, args.seed)
+        results["meta"]["load_sec"] = round(time.perf_counter() - start, 3)
+        results["meta"]["row_counts"] = counts
+
+    results["rewrite"] = await bench_rewrite(query_numbers, args.iterations, args.concurrency)
+    _print_phase("Rewrite pipeline", results["rewrite"])
+    for label, q in results["rewrite"]["queries"].items():
+        print(f"  {label:<5} speedup={q.get('speedup')} accepted={q.get('accepted')} {q.get('decision') or q.get('error')}")
+
+    if not args.skip_nl:
+        user = bench_user()
+        try:
+            results["nl_to_sql"] = await bench_nl_to_sql(user, args.iterations, args.concurrency)
+        finally:
+            cleanup_chats(user["id"])
+        _print_phase("NL → SQL", results["nl_to_sql"])
+
+    if isinstance(responder, ReplayResponder):
+        results["meta"]["llm_calls"] = responder.calls
+    else:
+        print(f"\nRecorded {responder.save()} responses to {args.record}")
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["baseline_delta"] = compare_to_baseline(results, json.load(f))
+        print("\nChange vs baseline (p50 %, + is slower):")
+        print(json.dumps(results["baseline_delta"], indent=2))
+
+        if args.max_regression_pct is not None:
+            worst = max(
+                (pct for phase in results["baseline_delta"].values() for pct in phase["p50_pct"].values()),
+                default=0.0
+            )
+            if worst > args.max_regression_pct:
+                print(f"Regression: {worst}% > {args.max_regression_pct}%")
+                exit_code = 1
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    return exit_code
+
+
+async def main(argv=None):
+    args = _parse_args(argv)
+    try:
+        return await _run(args)
+    finally:
+        llm_providers.set_llm_responder(None)
+        await close_async_pool()
+        close_pool()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from pydantic import BaseModel, EmailStr
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
 from dotenv import load_dotenv
 import os
@@ -9,20 +10,36 @@ load_dotenv()
 print(f"🔑 HMAC_SECRET_KEY from env: {os.getenv('HMAC_SECRET_KEY', 'NOT FOUND')}")
 
 
+import json
+import time
+import hashlib
 import traceback
-from services.llm_service import rewrite_sql_pipeline
-from services.instruction_search import find_best_instruction
-from services.nl_to_sql_service import generate_sql_from_prompt
-from utils.sql_executor import run_sql
+from services.llm_service import rewrite_sql_pipeline_async
+from services.instruction_search import search_instructions
+from services.nl_to_sql_service import generate_sql_from_prompt_async
+from utils.sql_executor import (
+    run_sql_async, stream_sql_async, json_default,
+    set_query_limits, until_disconnect, ClientDisconnected, SQL_STREAM_MAX_ROWS,
+)
 from services.sql_validator import validate_sql
 from services.cleaner import is_prompt_safe
 from services.sql_validator import is_sql_safe
-from routes.chat_routes import save_message
+from routes.chat_routes import save_message_async
 from routes import chat_routes
-from utils.db import get_connection as get_db
+from utils.db import close_pool
+from utils.async_db import get_async_db, close_async_pool, async_connection
 from utils.hmac_sign import generate_signature
-from utils.rate_limiter import rate_limit
+from utils.rate_limiter import rate_limit_async
+from utils.timing import stage
+from utils.metrics import MetricsMiddleware, UNSAFE_REJECTIONS
+from utils.tracing import TracingMiddleware, TRACE_ID_HEADER, close_tracing
+from utils.pagination import NEXT_CURSOR_HEADER
+from utils.migrations import MIGRATE_ON_STARTUP, apply_migrations
+from services.stats_service import stop_flusher
+from services.llm_telemetry import set_call_context, start_telemetry_writer, stop_telemetry_writer
 from routes import admin_routes
+from routes import metrics_routes
+from services.llm_providers import close_providers
 
 # Import authentication dependencies
 from routes import auth
@@ -40,18 +57,45 @@ origins = [
     "https://127.0.0.1:5173"
 ]
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  # Configure appropriately for production
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TRACE_ID_HEADER],
 )
 
 # Include authentication routes
 app.include_router(auth.router)
 app.include_router(chat_routes.router)
 app.include_router(admin_routes.router)
+app.include_router(metrics_routes.router)
+
+
+@app.on_event("startup")
+def run_migrations():
+    """Bring the app's tables and indexes up to date before serving"""
+    if MIGRATE_ON_STARTUP:
+        apply_migrations()
+
+
+@app.on_event("startup")
+async def start_background_writers():
+    start_telemetry_writer()
+
+
+@app.on_event("shutdown")
+async def shutdown_db_pool():
+    """Close every pooled DB connection and LLM client when the worker stops"""
+    stop_flusher()
+    await stop_telemetry_writer()
+    close_pool()
+    await close_async_pool()
+    await close_providers()
+    close_tracing()
 
 # ========================
 # Pydantic Models
@@ -76,11 +120,20 @@ def root():
     return {"status": "running", "message": "PromptSmith backend online"}
 
 
+# Not a registered HTTP status, but the conventional one for "client went away"
+CLIENT_CLOSED_REQUEST = 499
+
+
 @app.post("/rewrite-sql")
-def rewrite_sql(req: RewriteSQLRequest, user: dict = Depends(require_user)):
+async def rewrite_sql(req: RewriteSQLRequest, request: Request, user: dict = Depends(require_user)):
     """Rewrite SQL query using LLM pipeline"""
-    rate_limit(user["id"], endpoint="rewrite_sql")
-    result = rewrite_sql_pipeline(req.query)
+    await rate_limit_async(user["id"], endpoint="rewrite_sql")
+    set_call_context(user["id"], "rewrite_sql")
+    set_query_limits("rewrite_sql", user.get("role"))
+    try:
+        result = await until_disconnect(request, rewrite_sql_pipeline_async(req.query))
+    except ClientDisconnected:
+        raise HTTPException(CLIENT_CLOSED_REQUEST, "Client disconnected")
     
     # Handle different return types from rewrite_sql_pipeline
     if isinstance(result, dict):
@@ -116,81 +169,112 @@ def rewrite_sql(req: RewriteSQLRequest, user: dict = Depends(require_user)):
 
     return {
         "data": signed,
-        "signature": signature
+        "signature": signature,
+        # Unsigned diagnostics: verification timings and rewrite acceptance
+        "timings": result.get("timings") if isinstance(result, dict) else None,
+        "performance": {
+            "accepted": result.get("accepted"),
+            "decision": result.get("decision"),
+            "candidate_sql": result.get("candidate_sql"),
+            **(result.get("performance") or {})
+        } if isinstance(result, dict) else None
     }
 
 @app.post("/find-instruction")
-def find_instruction(req: InstructionSearchRequest, user: dict = Depends(require_user)):
+async def find_instruction(req: InstructionSearchRequest, request: Request, user: dict = Depends(require_user)):
     """Find best instruction for a given query"""
-    rate_limit(user["id"], endpoint="find_instruction")
-    return find_best_instruction(req.query, req.attempts)
+    await rate_limit_async(user["id"], endpoint="find_instruction")
+    set_call_context(user["id"], "find_instruction")
+    set_query_limits("find_instruction", user.get("role"))
+    try:
+        return await until_disconnect(request, search_instructions(req.query, attempts=req.attempts))
+    except ClientDisconnected:
+        raise HTTPException(CLIENT_CLOSED_REQUEST, "Client disconnected")
 
 
-@app.post("/nl-to-sql")
-def nl_to_sql(body: NLQuery, user: dict = Depends(require_user), db=Depends(get_db)):
-    rate_limit(user["id"], endpoint="nl_to_sql")
+async def generate_final_sql(prompt: str):
+    """Prompt safety → LLM generation → SQL safety → rewrite. Returns (raw_sql, final_sql)."""
+    # First safety check
+    with stage("validation"):
+        prompt_ok = is_prompt_safe(prompt)
+    if not prompt_ok:
+        UNSAFE_REJECTIONS.inc("prompt")
+        raise HTTPException(400, "This natural-language request is not allowed.")
+
+    # Generate SQL
     try:
-        
-        prompt = body.prompt
-        model: Optional[str] = "Gemini Flash 2.5"
+        with stage("llm"):
+            raw_sql = await generate_sql_from_prompt_async(prompt)
+    except Exception as e:
+        if "429" in str(e) or "quota" in str(e).lower():
+            raise HTTPException(
+                429, 
+                "API quota exceeded. Please try again later or use the Ollama model option."
+            )
+        raise
 
-        # First safety check
-        if not is_prompt_safe(prompt):
-            raise HTTPException(400, "This natural-language request is not allowed.")
+    # Validate SQL
+    with stage("validation"):
+        sql_ok = is_sql_safe(raw_sql)
+    if not sql_ok:
+        UNSAFE_REJECTIONS.inc("sql")
+        raise HTTPException(400, "Unsafe SQL detected")
+
+    # Rewrite SQL
+    rewrite_result = await rewrite_sql_pipeline_async(raw_sql)
+    
+    # Extract the final SQL string properly
+    if isinstance(rewrite_result, dict) and 'rewritten_sql' in rewrite_result:
+        final_sql_data = rewrite_result['rewritten_sql']
+        if isinstance(final_sql_data, str):
+            final_sql = final_sql_data
+        else:
+            final_sql = str(final_sql_data)
+    else:
+        final_sql = str(rewrite_result)
+
+    return raw_sql, final_sql
 
-        # Generate SQL
-        try:
-            raw_sql = generate_sql_from_prompt(prompt)
-        except Exception as e:
-            if "429" in str(e) or "quota" in str(e).lower():
-                raise HTTPException(
-                    429, 
-                    "API quota exceeded. Please try again later or use the Ollama model option."
-                )
-            raise
 
-        # Validate SQL
-        if not is_sql_safe(raw_sql):
-            raise HTTPException(400, "Unsafe SQL detected")
+async def get_or_create_chat(chat_id, user, prompt, db):
+    if chat_id is not None:
+        return chat_id
+    return await db.fetchval(
+        "INSERT INTO chats (user_id, title) VALUES ($1, $2) RETURNING id",
+        user["id"], prompt[:50]
+    )
 
-        # Rewrite SQL
-        rewrite_result = rewrite_sql_pipeline(raw_sql)
+
+@app.post("/nl-to-sql")
+async def nl_to_sql(body: NLQuery, request: Request, user: dict = Depends(require_user), db=Depends(get_async_db)):
+    await rate_limit_async(user["id"], endpoint="nl_to_sql")
+    set_call_context(user["id"], "nl_to_sql")
+    set_query_limits("nl_to_sql", user.get("role"))
+    try:
         
-        # Extract the final SQL string properly
-        if isinstance(rewrite_result, dict) and 'rewritten_sql' in rewrite_result:
-            final_sql_data = rewrite_result['rewritten_sql']
-            if isinstance(final_sql_data, str):
-                final_sql = final_sql_data
-            else:
-                final_sql = str(final_sql_data)
-        else:
-            final_sql = str(rewrite_result)
+        prompt = body.prompt
+        model: Optional[str] = "Gemini Flash 2.5"
+
+        # Generation, verification and execution stop if the client leaves
+        raw_sql, final_sql = await until_disconnect(request, generate_final_sql(prompt))
 
         # Execute SQL
-        sql_res = run_sql(final_sql)
-
-        # Create chat if not exists
-        if body.chat_id is None:
-            cur = db.cursor()
-            cur.execute(
-                "INSERT INTO chats (user_id, title) VALUES (%s, %s) RETURNING id",
-                (user["id"], prompt[:50])
+        with stage("execution"):
+            sql_res = await until_disconnect(request, run_sql_async(final_sql))
+
+        with stage("persistence"):
+            # Create chat if not exists
+            chat_id = await get_or_create_chat(body.chat_id, user, prompt, db)
+
+            # Save history
+            await save_message_async(
+                chat_id=chat_id,
+                user_msg=prompt,
+                ai_msg=str(sql_res),
+                raw_sql=raw_sql,
+                final_sql=final_sql,
+                db=db
             )
-            result = cur.fetchone()
-            chat_id = result["id"] if isinstance(result, dict) else result[0]
-            db.commit()
-        else:
-            chat_id = body.chat_id
-
-        # Save history
-        save_message(
-            chat_id=chat_id,
-            user_msg=prompt,
-            ai_msg=str(sql_res),
-            raw_sql=raw_sql,
-            final_sql=final_sql,
-            db=db
-        )
 
         # Prepare payload with proper serialization
         payload = {
@@ -200,7 +284,8 @@ def nl_to_sql(body: NLQuery, user: dict = Depends(require_user), db=Depends(get_
             "chat_id": chat_id
         }
 
-        signature = generate_signature(payload)
+        with stage("signing"):
+            signature = generate_signature(payload)
 
         return {
             "data": payload,
@@ -209,13 +294,109 @@ def nl_to_sql(body: NLQuery, user: dict = Depends(require_user), db=Depends(get_
 
     except HTTPException:
         raise
+    except ClientDisconnected:
+        raise HTTPException(CLIENT_CLOSED_REQUEST, "Client disconnected")
+    except Exception as e:
+        print(traceback.format_exc())
+        raise HTTPException(500, f"Error: {str(e)}")
+
+
+@app.post("/nl-to-sql/stream")
+async def nl_to_sql_stream(body: NLQuery, request: Request, user: dict = Depends(require_user), db=Depends(get_async_db)):
+    """
+    Same pipeline as /nl-to-sql, but rows are streamed as NDJSON from a
+    server-side cursor so memory stays bounded regardless of result size.
+
+    Records, one JSON object per line:
+      {"type": "meta", ...}       generated/final SQL and chat id
+      {"type": "columns", ...}    column names
+      {"type": "row", "data": {}} one per result row
+      {"type": "summary", ...}    row count, truncation flag, sha256 of every
+                                  preceding line, and an HMAC signature over
+                                  the summary
+
+    At most SQL_STREAM_MAX_ROWS rows are sent. A client disconnect cancels
+    the query (the response stops iterating and the cursor is closed).
+    """
+    await rate_limit_async(user["id"], endpoint="nl_to_sql")
+    set_call_context(user["id"], "nl_to_sql")
+    set_query_limits("nl_to_sql", user.get("role"))
+    try:
+        prompt = body.prompt
+        raw_sql, final_sql = await until_disconnect(request, generate_final_sql(prompt))
+        chat_id = await get_or_create_chat(body.chat_id, user, prompt, db)
+    except HTTPException:
+        raise
+    except ClientDisconnected:
+        raise HTTPException(CLIENT_CLOSED_REQUEST, "Client disconnected")
     except Exception as e:
         print(traceback.format_exc())
         raise HTTPException(500, f"Error: {str(e)}")
 
+    async def ndjson():
+        digest = hashlib.sha256()
+
+        def line(record):
+            data = (json.dumps(record, default=json_default, separators=(',', ':')) + "\n").encode()
+            digest.update(data)
+            return data
+
+        yield line({
+            "type": "meta",
+            "generated_sql": raw_sql,
+            "final_sql": final_sql,
+            "chat_id": chat_id
+        })
+
+        start = time.time()
+        row_count = 0
+        truncated = False
+        error = None
+        rows = stream_sql_async(final_sql)
+        try:
+            columns = await rows.__anext__()
+            yield line({"type": "columns", "columns": columns})
+
+            async for row in rows:
+                if row_count >= SQL_STREAM_MAX_ROWS:
+                    truncated = True
+                    break
+                row_count += 1
+                yield line({"type": "row", "data": row})
+        except Exception as e:
+            error = str(e)
+        finally:
+            await rows.aclose()
+
+        summary = {
+            "type": "summary",
+            "success": error is None,
+            "error": error,
+            "row_count": row_count,
+            "truncated": truncated,
+            "time_ms": round((time.time() - start) * 1000, 3),
+            "sha256": digest.hexdigest()
+        }
+
+        # Save history (row data is not stored for streamed results)
+        async with async_connection() as conn:
+            await save_message_async(
+                chat_id=chat_id,
+                user_msg=prompt,
+                ai_msg=json.dumps(summary),
+                raw_sql=raw_sql,
+                final_sql=final_sql,
+                db=conn
+            )
+
+        summary["signature"] = generate_signature(summary)
+        yield (json.dumps(summary, separators=(',', ':')) + "\n").encode()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 
 @app.get("/admin/dashboard")
-def admin_dashboard(admin: dict = Depends(require_admin)):
+async def admin_dashboard(admin: dict = Depends(require_admin)):
     """Admin-only dashboard endpoint"""
     return {
         "message": f"Welcome Admin {admin['name']}!",
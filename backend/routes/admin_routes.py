@@ -1,28 +1,27 @@
 from fastapi import APIRouter, Depends, HTTPException
-from utils.db import get_connection as get_db
-from routes.auth import require_user
+from utils.db import get_db, pool_stats
+from utils.cache import cache_stats
+from services.llm_providers import provider_stats
+from utils.rate_limiter import rate_limit_stats
+from routes.auth import require_admin
+from services.auth_service.auth_service import invalidate_principal
+from utils.migrations import migration_status, check_indexes
+from services.stats_service import analytics_snapshot, stats_flusher_stats
+from services.llm_telemetry import usage_rollup
+from utils.tracing import tracing_stats
+from utils.result_cache import result_cache_stats, bump_data_version
 from psycopg2.extras import RealDictCursor
-from utils.encryption import decrypt_text
+from utils.encryption import decrypt_rows
 from utils.encryption import encrypt_text  # if needed for future updates
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 
-# -----------------------------
-# Helper: Require admin role
-# -----------------------------
-def require_admin(user):
-    if user["role"] != "admin":
-        raise HTTPException(status_code=403, detail="Admins only")
-    return True
-
-
 # -----------------------------
 # 1) LIST ALL USERS
 # -----------------------------
 @router.get("/users")
-def list_users(user=Depends(require_user), db=Depends(get_db)):
-    require_admin(user)
+def list_users(user=Depends(require_admin), db=Depends(get_db)):
 
     cur = db.cursor(cursor_factory=RealDictCursor)
     # Exclude the current admin from the list
@@ -33,10 +32,7 @@ def list_users(user=Depends(require_user), db=Depends(get_db)):
     rows = cur.fetchall()
 
     # decrypt sensitive fields
-    for r in rows:
-        r["email"] = decrypt_text(r["email"])
-        if r["bio"]:
-            r["bio"] = decrypt_text(r["bio"])
+    decrypt_rows(rows, ["email", "bio"])
 
     cur.close()
     return rows
@@ -46,28 +42,19 @@ def list_users(user=Depends(require_user), db=Depends(get_db)):
 # 2) DELETE A USER
 # -----------------------------
 @router.delete("/users/{user_id}")
-def delete_user(user_id: int, user=Depends(require_user), db=Depends(get_db)):
-    require_admin(user)  # Check admin after getting user
+def delete_user(user_id: int, user=Depends(require_admin), db=Depends(get_db)):
     
     if user_id == user["id"]:
         raise HTTPException(400, "Cannot delete your own account")
 
     cur = db.cursor()
 
-    # Delete messages first
-    cur.execute("""
-        DELETE FROM chat_messages 
-        WHERE chat_id IN (SELECT id FROM chats WHERE user_id = %s)
-    """, (user_id,))
-
-    # Delete chats
-    cur.execute("DELETE FROM chats WHERE user_id = %s", (user_id,))
-
-    # Delete user
+    # Chats and their messages go with the user (ON DELETE CASCADE)
     cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
 
     db.commit()
     cur.close()
+    invalidate_principal(user_id)
 
     return {"success": True, "message": "User and all related data deleted."}
 
@@ -75,8 +62,7 @@ def delete_user(user_id: int, user=Depends(require_user), db=Depends(get_db)):
 # 3) LIST CHATS OF A USER
 # -----------------------------
 @router.get("/users/{user_id}/chats")
-def get_user_chats(user_id: int, user=Depends(require_user), db=Depends(get_db)):
-    require_admin(user)
+def get_user_chats(user_id: int, user=Depends(require_admin), db=Depends(get_db)):
 
     cur = db.cursor(cursor_factory=RealDictCursor)
     cur.execute(
@@ -92,14 +78,11 @@ def get_user_chats(user_id: int, user=Depends(require_user), db=Depends(get_db))
 # 4) DELETE A CHAT
 # -----------------------------
 @router.delete("/chats/{chat_id}")
-def delete_chat(chat_id: int, user=Depends(require_user), db=Depends(get_db)):
-    require_admin(user)
+def delete_chat(chat_id: int, user=Depends(require_admin), db=Depends(get_db)):
 
     cur = db.cursor()
 
-    # delete messages first
-    cur.execute("DELETE FROM chat_messages WHERE chat_id = %s", (chat_id,))
-    # delete the chat itself
+    # messages are removed by ON DELETE CASCADE
     cur.execute("DELETE FROM chats WHERE id = %s", (chat_id,))
 
     db.commit()
@@ -112,32 +95,91 @@ def delete_chat(chat_id: int, user=Depends(require_user), db=Depends(get_db)):
 # 5) ANALYTICS DASHBOARD
 # -----------------------------
 @router.get("/analytics")
-def get_analytics(user=Depends(require_user), db=Depends(get_db)):
-    require_admin(user)  # Check admin after getting user
-    
-    cur = db.cursor()
+def get_analytics(days: int = 30, user=Depends(require_admin)):
+    # Served from incrementally maintained counters (services/stats_service)
+    snapshot = analytics_snapshot(days)
+    totals = snapshot["totals"]
+
+    return {
+        "total_users": totals["users"],
+        "total_chats": totals["chats"],
+        "total_messages": totals["messages"],
+        "llm_usage": totals["llm_calls"],
+        "llm_errors": totals["llm_errors"],
+        "series": snapshot["series"],
+        "query_ms": snapshot["query_ms"],
+        "flusher": stats_flusher_stats(),
+    }
 
-    # total users
-    cur.execute("SELECT COUNT(*) FROM users")
-    total_users = cur.fetchone()[0]
 
-    # total chats
-    cur.execute("SELECT COUNT(*) FROM chats")
-    total_chats = cur.fetchone()[0]
 
-    # total messages
-    cur.execute("SELECT COUNT(*) FROM chat_messages")
-    total_messages = cur.fetchone()[0]
+# -----------------------------
+# 6) DB CONNECTION POOL STATS
+# -----------------------------
+@router.get("/db-pool")
+def get_db_pool_stats(user=Depends(require_admin)):
+    return pool_stats()
 
-    # For LLM usage, use messages count since llm_usage table doesn't exist
-    # Each message represents an LLM call
-    llm_usage = total_messages
 
-    cur.close()
 
-    return {
-        "total_users": total_users,
-        "total_chats": total_chats,
-        "total_messages": total_messages,
-        "llm_usage": llm_usage
-    }
+# -----------------------------
+# 7) CACHE STATS
+# -----------------------------
+@router.get("/cache-stats")
+def get_cache_stats(user=Depends(require_admin)):
+    return cache_stats()
+
+
+# -----------------------------
+# 8) LLM PROVIDER STATS
+# -----------------------------
+@router.get("/llm-stats")
+def get_llm_stats(user=Depends(require_admin)):
+    return provider_stats()
+
+
+# -----------------------------
+# 9) RATE LIMITER STATS
+# -----------------------------
+@router.get("/rate-limits")
+def get_rate_limit_stats(user=Depends(require_admin)):
+    return rate_limit_stats()
+
+
+# -----------------------------
+# 10) SCHEMA CHECK
+# -----------------------------
+@router.get("/schema-check")
+def get_schema_check(user=Depends(require_admin)):
+    return {"migrations": migration_status(), **check_indexes()}
+
+
+# -----------------------------
+# 11) LLM USAGE ROLLUPS
+# -----------------------------
+@router.get("/llm-usage")
+async def get_llm_usage(days: int = 7, user=Depends(require_admin)):
+    return await usage_rollup(days)
+
+
+# -----------------------------
+# 12) TRACE EXPORTER STATS
+# -----------------------------
+@router.get("/tracing")
+def get_tracing_stats(user=Depends(require_admin)):
+    return tracing_stats()
+
+
+# -----------------------------
+# 13) QUERY RESULT CACHE
+# -----------------------------
+@router.get("/result-cache")
+def get_result_cache_stats(user=Depends(require_admin)):
+    return result_cache_stats()
+
+
+@router.post("/result-cache/invalidate")
+def invalidate_result_cache(user=Depends(require_admin)):
+    """Drop cached query results in this worker, e.g. right after a data load."""
+    bump_data_version()
+    return {"success": True, **result_cache_stats()}
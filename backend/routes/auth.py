@@ -1,14 +1,19 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-from utils.db import get_connection as get_db
+from utils.db import get_db
+from utils.async_db import async_connection
 import bcrypt
 import jwt
 from datetime import datetime, timedelta
 import os
 from psycopg2.extras import RealDictCursor
+from psycopg2.errors import UniqueViolation
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import random
-from utils.encryption import encrypt_text, decrypt_text
+from utils.encryption import encrypt_text, decrypt_text, decrypt_rows, email_blind_index
+from services.auth_service.auth_service import (
+    lookup_user_by_email, PRINCIPAL_CACHE, principal_cache_key, invalidate_principal
+)
 router = APIRouter()
 
 # JWT Configuration - Use environment variable in production
@@ -80,7 +85,7 @@ def decode_jwt(token: str):
 # ========================
 # Dependency Functions
 # ========================
-def require_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme), db=Depends(get_db)):
+async def require_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
     """Protect routes that require authentication"""
     payload = decode_jwt(credentials.credentials)
     user_id = payload.get("user_id")
@@ -88,26 +93,29 @@ def require_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_sche
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token payload")
     
-    # Fetch user from database - use RealDictCursor
-    cur = db.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT id, name, email, role FROM users WHERE id=%s", (user_id,))
-    row = cur.fetchone()
-    cur.close()
+    # Verified principals are cached briefly; a hit needs no DB connection
+    cache_key = principal_cache_key(user_id)
+    user = await PRINCIPAL_CACHE.aget(cache_key)
+    if user is not None:
+        return dict(user)
+
+    async with async_connection() as db:
+        row = await db.fetchrow("SELECT id, name, email, role FROM users WHERE id=$1", user_id)
     
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {
+    user = {
         "id": row["id"],
         "name": row["name"],
         "email": row["email"],
         "role": row["role"]
     }
+    await PRINCIPAL_CACHE.aset(cache_key, user)
+    return dict(user)
 
-def require_admin(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme), db=Depends(get_db)):
+async def require_admin(user: dict = Depends(require_user)):
     """Protect admin-only routes"""
-    user = require_user(credentials, db)
-    
     if user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Admin access only")
     
@@ -119,9 +127,8 @@ def require_admin(credentials: HTTPAuthorizationCredentials = Depends(bearer_sch
 @router.post("/signup")
 def signup(data: SignupModel, db=Depends(get_db)):
     cur = db.cursor(cursor_factory=RealDictCursor)
-    # Check email
-    cur.execute("SELECT id FROM users WHERE email=%s", (data.email,))
-    if cur.fetchone():
+    # Check email (indexed lookup on the blind index)
+    if lookup_user_by_email(cur, data.email, columns="id, email"):
         cur.close()
         raise HTTPException(status_code=400, detail="Email already exists")
 
@@ -131,9 +138,15 @@ def signup(data: SignupModel, db=Depends(get_db)):
     # Pick avatar emoji
     avatar = pick_random_emoji()
 
-    cur.execute("INSERT INTO users (name, email, password_hash, bio) VALUES (%s, %s, %s, %s) RETURNING id",
-        (data.name, encrypt_text(data.email), hashed, "")
-    )   
+    try:
+        cur.execute("INSERT INTO users (name, email, email_hash, password_hash, bio) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+            (data.name, encrypt_text(data.email), email_blind_index(data.email), hashed, "")
+        )
+    except UniqueViolation:
+        # Lost a race with a concurrent signup for the same address
+        db.rollback()
+        cur.close()
+        raise HTTPException(status_code=400, detail="Email already exists")
 
     row = cur.fetchone()
     db.commit()
@@ -150,22 +163,10 @@ def login(data: LoginModel, db=Depends(get_db)):
     """Authenticate user and return JWT token"""
     cur = db.cursor(cursor_factory=RealDictCursor)
 
-    # Fetch ALL users since email is encrypted
-    cur.execute("SELECT id, password_hash, name, email, role FROM users")
-    users = cur.fetchall()
-    
-    # Find user by decrypting each email
-    row = None
-    for user in users:
-        try:
-            decrypted_email = decrypt_text(user["email"])
-            if decrypted_email == data.email:
-                row = user
-                break
-        except Exception:
-            # Skip users with invalid encryption
-            continue
-    
+    # Single indexed lookup via the email blind index
+    row = lookup_user_by_email(cur, data.email)
+    cur.close()
+
     if not row:
         raise HTTPException(status_code=400, detail="Invalid email or password")
 
@@ -204,9 +205,7 @@ def get_profile(user = Depends(require_user), db=Depends(get_db)):
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
     else:
-        row["email"] = decrypt_text(row["email"])
-        if row["bio"]:
-            row["bio"] = decrypt_text(row["bio"])
+        decrypt_rows([row], ["email", "bio"])
     
     return row
 
@@ -248,5 +247,6 @@ def update_profile(
         cur.execute("UPDATE users SET bio=%s WHERE id=%s", (encrypted_bio, user_id))
 
     db.commit()
+    invalidate_principal(user_id)
 
     return {"success": True, "message": "Profile updated"}
\ No newline at end of file
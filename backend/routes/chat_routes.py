@@ -1,15 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
-from utils.db import get_connection as get_db
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
+from utils.db import get_db
 from psycopg2.extras import RealDictCursor
 from routes.auth import require_user
 from fastapi.security import HTTPBearer
+from utils.pagination import (
+    NEXT_CURSOR_HEADER, clamp_limit, decode_cursor, parse_fields, split_page,
+)
 
 # AES Encryption
-from utils.encryption import encrypt_text, decrypt_text
+from utils.timing import stage
+from utils.tracing import span
+from utils.encryption import encrypt_text, encrypt_many, decrypt_rows
 
 router = APIRouter()
 bearer_scheme = HTTPBearer()
 
+# Selectable columns; id and the sort timestamp are always returned
+CHAT_FIELDS = ("title", "updated_at")
+MESSAGE_FIELDS = ("user_message", "ai_response", "raw_sql", "final_sql")
+ENCRYPTED_CHAT_FIELDS = {"title"}
+
 
 # ----------------------------
 # CREATE NEW CHAT
@@ -34,55 +45,114 @@ def create_chat(user=Depends(require_user), db=Depends(get_db)):
 # LIST CHATS
 # ----------------------------
 @router.get("/chats/list")
-def get_chats(user=Depends(require_user), db=Depends(get_db)):
-    cur = db.cursor(cursor_factory=RealDictCursor)
+def get_chats(
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user=Depends(require_user),
+    db=Depends(get_db),
+):
+    """
+    Most recently updated chats first; all of them unless `limit` or
+    `cursor` is given. Pass the X-Next-Cursor header of a response back as
+    `cursor` for the next page; `fields=title` skips updated_at in the output.
+    """
+    limit = clamp_limit(limit, cursor)
+    selected = parse_fields(fields, CHAT_FIELDS, CHAT_FIELDS)
+
+    query = "SELECT id, updated_at" + (", title" if "title" in selected else "") + " FROM chats WHERE user_id=%s"
+    params = [user["id"]]
+    if cursor:
+        query += " AND (updated_at, id) < (%s, %s)"
+        params.extend(decode_cursor(cursor))
+    query += " ORDER BY updated_at DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit + 1)
 
-    cur.execute(
-        "SELECT id, title, updated_at FROM chats WHERE user_id=%s ORDER BY updated_at DESC",
-        (user["id"],)
-    )
-    rows = cur.fetchall()
+    cur = db.cursor(cursor_factory=RealDictCursor)
+    cur.execute(query, params)
+    rows, next_cursor = split_page(cur.fetchall(), limit, "updated_at")
+    cur.close()
 
-    # Decrypt chat titles
-    for r in rows:
-        if r["title"]:
-            try:
-                r["title"] = decrypt_text(r["title"])
-            except Exception:
-                # If decryption fails, keep plaintext title
-                pass
+    decrypt_rows(rows, ENCRYPTED_CHAT_FIELDS.intersection(selected))
+    if "updated_at" not in selected:
+        for r in rows:
+            del r["updated_at"]
 
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return rows
 
 
 # ----------------------------
 # SAVE MESSAGE (NL-to-SQL)
 # ----------------------------
+def _message_bytes(values):
+    return sum(len(v) for v in values if v)
+
+
 def save_message(chat_id, user_msg, ai_msg, raw_sql, final_sql, db):
-    cur = db.cursor()
+    with span("chat.save_message", chat_id=chat_id) as s:
+        cur = db.cursor()
 
-    enc_user_msg = encrypt_text(user_msg)
-    enc_ai_msg = encrypt_text(ai_msg)
-    enc_raw = encrypt_text(raw_sql)
-    enc_final = encrypt_text(final_sql)
+        encrypted = encrypt_many([user_msg, ai_msg, raw_sql, final_sql])
+        enc_user_msg, enc_ai_msg, enc_raw, enc_final = encrypted
+        s.set(bytes=_message_bytes(encrypted))
 
-    cur.execute(
-        """
-        INSERT INTO chat_messages (chat_id, user_message, ai_response, raw_sql, final_sql)
-        VALUES (%s, %s, %s, %s, %s)
-        """,
-        (chat_id, enc_user_msg, enc_ai_msg, enc_raw, enc_final)
-    )
+        cur.execute(
+            """
+            INSERT INTO chat_messages (chat_id, user_message, ai_response, raw_sql, final_sql)
+            VALUES (%s, %s, %s, %s, %s)
+            """,
+            (chat_id, enc_user_msg, enc_ai_msg, enc_raw, enc_final)
+        )
 
-    cur.execute("UPDATE chats SET updated_at = NOW() WHERE id=%s", (chat_id,))
-    db.commit()
+        cur.execute("UPDATE chats SET updated_at = NOW() WHERE id=%s", (chat_id,))
+        db.commit()
+
+
+async def save_message_async(chat_id, user_msg, ai_msg, raw_sql, final_sql, db):
+    """asyncpg variant of save_message used by the async /nl-to-sql path."""
+    with span("chat.save_message", chat_id=chat_id) as s:
+        with stage("encryption"):
+            encrypted = encrypt_many([user_msg, ai_msg, raw_sql, final_sql])
+            enc_user_msg, enc_ai_msg, enc_raw, enc_final = encrypted
+        s.set(bytes=_message_bytes(encrypted))
+
+        async with db.transaction():
+            await db.execute(
+                """
+                INSERT INTO chat_messages (chat_id, user_message, ai_response, raw_sql, final_sql)
+                VALUES ($1, $2, $3, $4, $5)
+                """,
+                chat_id, enc_user_msg, enc_ai_msg, enc_raw, enc_final
+            )
+
+            await db.execute("UPDATE chats SET updated_at = NOW() WHERE id=$1", chat_id)
 
 
 # ----------------------------
 # GET MESSAGES FOR A CHAT
 # ----------------------------
 @router.get("/chats/{chat_id}/messages")
-def get_chat_messages(chat_id: int, user=Depends(require_user), db=Depends(get_db)):
+def get_chat_messages(
+    chat_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user=Depends(require_user),
+    db=Depends(get_db),
+):
+    """
+    The newest `limit` messages (all of them without `limit` or `cursor`),
+    oldest first. `next_cursor` pages back to older messages;
+    `fields=user_message` returns just the prompts.
+    """
+    limit = clamp_limit(limit, cursor)
+    selected = parse_fields(fields, MESSAGE_FIELDS, MESSAGE_FIELDS)
+
     cur = db.cursor(cursor_factory=RealDictCursor)
 
     # Verify chat belongs to user
@@ -92,53 +162,30 @@ def get_chat_messages(chat_id: int, user=Depends(require_user), db=Depends(get_d
     if not chat_row:
         raise HTTPException(404, "Chat not found")
 
-    # Decrypt chat title
-    try:
-        chat_row["title"] = decrypt_text(chat_row["title"])
-    except Exception:
-        pass
+    decrypt_rows([chat_row], ["title"])
+
+    # Fetch one page of messages, newest first
+    query = "SELECT " + ", ".join(["id", *selected, "created_at"]) + " FROM chat_messages WHERE chat_id=%s"
+    params = [chat_id]
+    if cursor:
+        query += " AND (created_at, id) < (%s, %s)"
+        params.extend(decode_cursor(cursor))
+    query += " ORDER BY created_at DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+
+    cur.execute(query, params)
+    rows, next_cursor = split_page(cur.fetchall(), limit, "created_at")
+    cur.close()
 
-    # Fetch messages
-    cur.execute(
-        """
-        SELECT id, user_message, ai_response, raw_sql, final_sql, created_at
-        FROM chat_messages
-        WHERE chat_id=%s
-        ORDER BY created_at ASC
-        """,
-        (chat_id,)
-    )
-    rows = cur.fetchall()
-    # print(rows)
-
-    # Decrypt every message field
-    for msg in rows:
-        if msg["user_message"]:
-            try:
-                msg["user_message"] = decrypt_text(msg["user_message"])
-            except Exception:
-                pass
-        if msg["ai_response"]:
-            try:
-                msg["ai_response"] = decrypt_text(msg["ai_response"])
-            except Exception:
-                pass
-        if msg["raw_sql"]:
-            try:
-                msg["raw_sql"] = decrypt_text(msg["raw_sql"])
-            except Exception:
-                pass
-        if msg["final_sql"]:
-            try:
-                msg["final_sql"] = decrypt_text(msg["final_sql"])
-            except Exception:
-                pass
-        
-    print(rows)
+    rows.reverse()
+    decrypt_rows(rows, selected)
 
     return {
         "chat": chat_row,
-        "messages": rows
+        "messages": rows,
+        "next_cursor": next_cursor,
     }
 
 
@@ -149,16 +196,14 @@ def get_chat_messages(chat_id: int, user=Depends(require_user), db=Depends(get_d
 def delete_chat(chat_id: int, user = Depends(require_user), db=Depends(get_db)):
     cur = db.cursor()
 
-    # Ensure the chat belongs to the user
-    cur.execute("SELECT id FROM chats WHERE id = %s AND user_id = %s", (chat_id, user["id"]))
+    # Only the owner's chat matches; messages go with it (ON DELETE CASCADE)
+    cur.execute("DELETE FROM chats WHERE id = %s AND user_id = %s RETURNING id", (chat_id, user["id"]))
     if not cur.fetchone():
+        db.rollback()
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    # Delete messages first due to FK constraints
-    cur.execute("DELETE FROM chat_messages WHERE chat_id = %s", (chat_id,))
-    cur.execute("DELETE FROM chats WHERE id = %s", (chat_id,))
-    
     db.commit()
     cur.close()
 
-    return {"success": True, "deleted_chat": chat_id}
\ No newline at end of file
+    return {"success": True, "deleted_chat": chat_id}
+
@@ -0,0 +1,104 @@
+import os
+import hmac
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+
+from utils.metrics import CONTENT_TYPE, register_collector, render
+from utils.cache import cache_stats
+from utils import db
+from utils.async_db import async_pool_stats
+from utils.rate_limiter import rate_limit_stats
+from services.llm_telemetry import telemetry_stats
+from services.stats_service import stats_flusher_stats
+from utils.tracing import tracing_stats
+
+router = APIRouter(tags=["Metrics"])
+
+# Optional bearer token for scrapers; /metrics is open when unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+# -----------------------------
+# SCRAPE-TIME COLLECTORS
+# -----------------------------
+def _cache_metrics():
+    lookups, evictions, entries, nbytes = [], [], [], []
+    for name, stats in cache_stats().items():
+        local = stats["local"]
+        lookups.append(({"cache": name, "tier": "local", "result": "hit"}, local["hits"]))
+        lookups.append(({"cache": name, "tier": "local", "result": "miss"}, local["misses"]))
+        evictions.append(({"cache": name}, local["evictions"]))
+        entries.append(({"cache": name}, local["entries"]))
+        nbytes.append(({"cache": name}, local["bytes"]))
+        shared = stats.get("shared")
+        if shared:
+            lookups.append(({"cache": name, "tier": "shared", "result": "hit"}, shared["hits"]))
+            lookups.append(({"cache": name, "tier": "shared", "result": "miss"}, shared["misses"]))
+
+    yield "promptsmith_cache_lookups_total", "counter", "Cache lookups by cache, tier and result", lookups
+    yield "promptsmith_cache_evictions_total", "counter", "Entries evicted to stay within bounds", evictions
+    yield "promptsmith_cache_entries", "gauge", "Entries held in the local tier", entries
+    yield "promptsmith_cache_bytes", "gauge", "Approximate bytes held in the local tier", nbytes
+
+
+def _pool_metrics():
+    # Don't open a pool just to report on it
+    pools = {}
+    if db._pool is not None:
+        pools["sync"] = db.pool_stats()
+    async_stats = async_pool_stats()
+    if async_stats is not None:
+        pools["async"] = async_stats
+
+    yield "promptsmith_db_connections", "gauge", "Pooled DB connections by state", [
+        ({"pool": pool, "state": state}, stats[state])
+        for pool, stats in pools.items()
+        for state in ("idle", "in_use")
+    ]
+    yield "promptsmith_db_pool_waiting", "gauge", "Callers waiting for a connection", [
+        ({"pool": pool}, stats["waiting"]) for pool, stats in pools.items() if "waiting" in stats
+    ]
+
+
+def _background_metrics():
+    limiter = rate_limit_stats()
+    telemetry = telemetry_stats()
+    flusher = stats_flusher_stats()
+    tracing = tracing_stats()
+
+    yield "promptsmith_rate_limit_keys", "gauge", "Keys tracked by the rate limiter", [
+        ({}, limiter.get("keys"))
+    ]
+    yield "promptsmith_llm_telemetry_buffered", "gauge", "LLM usage records waiting to be written", [
+        ({}, telemetry["buffered"])
+    ]
+    yield "promptsmith_llm_telemetry_dropped_total", "counter", "LLM usage records dropped on overflow", [
+        ({}, telemetry["dropped"])
+    ]
+    yield "promptsmith_stats_pending_events", "gauge", "Analytics events not yet flushed", [
+        ({}, flusher["pending_events"])
+    ]
+    yield "promptsmith_traces_exported_total", "counter", "Request traces written to the trace file", [
+        ({}, tracing["exported"])
+    ]
+    yield "promptsmith_traces_dropped_total", "counter", "Kept traces dropped because the exporter fell behind", [
+        ({}, tracing["dropped"])
+    ]
+
+
+register_collector(_cache_metrics)
+register_collector(_pool_metrics)
+register_collector(_background_metrics)
+
+
+# -----------------------------
+# PROMETHEUS ENDPOINT
+# -----------------------------
+@router.get("/metrics")
+def metrics(request: Request):
+    if METRICS_TOKEN:
+        supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied, METRICS_TOKEN):
+            raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(render(), media_type=CONTENT_TYPE)
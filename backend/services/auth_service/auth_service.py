@@ -1,5 +1,33 @@
+import os
 import bcrypt
-from utils.db import get_connection
+import psycopg2
+from psycopg2.extras import execute_values
+from utils.db import connection
+from utils.cache import build_cache
+from utils.migrations import apply_migrations
+from utils.encryption import encrypt_text, decrypt_many, email_blind_index, normalize_email
+
+USER_LOGIN_COLUMNS = "id, password_hash, name, email, role"
+
+# Verified principals (id, name, email, role) by user id, so authenticated
+# requests skip the users lookup. Entries are dropped on profile updates,
+# deletions and role changes in this worker; other workers pick the change
+# up within AUTH_CACHE_TTL_SEC.
+PRINCIPAL_CACHE = build_cache(
+    "principals",
+    max_entries=int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.getenv("AUTH_CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+    ttl=float(os.getenv("AUTH_CACHE_TTL_SEC", "30")),
+    backend=os.getenv("AUTH_CACHE_BACKEND", "memory"),
+)
+
+
+def principal_cache_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def invalidate_principal(user_id: int):
+    PRINCIPAL_CACHE.delete(principal_cache_key(user_id))
 
 # ---------------------
 # PASSWORD HASHING
@@ -15,52 +43,185 @@ def check_password(password: str, hashed: str) -> bool:
 # DATABASE HELPERS
 # ---------------------
 
+def lookup_user_by_email(cur, email: str, columns: str = USER_LOGIN_COLUMNS):
+    """
+    Single indexed lookup on users.email_hash.
+    Rows written before the blind index existed are matched by decrypting
+    only those rows, and get their hash filled in on the way.
+    """
+    email_hash = email_blind_index(email)
+
+    cur.execute(f"SELECT {columns} FROM users WHERE email_hash=%s", (email_hash,))
+    row = cur.fetchone()
+    if row:
+        return row
+
+    cur.execute(f"SELECT {columns} FROM users WHERE email_hash IS NULL")
+    target = normalize_email(email)
+    rows = cur.fetchall()
+    for user, plain in zip(rows, decrypt_many([r["email"] for r in rows], fallback=False)):
+        # Skip users with invalid encryption
+        if plain is None or normalize_email(plain) != target:
+            continue
+
+        try:
+            cur.execute("UPDATE users SET email_hash=%s WHERE id=%s", (email_hash, user["id"]))
+            cur.connection.commit()
+        except psycopg2.errors.UniqueViolation:
+            # Another row holds the same email in a different case; leave
+            # this one unindexed (backfill_email_index reports it)
+            cur.connection.rollback()
+        return user
+
+    return None
+
 def find_user_by_email(email: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email=%s", (email,))
-    return cur.fetchone()
+    with connection() as conn:
+        cur = conn.cursor()
+        return lookup_user_by_email(cur, email, columns="*")
 
 def create_user(name: str, email: str, password: str):
-    conn = get_connection()
-    cur = conn.cursor()
-
     hashed = hash_password(password)
 
-    cur.execute(
-        """
-        INSERT INTO users (name, email, password_hash)
-        VALUES (%s, %s, %s)
-        RETURNING id, name, email, role;
-        """,
-        (name, email, hashed)
-    )
+    with connection() as conn:
+        cur = conn.cursor()
 
-    conn.commit()
-    return cur.fetchone()
+        cur.execute(
+            """
+            INSERT INTO users (name, email, email_hash, password_hash)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id, name, email, role;
+            """,
+            (name, encrypt_text(email), email_blind_index(email), hashed)
+        )
+
+        row = cur.fetchone()
+        conn.commit()
+        return row
 
 def update_profile(user_id: int, name: str, bio: str, profile_image: str):
-    conn = get_connection()
-    cur = conn.cursor()
+    with connection() as conn:
+        cur = conn.cursor()
+
+        cur.execute("""
+            UPDATE users
+            SET name=%s, bio=%s, profile_image=%s
+            WHERE id=%s
+            RETURNING id, email, name, role, bio, profile_image;
+        """, (name, bio, profile_image, user_id))
+
+        row = cur.fetchone()
+        conn.commit()
+        invalidate_principal(user_id)
+        return row
 
-    cur.execute("""
-        UPDATE users
-        SET name=%s, bio=%s, profile_image=%s
-        WHERE id=%s
-        RETURNING id, email, name, role, bio, profile_image;
-    """, (name, bio, profile_image, user_id))
+def set_user_role(user_id: int, role: str):
+    with connection() as conn:
+        cur = conn.cursor()
 
-    conn.commit()
-    return cur.fetchone()
+        cur.execute("UPDATE users SET role=%s WHERE id=%s RETURNING id, role;", (role, user_id))
+
+        row = cur.fetchone()
+        conn.commit()
+        invalidate_principal(user_id)
+        return row
 
 def get_profile(user_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
+    with connection() as conn:
+        cur = conn.cursor()
+
+        cur.execute("""
+            SELECT id, email, name, role, bio, profile_image, created_at
+            FROM users
+            WHERE id=%s;
+        """, (user_id,))
+
+        return cur.fetchone()
+
+
+# ---------------------
+# EMAIL BLIND INDEX MAINTENANCE
+# ---------------------
+
+def backfill_email_index(batch_size: int = 1000):
+    """
+    Fill users.email_hash for rows that only have the encrypted email.
+    Walks the table by id in batches so it can run against a live database.
+
+    Accounts whose emails differ only in case share a hash; only the first
+    one (lowest id, or the one already indexed) gets it. The others are
+    left unindexed and reported in "duplicates" for manual merging.
+    """
+    updated = 0
+    skipped = 0
+    duplicates = []
+    last_id = 0
+
+    while True:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT id, email FROM users
+                WHERE email_hash IS NULL AND id > %s
+                ORDER BY id
+                LIMIT %s
+                """,
+                (last_id, batch_size)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            # One row per hash within the batch
+            params = {}
+            for r, plain in zip(rows, decrypt_many([r["email"] for r in rows], fallback=False)):
+                if plain is None:
+                    skipped += 1
+                    continue
+                email_hash = email_blind_index(plain)
+                if email_hash in params.values():
+                    duplicates.append(r["id"])
+                    continue
+                params[r["id"]] = email_hash
+
+            for attempt in range(3):
+                try:
+                    done = execute_values(
+                        cur,
+                        """
+                        UPDATE users u SET email_hash = v.hash
+                        FROM (VALUES %s) AS v(id, hash)
+                        WHERE u.id = v.id AND u.email_hash IS NULL
+                          AND NOT EXISTS (SELECT 1 FROM users d WHERE d.email_hash = v.hash)
+                        RETURNING u.id
+                        """,
+                        list(params.items()),
+                        fetch=True
+                    ) if params else []
+                    done_ids = {r["id"] for r in done}
+                    missed = [user_id for user_id in params if user_id not in done_ids]
+                    if missed:
+                        # Not updated and still unindexed: the hash belongs to another account
+                        cur.execute("SELECT id FROM users WHERE id = ANY(%s) AND email_hash IS NULL", (missed,))
+                        duplicates.extend(r["id"] for r in cur.fetchall())
+                    conn.commit()
+                    break
+                except psycopg2.errors.UniqueViolation:
+                    # A concurrent login indexed one of these emails; retry
+                    # so NOT EXISTS sees it
+                    conn.rollback()
+            else:
+                raise RuntimeError("email_hash backfill kept conflicting with concurrent updates")
+            cur.close()
+
+        updated += len(done_ids)
+        last_id = rows[-1]["id"]
+
+    return {"updated": updated, "skipped": skipped, "duplicates": duplicates}
 
-    cur.execute("""
-        SELECT id, email, name, role, bio, profile_image, created_at
-        FROM users
-        WHERE id=%s;
-    """, (user_id,))
 
-    return cur.fetchone()
+if __name__ == "__main__":
+    # python -m services.auth_service.auth_service  (run from backend/)
+    apply_migrations()
+    print(backfill_email_index())
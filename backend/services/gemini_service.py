@@ -1,27 +1,32 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+from services.llm_providers import generate, agenerate
+from services.llm_telemetry import llm_operation
 
-load_dotenv()
+# Prompt construction for SQL rewrites. The backend that answers is chosen
+# by `model` (a provider spec, see services/llm_providers.py).
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-genai.configure(api_key=GEMINI_API_KEY)
-
-MODEL_NAME = "gemini-2.5-flash"
-
-
-def generate_sql_rewrite(sql: str, instruction: str) -> str:
-    prompt = (
+def build_rewrite_prompt(sql: str, instruction: str) -> str:
+    return (
         f"{instruction}\n\n"
         f"Rewrite this SQL:\n{sql}\n\n"
         "Output only the rewritten SQL. No explanation."
     )
 
-    model = genai.GenerativeModel(MODEL_NAME)
 
-    response = model.generate_content(prompt)
+def generate_sql_rewrite(sql: str, instruction: str, model: str = None) -> str:
+    prompt = build_rewrite_prompt(sql, instruction)
+
+    with llm_operation("rewrite"):
+        rewritten = generate(prompt, model).strip()
+
+    return rewritten
+
+
+async def generate_sql_rewrite_async(sql: str, instruction: str, model: str = None) -> str:
+    """Non-blocking variant: awaits the provider instead of holding a worker thread."""
+    prompt = build_rewrite_prompt(sql, instruction)
 
-    rewritten = response.text.strip()
+    with llm_operation("rewrite"):
+        rewritten = (await agenerate(prompt, model)).strip()
 
     return rewritten
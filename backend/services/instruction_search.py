@@ -78,32 +78,248 @@
 
 
 """
-Lightweight instruction selector.
-You can expand this later, but this avoids import errors.
+Instruction selection and search.
+
+find_best_instruction is the cheap default used on every rewrite.
+search_instructions is the /find-instruction engine: it rewrites the query
+with several candidate instructions concurrently, executes the original SQL
+once and checks each candidate against that result, and ranks the
+equivalent candidates by measured speed. Speed comes from EXPLAIN ANALYZE
+runs (plan_service.time_plan): the original is timed once, right after its
+reference run, and each equivalent candidate right after its verification
+run, one candidate at a time, so both sides are timed warm and without
+competing timing runs. The search stops early once a candidate is clearly
+faster, or when its time budget runs out.
 """
+import os
+import time
+import asyncio
+
+from services.cleaner import clean_sql_output
+from services.gemini_service import generate_sql_rewrite_async
+from utils.sql_executor import stream_sql_async
+from utils.correctness import (
+    OrderedDigest, is_order_sensitive, compare_to_ordered_digest_async, digest_stream_async, digest_verdict
+)
+from services.plan_service import time_plan, compare_timings, accept_rewrite
+
+SEARCH_CONCURRENCY = int(os.getenv("INSTRUCTION_SEARCH_CONCURRENCY", "4"))
+SEARCH_BUDGET_SEC = float(os.getenv("INSTRUCTION_SEARCH_BUDGET_SEC", "45"))
+# An equivalent candidate at least this much faster ends the search
+SEARCH_WIN_SPEEDUP = float(os.getenv("INSTRUCTION_SEARCH_WIN_SPEEDUP", "1.5"))
+# EXPLAIN ANALYZE timing runs for the original and each equivalent candidate
+SEARCH_TIMING_RUNS = int(os.getenv("INSTRUCTION_SEARCH_TIMING_RUNS", "3"))
+
+DEFAULT_INSTRUCTION = (
+    "You are a SQL query optimizer. Rewrite the input SQL to improve performance "
+    "and readability while preserving identical results.\n\n"
+    "You MAY apply only the following transformations:\n"
+    "• Remove unnecessary subqueries and CTEs\n"
+    "• Reorder JOINs (join smaller or more selective tables first)\n"
+    "• Convert NOT IN to NOT EXISTS or LEFT JOIN when equivalent\n"
+    "• Push down WHERE filters as early as possible\n"
+    "• Remove redundant DISTINCT or GROUP BY clauses\n"
+    "• Add reasonable index or optimizer hints if clearly beneficial\n"
+    "• Simplify redundant expressions and CASE statements\n"
+    "• Reformat the query for clear, consistent style\n\n"
+    "You MUST NOT:\n"
+    "• Change column names, aliases, or returned columns\n"
+    "• Change filter conditions, join conditions, or business logic\n"
+    "• Change the result set, ordering, or limit semantics\n"
+    "• Introduce dialect-specific features not present in the input\n\n"
+    "If you cannot safely optimize without risking different results, "
+    "return the original SQL unchanged.\n\n"
+    "Output ONLY the optimized SQL query, with no explanation or commentary."
+)
+
+# Candidates in the order they are tried; `attempts` takes a prefix
+INSTRUCTIONS = [
+    DEFAULT_INSTRUCTION,
+    "Rewrite the SQL to improve performance. Preserve all column aliases.",
+    "Rewrite the SQL minimizing subqueries. Preserve results.",
+    "Optimize joins and filtering. Output only the rewritten SQL.",
+    "Rewrite the SQL using index-friendly operations. Keep output identical.",
+    "Rewrite the SQL with strict alias preservation and no aggregate simplification.",
+    "Rewrite the SQL for readability. Do not change column names.",
+    "Rewrite for ANSI SQL compliance. Preserve aliases.",
+    "Standardize formatting and spacing. Do NOT modify logic.",
+]
+
 
 def find_best_instruction(model: str, query: str):
     return {
-        "instruction": (
-            "You are a SQL query optimizer. Rewrite the input SQL to improve performance "
-            "and readability while preserving identical results.\n\n"
-            "You MAY apply only the following transformations:\n"
-            "• Remove unnecessary subqueries and CTEs\n"
-            "• Reorder JOINs (join smaller or more selective tables first)\n"
-            "• Convert NOT IN to NOT EXISTS or LEFT JOIN when equivalent\n"
-            "• Push down WHERE filters as early as possible\n"
-            "• Remove redundant DISTINCT or GROUP BY clauses\n"
-            "• Add reasonable index or optimizer hints if clearly beneficial\n"
-            "• Simplify redundant expressions and CASE statements\n"
-            "• Reformat the query for clear, consistent style\n\n"
-            "You MUST NOT:\n"
-            "• Change column names, aliases, or returned columns\n"
-            "• Change filter conditions, join conditions, or business logic\n"
-            "• Change the result set, ordering, or limit semantics\n"
-            "• Introduce dialect-specific features not present in the input\n\n"
-            "If you cannot safely optimize without risking different results, "
-            "return the original SQL unchanged.\n\n"
-            "Output ONLY the optimized SQL query, with no explanation or commentary."
-            ),
+        "instruction": DEFAULT_INSTRUCTION,
         "reason": "Performance optimization"
-    }
\ No newline at end of file
+    }
+
+
+async def _execute_original(sql: str):
+    """Run the original once; keep its per-row hashes (ordered) or multiset digest (unordered)."""
+    ordered = is_order_sensitive(sql)
+    start = time.perf_counter()
+    stream = stream_sql_async(sql)
+    try:
+        await anext(stream)
+        if ordered:
+            reference = OrderedDigest()
+            async for row in stream:
+                reference.add(row)
+        else:
+            reference = await digest_stream_async(stream)
+    finally:
+        await stream.aclose()
+    return ordered, reference, (time.perf_counter() - start) * 1000
+
+
+async def _evaluate(candidate, model, sql, ordered, reference, original_timing, timing_lock):
+    """LLM rewrite, one execution checked against the original's result, then timing."""
+    instruction = candidate["instruction"]
+    start = time.perf_counter()
+    try:
+        rewritten = clean_sql_output(await generate_sql_rewrite_async(sql, instruction, model))
+    except Exception as e:
+        candidate.update(status="error", reason=f"LLM error: {e}")
+        return candidate
+    candidate["llm_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    candidate["rewritten_sql"] = rewritten
+
+    start = time.perf_counter()
+    stream = stream_sql_async(rewritten)
+    try:
+        await anext(stream)
+        if ordered:
+            comparison = await compare_to_ordered_digest_async(reference, stream)
+        else:
+            comparison = digest_verdict(reference, await digest_stream_async(stream))
+    except Exception as e:
+        candidate.update(status="error", reason=f"Rewritten SQL failed: {e}")
+        return candidate
+    finally:
+        await stream.aclose()
+    execution_ms = (time.perf_counter() - start) * 1000
+
+    outcome = {
+        "valid": comparison["valid"],
+        "reason": comparison["reason"],
+        "execution_ms": round(execution_ms, 3),
+    }
+    if comparison["valid"] and original_timing is not None:
+        # The verification run above is cold and overlaps other candidates;
+        # it serves as the warm-up, and timing runs go one candidate at a time
+        try:
+            async with timing_lock:
+                timing = await time_plan(rewritten, runs=SEARCH_TIMING_RUNS, warmup=False)
+        except Exception as e:
+            outcome["timing_error"] = str(e)
+        else:
+            performance = compare_timings(original_timing, timing)
+            speedup = performance["speedup"]
+            outcome["original_ms"] = performance["original_ms"]["median"]
+            outcome["rewritten_ms"] = performance["rewritten_ms"]["median"]
+            if speedup:
+                outcome["speedup"] = speedup["speedup"]
+                outcome["speedup_interval"] = [speedup["lower"], speedup["upper"]]
+            # Same bar as /rewrite-sql: equivalent and not slower
+            outcome["accepted"], outcome["decision"] = accept_rewrite(performance)
+
+    candidate.update(status="done", **outcome)
+    return candidate
+
+
+def _rank(candidate):
+    return (candidate.get("accepted", False), candidate.get("valid", False), candidate.get("speedup") or 0.0)
+
+
+async def search_instructions(sql: str, model: str = None, attempts: int = 3,
+                              concurrency: int = SEARCH_CONCURRENCY,
+                              budget_sec: float = SEARCH_BUDGET_SEC,
+                              win_speedup: float = SEARCH_WIN_SPEEDUP):
+    """
+    Try up to `attempts` instructions concurrently (at most `concurrency`
+    at a time) and return the fastest one that is equivalent and passes
+    plan_service.accept_rewrite; otherwise the default instruction.
+    """
+    started = time.perf_counter()
+    deadline = started + budget_sec
+
+    try:
+        ordered, reference, original_ms = await asyncio.wait_for(_execute_original(sql), budget_sec)
+    except asyncio.TimeoutError:
+        return {"success": False, "error": "Original SQL exceeded the search budget",
+                "instruction": DEFAULT_INSTRUCTION}
+    except Exception as e:
+        return {"success": False, "error": f"Original SQL failed: {e}",
+                "instruction": DEFAULT_INSTRUCTION}
+
+    # The reference run just warmed the original's data
+    original_timing = None
+    timing_error = None
+    try:
+        original_timing = await asyncio.wait_for(
+            time_plan(sql, runs=SEARCH_TIMING_RUNS, warmup=False),
+            max(0.0, deadline - time.perf_counter())
+        )
+    except Exception as e:
+        timing_error = f"Timing the original failed: {e or type(e).__name__}"
+    timing_lock = asyncio.Lock()
+
+    candidates = [
+        {"instruction": instruction, "status": "pending"}
+        for instruction in INSTRUCTIONS[:max(1, min(attempts, len(INSTRUCTIONS)))]
+    ]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def bounded(candidate):
+        async with semaphore:
+            candidate["status"] = "running"
+            return await _evaluate(candidate, model, sql, ordered, reference, original_timing, timing_lock)
+
+    pending = {asyncio.create_task(bounded(c)) for c in candidates}
+    stopped_early = False
+    budget_exhausted = False
+
+    try:
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                budget_exhausted = True
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if any(t.result().get("accepted")
+                   and (t.result().get("speedup") or 0) >= win_speedup for t in done):
+                stopped_early = True
+                break
+    finally:
+        # Also on cancellation (client gone), so no candidate query keeps running
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+    for candidate in candidates:
+        if candidate["status"] in ("pending", "running"):
+            candidate["status"] = "cancelled"
+
+    best = max(candidates, key=_rank)
+    found = best.get("accepted", False)
+    if found:
+        reason = f"Best of {sum(c['status'] == 'done' for c in candidates)} evaluated candidates"
+    elif best.get("valid"):
+        reason = f"No equivalent candidate was fast enough ({best.get('decision') or best.get('timing_error') or timing_error})"
+    else:
+        reason = "No candidate produced equivalent results"
+
+    return {
+        "success": True,
+        "instruction": best["instruction"] if found else DEFAULT_INSTRUCTION,
+        "rewritten_sql": best.get("rewritten_sql") if found else None,
+        "speedup": best.get("speedup") if found else None,
+        "reason": reason,
+        # First (cold) run of the original, used as the correctness reference
+        "original_ms": round(original_ms, 3),
+        "original_timing_ms": original_timing["median"] if original_timing else None,
+        "timing_error": timing_error,
+        "stopped_early": stopped_early,
+        "budget_exhausted": budget_exhausted,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        "candidates": sorted(candidates, key=_rank, reverse=True),
+    }
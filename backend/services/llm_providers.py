@@ -0,0 +1,368 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import deque
+
+from dotenv import load_dotenv
+
+from utils.tracing import span, annotate
+
+load_dotenv()
+
+# Which backend serves LLM calls when the caller doesn't name one.
+# A model spec is "<provider>" or "<provider>:<model>", e.g. "ollama:llama3".
+DEFAULT_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_TIMEOUT_SEC = float(os.getenv("GEMINI_TIMEOUT_SEC", "60"))
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "sqlcoder:15b")
+OLLAMA_TIMEOUT_SEC = float(os.getenv("OLLAMA_TIMEOUT_SEC", "120"))
+
+# Stub: canned responses (prompt sha256 → text) served in-process, or by a
+# stand-in server at LLM_STUB_URL (see benchmarks/llm_stub_server.py)
+LLM_STUB_URL = os.getenv("LLM_STUB_URL")
+LLM_STUB_RESPONSES = os.getenv("LLM_STUB_RESPONSES")
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "0"))
+LLM_STUB_TIMEOUT_SEC = float(os.getenv("LLM_STUB_TIMEOUT_SEC", "30"))
+
+# Recent call latencies kept per provider for p50/p95
+LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "512"))
+
+
+# Called after every provider call as listener(provider, call), where call
+# holds ms, error, prompt/response sizes and token counts when reported
+_call_listeners = []
+
+
+class LLMTimeout(Exception):
+    """The provider did not answer within its timeout."""
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+def token_usage(prompt_tokens=None, completion_tokens=None):
+    if prompt_tokens is None and completion_tokens is None:
+        return None
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+
+class LLMProvider:
+    """
+    One long-lived client per backend. Subclasses implement _generate and
+    _agenerate, returning (text, token_usage or None); generate/agenerate
+    add timeouts and latency accounting.
+    """
+
+    name = "base"
+
+    def __init__(self, model=None, timeout=60.0):
+        self.model = model
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+        self.last_ms = None
+
+    def _record(self, start, error=None, prompt="", text=None, usage=None):
+        ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.calls += 1
+            self.total_ms += ms
+            self.last_ms = ms
+            self._latencies.append(ms)
+            if isinstance(error, LLMTimeout):
+                self.timeouts += 1
+            elif error is not None:
+                self.errors += 1
+
+        if usage:
+            annotate(**usage)
+        if text is not None:
+            annotate(response_chars=len(text))
+
+        if not _call_listeners:
+            return
+        call = {
+            "ms": ms,
+            "error": error,
+            "prompt_chars": len(prompt),
+            "response_chars": len(text) if text is not None else None,
+            "prompt_tokens": usage["prompt_tokens"] if usage else None,
+            "completion_tokens": usage["completion_tokens"] if usage else None,
+        }
+        for listener in _call_listeners:
+            try:
+                listener(self, call)
+            except Exception:
+                # Accounting must never fail the call itself
+                pass
+
+    def _span(self, prompt):
+        return span("llm.call", provider=self.name, model=self.model, prompt_chars=len(prompt))
+
+    def generate(self, prompt: str) -> str:
+        # Listeners run inside the span, so they can annotate it
+        with self._span(prompt):
+            start = time.perf_counter()
+            try:
+                text, usage = self._generate(prompt)
+            except Exception as e:
+                self._record(start, e, prompt)
+                raise
+            self._record(start, None, prompt, text, usage)
+            return text
+
+    async def agenerate(self, prompt: str) -> str:
+        with self._span(prompt):
+            start = time.perf_counter()
+            try:
+                text, usage = await asyncio.wait_for(self._agenerate(prompt), self.timeout)
+            except asyncio.TimeoutError:
+                error = LLMTimeout(f"{self.name} did not respond within {self.timeout}s")
+                self._record(start, error, prompt)
+                raise error
+            except Exception as e:
+                self._record(start, e, prompt)
+                raise
+            self._record(start, None, prompt, text, usage)
+            return text
+
+    def _generate(self, prompt):
+        raise NotImplementedError
+
+    async def _agenerate(self, prompt):
+        # Providers without a native async client run the sync call off the loop
+        return await asyncio.to_thread(self._generate, prompt)
+
+    async def aclose(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            recent = sorted(self._latencies)
+            stats = {
+                "provider": self.name,
+                "model": self.model,
+                "timeout_sec": self.timeout,
+                "calls": self.calls,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else None,
+                "last_ms": round(self.last_ms, 3) if self.last_ms is not None else None,
+            }
+        if recent:
+            stats["p50_ms"] = round(recent[len(recent) // 2], 3)
+            stats["p95_ms"] = round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 3)
+        return stats
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model=None, timeout=GEMINI_TIMEOUT_SEC):
+        import google.generativeai as genai
+
+        super().__init__(model or GEMINI_MODEL, timeout)
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        self._model = genai.GenerativeModel(self.model)
+
+    @staticmethod
+    def _usage(response):
+        meta = getattr(response, "usage_metadata", None)
+        if meta is None:
+            return None
+        return token_usage(getattr(meta, "prompt_token_count", None), getattr(meta, "candidates_token_count", None))
+
+    def _generate(self, prompt):
+        response = self._model.generate_content(prompt, request_options={"timeout": self.timeout})
+        return response.text, self._usage(response)
+
+    async def _agenerate(self, prompt):
+        response = await self._model.generate_content_async(prompt, request_options={"timeout": self.timeout})
+        return response.text, self._usage(response)
+
+
+class OllamaProvider(LLMProvider):
+    name = "ollama"
+
+    def __init__(self, model=None, timeout=OLLAMA_TIMEOUT_SEC, host=OLLAMA_HOST):
+        import ollama
+
+        super().__init__(model or OLLAMA_MODEL, timeout)
+        self.host = host
+        # Each client keeps an HTTP connection pool to the Ollama server
+        self._client = ollama.Client(host=host, timeout=timeout)
+        self._async_client = ollama.AsyncClient(host=host, timeout=timeout)
+
+    @staticmethod
+    def _result(response):
+        try:
+            usage = token_usage(response["prompt_eval_count"], response["eval_count"])
+        except (KeyError, TypeError):
+            usage = None
+        return response["response"], usage
+
+    def _generate(self, prompt):
+        return self._result(self._client.generate(model=self.model, prompt=prompt))
+
+    async def _agenerate(self, prompt):
+        return self._result(await self._async_client.generate(model=self.model, prompt=prompt))
+
+
+class StubProvider(LLMProvider):
+    """
+    Stand-in LLM for load tests and offline runs. Answers from `responses`
+    (prompt sha256 → text), then from `responder(prompt)`, after sleeping
+    latency_ms. With `url`, prompts are sent to a stand-in HTTP server instead.
+    """
+
+    name = "stub"
+
+    def __init__(self, model=None, timeout=LLM_STUB_TIMEOUT_SEC, responses=None,
+                 responder=None, latency_ms=LLM_STUB_LATENCY_MS, url=None):
+        super().__init__(model or "stub", timeout)
+        if isinstance(responses, str):
+            with open(responses) as f:
+                responses = json.load(f)
+        self.responses = responses or {}
+        self.responder = responder
+        self.latency_sec = latency_ms / 1000
+        self.url = url
+
+        self._http = None
+        self._async_http = None
+        if url:
+            import httpx
+
+            self._http = httpx.Client(base_url=url, timeout=timeout)
+            self._async_http = httpx.AsyncClient(base_url=url, timeout=timeout)
+
+    def _answer(self, prompt):
+        text = self.responses.get(prompt_hash(prompt))
+        if text is not None:
+            return text
+        if self.responder is not None:
+            return self.responder(prompt)
+        raise KeyError(f"No stub response for prompt {prompt_hash(prompt)[:12]}")
+
+    def _generate(self, prompt):
+        if self._http is not None:
+            response = self._http.post("/generate", json={"prompt": prompt, "model": self.model})
+            response.raise_for_status()
+            return response.json()["response"], None
+
+        if self.latency_sec:
+            time.sleep(self.latency_sec)
+        return self._answer(prompt), None
+
+    async def _agenerate(self, prompt):
+        if self._async_http is not None:
+            response = await self._async_http.post("/generate", json={"prompt": prompt, "model": self.model})
+            response.raise_for_status()
+            return response.json()["response"], None
+
+        if self.latency_sec:
+            await asyncio.sleep(self.latency_sec)
+        return self._answer(prompt), None
+
+    async def aclose(self):
+        if self._http is not None:
+            self._http.close()
+            await self._async_http.aclose()
+
+
+def _build_stub(model=None):
+    return StubProvider(model, responses=LLM_STUB_RESPONSES, url=LLM_STUB_URL)
+
+
+PROVIDERS = {
+    "gemini": GeminiProvider,
+    "ollama": OllamaProvider,
+    "stub": _build_stub,
+}
+
+# model spec → provider instance, created on first use and reused
+_instances = {}
+_instances_lock = threading.Lock()
+
+# When set, every call is answered by this provider (offline benchmarks)
+_override = None
+
+
+def get_provider(spec: str = None) -> LLMProvider:
+    """Return the long-lived provider for a model spec ("gemini", "ollama:llama3", ...)."""
+    spec = spec or DEFAULT_PROVIDER
+    provider = _instances.get(spec)
+    if provider is not None:
+        return provider
+
+    name, _, model = spec.partition(":")
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{name}' (expected one of {', '.join(PROVIDERS)})")
+
+    with _instances_lock:
+        provider = _instances.get(spec)
+        if provider is None:
+            provider = PROVIDERS[name](model or None)
+            _instances[spec] = provider
+    return provider
+
+
+def register_provider(spec: str, provider: LLMProvider):
+    """Install (or replace) the provider used for `spec`."""
+    with _instances_lock:
+        _instances[spec] = provider
+
+
+def add_call_listener(listener):
+    """Register listener(provider, call), run after every LLM call."""
+    if listener not in _call_listeners:
+        _call_listeners.append(listener)
+
+
+def set_llm_responder(responder, latency_ms: float = 0.0):
+    """Route all LLM calls to `responder` (prompt → text); pass None to go back to the real providers."""
+    global _override
+    _override = StubProvider(responder=responder, latency_ms=latency_ms) if responder is not None else None
+
+
+def _resolve(spec):
+    return _override if _override is not None else get_provider(spec)
+
+
+def model_id(model: str = None) -> str:
+    """"provider:model" that would answer calls for this spec (cache keys)."""
+    provider = _resolve(model)
+    return f"{provider.name}:{provider.model}"
+
+
+def generate(prompt: str, model: str = None) -> str:
+    return _resolve(model).generate(prompt)
+
+
+async def agenerate(prompt: str, model: str = None) -> str:
+    return await _resolve(model).agenerate(prompt)
+
+
+def provider_stats():
+    stats = {spec: provider.stats() for spec, provider in list(_instances.items())}
+    if _override is not None:
+        stats["override"] = _override.stats()
+    return stats
+
+
+async def close_providers():
+    for provider in list(_instances.values()):
+        await provider.aclose()
+    _instances.clear()
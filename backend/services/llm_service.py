@@ -88,41 +88,243 @@
 #     }
 
 
-from services.gemini_service import generate_sql_rewrite
-from utils.sql_executor import run_sql
-from utils.correctness import compare_results
+import os
+import time
+import asyncio
+import hashlib
+import sqlglot
+from sqlglot.optimizer.normalize_identifiers import normalize_identifiers
+from services.gemini_service import generate_sql_rewrite_async
+from services.schema_service import get_schema_snapshot_async
+from utils.sql_executor import stream_sql_async
+from utils.correctness import (
+    is_order_sensitive, compare_ordered_streams_async,
+    digest_stream_async, digest_verdict
+)
+from utils.cache import build_cache
+from utils.timing import stage
 from services.instruction_search import find_best_instruction
+from services.plan_service import compare_plans, accept_rewrite
 
 
-def rewrite_with_model(model: str, sql: str, instruction: str):
+# Canonical SQL → the vetted outcome of rewrite_sql_pipeline_async
+# (rewritten_sql, candidate_sql, accepted, decision, comparison, performance).
+# A hit skips the LLM call, verification and timing. Bump the version when
+# the value shape changes, so a shared (postgres) cache never serves entries
+# written in an older shape.
+REWRITE_CACHE_VERSION = 2
+REWRITE_CACHE = build_cache(
+    "sql_rewrite",
+    max_entries=int(os.getenv("REWRITE_CACHE_MAX_ENTRIES", "2048")),
+    max_bytes=int(os.getenv("REWRITE_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    ttl=float(os.getenv("REWRITE_CACHE_TTL_SEC", "3600")),
+    backend=os.getenv("REWRITE_CACHE_BACKEND", "memory"),
+)
+
+# Provider spec used for rewrites (defaults to LLM_PROVIDER)
+REWRITE_MODEL = os.getenv("REWRITE_MODEL")
+
+# Original and rewritten SQL are streamed and compared concurrently, under
+# one shared deadline.
+VERIFY_TIMEOUT_SEC = float(os.getenv("VERIFY_TIMEOUT_SEC", "60"))
+VERIFY_CANCEL_ON_FAILURE = os.getenv("VERIFY_CANCEL_ON_FAILURE", "true").lower() == "true"
+
+
+class _LegFailed(Exception):
+    """A verification leg's query failed; details are in its result dict."""
+
+
+def canonicalize_sql(sql: str) -> str:
     """
-    This wrapper keeps compatibility with instruction_search.
-    It ignores 'model' and uses Gemini underneath.
+    Render SQL from its AST so formatting, keyword case and unquoted
+    identifier case don't produce different cache keys.
+    Falls back to whitespace-collapsed text when sqlglot can't parse it.
     """
     try:
-        return generate_sql_rewrite(sql, instruction)
+        expression = sqlglot.parse_one(sql, read="postgres")
+        expression = normalize_identifiers(expression, dialect="postgres")
+        return expression.sql(dialect="postgres", normalize=True)
+    except Exception:
+        return " ".join(sql.strip().rstrip(";").split())
+
+
+def sql_fingerprint(sql: str) -> str:
+    return hashlib.sha256(canonicalize_sql(sql).encode()).hexdigest()
+
+
+async def rewrite_with_model_async(model: str, sql: str, instruction: str):
+    try:
+        return await generate_sql_rewrite_async(sql, instruction, model)
     except Exception as e:
         return f"ERROR: {str(e)}"
 
 
-def rewrite_sql_pipeline(sql: str):
-    instruction_data = find_best_instruction("gemini", sql)
-    instruction = instruction_data["instruction"]
+async def run_verification_async(sql: str, rewritten_sql: str,
+                                 timeout: float = VERIFY_TIMEOUT_SEC,
+                                 cancel_on_failure: bool = VERIFY_CANCEL_ON_FAILURE):
+    """
+    Stream both result sets through server-side cursors and compare them as
+    rows arrive, so memory stays constant whatever the result size.
+
+    Queries with a top-level ORDER BY are compared positionally and stop at
+    the first differing row; everything else is compared as a multiset, with
+    both legs consumed concurrently. Cancelling a leg makes asyncpg cancel
+    its query on the Postgres side.
+
+    Returns (original_res, rewritten_res, comparison, timings). The result
+    dicts carry columns and row_count but not the rows themselves.
+    """
+    legs = {"original": sql, "rewritten": rewritten_sql}
+    results = {
+        name: {"success": True, "error": None, "rows": [], "columns": [], "row_count": 0, "time_ms": None}
+        for name in legs
+    }
+    cancelled = []
+
+    async def tracked(name):
+        start = time.perf_counter()
+        stream = stream_sql_async(legs[name])
+        try:
+            results[name]["columns"] = await anext(stream)
+            async for row in stream:
+                results[name]["row_count"] += 1
+                yield row
+        except Exception as e:
+            results[name]["success"] = False
+            results[name]["error"] = str(e)
+            raise _LegFailed(name)
+        finally:
+            results[name]["time_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            await stream.aclose()
+
+    started = time.perf_counter()
+    comparison = None
 
-    rewritten_sql = rewrite_with_model("gemini", sql, instruction)
-    rewritten_sql = clean_sql(rewritten_sql)   # ← ADD THIS
+    if is_order_sensitive(sql):
+        original_rows, rewritten_rows = tracked("original"), tracked("rewritten")
+        try:
+            comparison = await asyncio.wait_for(
+                compare_ordered_streams_async(original_rows, rewritten_rows),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            cancelled = list(legs)
+        except _LegFailed:
+            pass
+        finally:
+            await original_rows.aclose()
+            await rewritten_rows.aclose()
+    else:
+        tasks = {asyncio.create_task(digest_stream_async(tracked(name))): name for name in legs}
+        done, pending = await asyncio.wait(
+            tasks,
+            timeout=timeout,
+            return_when=asyncio.FIRST_EXCEPTION if cancel_on_failure else asyncio.ALL_COMPLETED
+        )
+        for t in pending:
+            t.cancel()
+            cancelled.append(tasks[t])
+        if pending:
+            await asyncio.wait(pending)
 
-    original_res = run_sql(sql)
-    rewritten_res = run_sql(rewritten_sql)
-    comparison = compare_results(original_res, rewritten_res)
+        failures = [t.exception() for t in done]
+        if not cancelled and not any(failures):
+            digests = {tasks[t]: t.result() for t in done}
+            comparison = digest_verdict(digests["original"], digests["rewritten"])
+
+    failed = [name for name in legs if not results[name]["success"]]
+    for name in cancelled:
+        results[name]["success"] = False
+        results[name]["error"] = "Query cancelled"
+
+    if comparison is None:
+        if "original" in failed:
+            comparison = {"valid": False, "reason": "Original SQL failed"}
+        elif "rewritten" in failed:
+            comparison = {"valid": False, "reason": "Rewritten SQL failed"}
+        else:
+            comparison = {"valid": False, "reason": "Verification timed out"}
+
+    total_ms = round((time.perf_counter() - started) * 1000, 3)
+    original_ms = results["original"]["time_ms"] or 0.0
+    rewritten_ms = results["rewritten"]["time_ms"] or 0.0
+    timings = {
+        "original_ms": original_ms,
+        "rewritten_ms": rewritten_ms,
+        "total_ms": total_ms,
+        "saved_ms": round(max(0.0, original_ms + rewritten_ms - total_ms), 3),
+        "cancelled": cancelled,
+    }
+    return results["original"], results["rewritten"], comparison, timings
+
+
+async def rewrite_sql_pipeline_async(sql: str):
+    """
+    Async rewrite pipeline. The LLM rewrite is only returned when it is
+    result-equivalent and measured not slower than the original; otherwise
+    `rewritten_sql` is the original SQL and `decision` says why.
+    """
+    _, schema_fingerprint = await get_schema_snapshot_async()
+    cache_key = f"v{REWRITE_CACHE_VERSION}:{schema_fingerprint}:{sql_fingerprint(sql)}"
+    cached = await REWRITE_CACHE.aget(cache_key)
+    if cached is not None:
+        return {
+            "original": None,
+            "rewritten_result": None,
+            "timings": None,
+            **cached,
+            "cached": True
+        }
+
+    instruction = find_best_instruction(REWRITE_MODEL, sql)["instruction"]
+
+    with stage("llm"):
+        candidate_sql = await rewrite_with_model_async(REWRITE_MODEL, sql, instruction)
+    candidate_sql = clean_sql(candidate_sql)
+
+    with stage("verification"):
+        original_res, rewritten_res, comparison, timings = await run_verification_async(sql, candidate_sql)
+
+    performance = None
+    accepted = False
+    decision = comparison["reason"]
+    performance_failed = False
+    if comparison["valid"]:
+        try:
+            with stage("plan"):
+                performance = await compare_plans(sql, candidate_sql)
+            accepted, decision = accept_rewrite(performance)
+        except Exception as e:
+            performance_failed = True
+            decision = f"Performance check failed: {e}"
+
+    outcome = {
+        "rewritten_sql": candidate_sql if accepted else sql,
+        "candidate_sql": candidate_sql,
+        "accepted": accepted,
+        "decision": decision,
+        "comparison": comparison,
+        "performance": performance,
+    }
+
+    transient = (
+        not original_res["success"]
+        or candidate_sql.startswith("ERROR")
+        or timings["cancelled"]
+        or performance_failed
+    )
+    if not transient:
+        await REWRITE_CACHE.aset(cache_key, outcome)
 
     return {
         "original": original_res,
-        "rewritten_sql": rewritten_sql,
         "rewritten_result": rewritten_res,
-        "comparison": comparison
+        "timings": timings,
+        **outcome,
+        "cached": False
     }
 
+
 def clean_sql(raw):
     if not raw:
         return raw
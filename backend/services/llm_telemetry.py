@@ -0,0 +1,252 @@
+import os
+import asyncio
+import contextvars
+from collections import deque
+from decimal import Decimal
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+
+from utils.async_db import async_connection
+from services.llm_providers import add_call_listener, LLMTimeout
+from utils.metrics import LLM_CALLS, LLM_SECONDS
+from utils.tracing import annotate
+
+# One llm_usage row per LLM call: who asked (user, endpoint), what for
+# (operation), which model, sizes, tokens, latency and outcome. Records are
+# buffered in memory by the provider listener and written in batches by a
+# task on the worker's event loop, never on the request path.
+
+TELEMETRY_ENABLED = os.getenv("LLM_TELEMETRY_ENABLED", "1") == "1"
+TELEMETRY_FLUSH_SEC = float(os.getenv("LLM_TELEMETRY_FLUSH_SEC", "2"))
+TELEMETRY_BATCH = int(os.getenv("LLM_TELEMETRY_BATCH", "500"))
+TELEMETRY_MAX_BUFFER = int(os.getenv("LLM_TELEMETRY_MAX_BUFFER", "20000"))
+TELEMETRY_RETENTION_DAYS = int(os.getenv("LLM_TELEMETRY_RETENTION_DAYS", "90"))
+TELEMETRY_MAX_DAYS = int(os.getenv("LLM_TELEMETRY_MAX_DAYS", "90"))
+
+COLUMNS = (
+    "created_at", "user_id", "endpoint", "operation", "provider", "model",
+    "prompt_chars", "response_chars", "prompt_tokens", "completion_tokens",
+    "latency_ms", "outcome", "error",
+)
+
+_user_id = contextvars.ContextVar("llm_user_id", default=None)
+_endpoint = contextvars.ContextVar("llm_endpoint", default=None)
+_operation = contextvars.ContextVar("llm_operation", default=None)
+
+_buffer = deque()
+_writer = None
+_written = 0
+_dropped = 0
+_flush_errors = 0
+_last_cleanup = None
+
+
+def set_call_context(user_id, endpoint: str):
+    """Attribute LLM calls made while handling the current request."""
+    _user_id.set(user_id)
+    _endpoint.set(endpoint)
+
+
+@contextmanager
+def llm_operation(name: str):
+    """Label the LLM calls made inside the block ("nl_to_sql", "rewrite", ...)."""
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def _outcome(error):
+    if error is None:
+        return "ok"
+    if isinstance(error, LLMTimeout):
+        return "timeout"
+    return "error"
+
+
+def _observe_call(provider, call):
+    operation = _operation.get() or "other"
+    LLM_CALLS.inc(provider.name, operation, _outcome(call["error"]))
+    LLM_SECONDS.observe(call["ms"] / 1000, provider.name, operation)
+    # Runs inside the provider's llm.call span
+    annotate(operation=operation)
+
+
+def _record_call(provider, call):
+    global _dropped
+
+    if not TELEMETRY_ENABLED:
+        return
+    if len(_buffer) >= TELEMETRY_MAX_BUFFER:
+        # The database is behind or down; keep the newest records
+        _buffer.popleft()
+        _dropped += 1
+
+    error = call["error"]
+    outcome = _outcome(error)
+
+    _buffer.append((
+        datetime.now(timezone.utc),
+        _user_id.get(),
+        _endpoint.get(),
+        _operation.get(),
+        provider.name,
+        provider.model,
+        call["prompt_chars"],
+        call["response_chars"],
+        call["prompt_tokens"],
+        call["completion_tokens"],
+        call["ms"],
+        outcome,
+        str(error)[:500] if error is not None else None,
+    ))
+
+
+add_call_listener(_observe_call)
+add_call_listener(_record_call)
+
+
+async def flush():
+    """Write buffered records in batches; a failed batch goes back to the front."""
+    global _written, _flush_errors
+
+    written = 0
+    while _buffer:
+        batch = []
+        while _buffer and len(batch) < TELEMETRY_BATCH:
+            batch.append(_buffer.popleft())
+        try:
+            async with async_connection() as conn:
+                await conn.copy_records_to_table("llm_usage", records=batch, columns=COLUMNS)
+        except Exception:
+            _buffer.extendleft(reversed(batch))
+            _flush_errors += 1
+            break
+        written += len(batch)
+
+    _written += written
+    await _cleanup()
+    return written
+
+
+async def _cleanup():
+    global _last_cleanup
+
+    now = datetime.now(timezone.utc)
+    if _last_cleanup is not None and now - _last_cleanup < timedelta(hours=1):
+        return
+    _last_cleanup = now
+    try:
+        async with async_connection() as conn:
+            await conn.execute(
+                "DELETE FROM llm_usage WHERE created_at < $1",
+                now - timedelta(days=TELEMETRY_RETENTION_DAYS)
+            )
+    except Exception:
+        pass
+
+
+async def _writer_loop():
+    while True:
+        await asyncio.sleep(TELEMETRY_FLUSH_SEC)
+        await flush()
+
+
+def start_telemetry_writer():
+    """Start the batch writer on the running event loop (app startup)."""
+    global _writer
+    if TELEMETRY_ENABLED and _writer is None:
+        _writer = asyncio.get_running_loop().create_task(_writer_loop())
+
+
+async def stop_telemetry_writer():
+    global _writer
+    if _writer is not None:
+        _writer.cancel()
+        try:
+            await _writer
+        except asyncio.CancelledError:
+            pass
+        _writer = None
+    await flush()
+
+
+def telemetry_stats():
+    return {
+        "enabled": TELEMETRY_ENABLED,
+        "buffered": len(_buffer),
+        "written": _written,
+        "dropped": _dropped,
+        "flush_errors": _flush_errors,
+    }
+
+
+# ---------------------
+# ROLLUPS
+# ---------------------
+
+async def usage_rollup(days: int = 7, top_users: int = 10):
+    """Per endpoint/model, per day and per user aggregates over the last `days`."""
+    days = max(1, min(days, TELEMETRY_MAX_DAYS))
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+
+    async with async_connection() as conn:
+        by_model = await conn.fetch(
+            """
+            SELECT endpoint, operation, provider, model,
+                   COUNT(*) AS calls,
+                   COUNT(*) FILTER (WHERE outcome = 'error') AS errors,
+                   COUNT(*) FILTER (WHERE outcome = 'timeout') AS timeouts,
+                   ROUND(AVG(latency_ms)::numeric, 1) AS avg_ms,
+                   ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms)::numeric, 1) AS p95_ms,
+                   SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   SUM(prompt_chars) AS prompt_chars,
+                   SUM(response_chars) AS response_chars
+            FROM llm_usage
+            WHERE created_at >= $1
+            GROUP BY endpoint, operation, provider, model
+            ORDER BY calls DESC
+            """,
+            since
+        )
+        by_day = await conn.fetch(
+            """
+            SELECT created_at::date AS day,
+                   COUNT(*) AS calls,
+                   COUNT(*) FILTER (WHERE outcome <> 'ok') AS failures,
+                   COALESCE(SUM(prompt_tokens), 0) + COALESCE(SUM(completion_tokens), 0) AS tokens
+            FROM llm_usage
+            WHERE created_at >= $1
+            GROUP BY day
+            ORDER BY day
+            """,
+            since
+        )
+        by_user = await conn.fetch(
+            """
+            SELECT user_id,
+                   COUNT(*) AS calls,
+                   COALESCE(SUM(prompt_tokens), 0) + COALESCE(SUM(completion_tokens), 0) AS tokens,
+                   ROUND(SUM(latency_ms)::numeric, 1) AS total_ms
+            FROM llm_usage
+            WHERE created_at >= $1 AND user_id IS NOT NULL
+            GROUP BY user_id
+            ORDER BY calls DESC
+            LIMIT $2
+            """,
+            since, top_users
+        )
+
+    def plain(rows):
+        return [{k: float(v) if isinstance(v, Decimal) else v for k, v in r.items()} for r in rows]
+
+    return {
+        "success": True,
+        "days": days,
+        "by_model": plain(by_model),
+        "by_day": [{**r, "day": r["day"].isoformat()} for r in plain(by_day)],
+        "top_users": plain(by_user),
+        "writer": telemetry_stats(),
+    }
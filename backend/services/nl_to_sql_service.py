@@ -1,13 +1,51 @@
-import google.generativeai as genai
+import os
+import re
+import hashlib
 from services.cleaner import clean_sql_output
-from services.schema_service import get_schema_text
+from services.llm_providers import generate, agenerate, model_id
+from services.llm_telemetry import llm_operation
+from services.schema_service import get_schema_snapshot, get_schema_snapshot_async
+from utils.cache import build_cache
+from utils.timing import stage
 
 
+# Prompt → SQL cache. Keys include the schema fingerprint and the model, so a
+# schema change or a model switch never serves SQL generated for the old one.
+PROMPT_CACHE = build_cache(
+    "nl_to_sql",
+    max_entries=int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "2048")),
+    max_bytes=int(os.getenv("PROMPT_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    ttl=float(os.getenv("PROMPT_CACHE_TTL_SEC", "3600")),
+    backend=os.getenv("PROMPT_CACHE_BACKEND", "memory"),
+)
+_last_schema_fingerprint = None
 
-def generate_sql_from_prompt(prompt: str):
-    schema_text = get_schema_text()
+# Provider spec for NL → SQL generation (defaults to LLM_PROVIDER)
+NL_TO_SQL_MODEL = os.getenv("NL_TO_SQL_MODEL")
+
+
+# Sentence punctuation only: operators (< > = ! % - + * /), digits and
+# decimal points change the meaning of a request and are kept
+_QUOTES = re.compile(r"[\"'`“”‘’]")
+_COMMAS = re.compile(r"[,;]+(?=\s|$)")
+_TRAILING = re.compile(r"[\s.?!:]+$")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold case, quotes, sentence punctuation and whitespace so trivially different phrasings share a key."""
+    p = prompt.lower()
+    p = _QUOTES.sub(" ", p)
+    p = _COMMAS.sub(" ", p)
+    p = _TRAILING.sub("", p)
+    return " ".join(p.split())
+
+
+def prompt_cache_key(prompt: str, schema_fingerprint: str, model: str = "") -> str:
+    return hashlib.sha256(f"{schema_fingerprint}\n{model}\n{normalize_prompt(prompt)}".encode()).hexdigest()
 
-    final_prompt = f"""
+
+def build_nl_prompt(prompt: str, schema_text: str) -> str:
+    return f"""
 You are an expert SQL generator.
 
 User request:
@@ -27,7 +65,55 @@ Rules:
 Return ONLY the SQL query.
 """
 
-    response = genai.GenerativeModel("gemini-2.5-flash").generate_content(final_prompt)
-    sql_raw = response.text
 
-    return clean_sql_output(sql_raw)
+def _prompt_cache_lookup_key(prompt: str, schema_fingerprint: str) -> str:
+    global _last_schema_fingerprint
+
+    # Entries for an older schema can never hit again; free the memory now
+    if _last_schema_fingerprint is not None and schema_fingerprint != _last_schema_fingerprint:
+        PROMPT_CACHE.clear()
+    _last_schema_fingerprint = schema_fingerprint
+
+    return prompt_cache_key(prompt, schema_fingerprint, model_id(NL_TO_SQL_MODEL))
+
+
+def generate_sql_from_prompt(prompt: str):
+    schema_text, schema_fingerprint = get_schema_snapshot()
+
+    cache_key = _prompt_cache_lookup_key(prompt, schema_fingerprint)
+    cached = PROMPT_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    final_prompt = build_nl_prompt(prompt, schema_text)
+
+    with llm_operation("nl_to_sql"):
+        sql_raw = generate(final_prompt, NL_TO_SQL_MODEL)
+
+    sql = clean_sql_output(sql_raw)
+    if sql:
+        PROMPT_CACHE.set(cache_key, sql)
+
+    return sql
+
+
+async def generate_sql_from_prompt_async(prompt: str):
+    """Async variant: schema lookup, cache and LLM call never block the event loop."""
+    with stage("schema"):
+        schema_text, schema_fingerprint = await get_schema_snapshot_async()
+
+    cache_key = _prompt_cache_lookup_key(prompt, schema_fingerprint)
+    cached = await PROMPT_CACHE.aget(cache_key)
+    if cached is not None:
+        return cached
+
+    final_prompt = build_nl_prompt(prompt, schema_text)
+
+    with llm_operation("nl_to_sql"):
+        sql_raw = await agenerate(final_prompt, NL_TO_SQL_MODEL)
+
+    sql = clean_sql_output(sql_raw)
+    if sql:
+        await PROMPT_CACHE.aset(cache_key, sql)
+
+    return sql
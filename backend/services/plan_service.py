@@ -0,0 +1,180 @@
+import os
+import json
+import math
+import time
+import statistics
+from utils.async_db import async_connection
+from utils.sql_executor import set_statement_timeout
+
+# How many interleaved EXPLAIN ANALYZE runs per query, and a wall-clock budget
+# after which we stop adding runs (each query always gets at least one).
+PLAN_ANALYZE_RUNS = int(os.getenv("PLAN_ANALYZE_RUNS", "5"))
+PLAN_ANALYZE_BUDGET_SEC = float(os.getenv("PLAN_ANALYZE_BUDGET_SEC", "20"))
+
+# A rewrite is rejected when it is measurably slower (whole speedup interval
+# below 1) or its point estimate falls under this fraction of the original.
+REWRITE_MIN_SPEEDUP = float(os.getenv("REWRITE_MIN_SPEEDUP", "0.95"))
+
+# Two-sided 95% Student t critical values by degrees of freedom
+_T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447,
+         7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228, 15: 2.131, 20: 2.086, 30: 2.042}
+
+
+def _t_critical(df):
+    for bound in sorted(_T_95):
+        if df <= bound:
+            return _T_95[bound]
+    return 1.96
+
+
+def summarize_plan(plan):
+    """Keep the top-level numbers of an EXPLAIN (FORMAT JSON) plan."""
+    root = plan["Plan"]
+    summary = {
+        "node_type": root.get("Node Type"),
+        "startup_cost": root.get("Startup Cost"),
+        "total_cost": root.get("Total Cost"),
+        "plan_rows": root.get("Plan Rows"),
+    }
+    if "Execution Time" in plan:
+        summary["execution_ms"] = plan["Execution Time"]
+        summary["planning_ms"] = plan.get("Planning Time")
+    return summary
+
+
+async def _explain(conn, sql, analyze=False):
+    options = "ANALYZE, TIMING OFF, SUMMARY ON, FORMAT JSON" if analyze else "FORMAT JSON"
+    raw = await conn.fetchval(f"EXPLAIN ({options}) {sql.strip().rstrip(';')}")
+    plan = json.loads(raw) if isinstance(raw, str) else raw
+    return plan[0]
+
+
+def speedup_interval(original_ms, rewritten_ms):
+    """
+    Paired speedup estimate from interleaved runs.
+    Works on log(original/rewritten) per pair, so the interval is
+    multiplicative: speedup = exp(mean), bounds = exp(mean ± t·se).
+    """
+    ratios = [
+        math.log(o / r)
+        for o, r in zip(original_ms, rewritten_ms)
+        if o > 0 and r > 0
+    ]
+    if not ratios:
+        return None
+
+    mean = statistics.fmean(ratios)
+    if len(ratios) < 2:
+        return {"speedup": round(math.exp(mean), 4), "lower": None, "upper": None, "runs": 1}
+
+    half_width = _t_critical(len(ratios) - 1) * statistics.stdev(ratios) / math.sqrt(len(ratios))
+    return {
+        "speedup": round(math.exp(mean), 4),
+        "lower": round(math.exp(mean - half_width), 4),
+        "upper": round(math.exp(mean + half_width), 4),
+        "runs": len(ratios),
+    }
+
+
+async def compare_plans(sql: str, rewritten_sql: str,
+                        runs: int = PLAN_ANALYZE_RUNS,
+                        budget_sec: float = PLAN_ANALYZE_BUDGET_SEC):
+    """
+    Cost estimates plus measured execution times for both queries.
+    Runs are interleaved (A, B, A, B, ...) after one warm-up each so cache
+    warmth and background load affect both sides equally.
+    """
+    async with async_connection() as conn:
+        async with conn.transaction(readonly=True):
+            # EXPLAIN ANALYZE executes the query: same timeout as running it
+            await set_statement_timeout(conn)
+            original_plan = await _explain(conn, sql)
+            rewritten_plan = await _explain(conn, rewritten_sql)
+
+            # Warm-up (discarded)
+            await _explain(conn, sql, analyze=True)
+            await _explain(conn, rewritten_sql, analyze=True)
+
+            original_ms, rewritten_ms = [], []
+            start = time.monotonic()
+            for _ in range(max(1, runs)):
+                original_ms.append((await _explain(conn, sql, analyze=True))["Execution Time"])
+                rewritten_ms.append((await _explain(conn, rewritten_sql, analyze=True))["Execution Time"])
+                if time.monotonic() - start > budget_sec:
+                    break
+
+    original_cost = original_plan["Plan"]["Total Cost"]
+    rewritten_cost = rewritten_plan["Plan"]["Total Cost"]
+
+    return {
+        "original_plan": summarize_plan(original_plan),
+        "rewritten_plan": summarize_plan(rewritten_plan),
+        "cost_ratio": round(original_cost / rewritten_cost, 4) if rewritten_cost else None,
+        "original_ms": {"median": statistics.median(original_ms), "samples": original_ms},
+        "rewritten_ms": {"median": statistics.median(rewritten_ms), "samples": rewritten_ms},
+        "speedup": speedup_interval(original_ms, rewritten_ms),
+    }
+
+
+async def time_plan(sql: str, runs: int = PLAN_ANALYZE_RUNS,
+                    budget_sec: float = PLAN_ANALYZE_BUDGET_SEC, warmup: bool = True):
+    """
+    Plan summary plus EXPLAIN ANALYZE execution times of one query. Skip
+    the warm-up run when the query has just been executed anyway.
+    """
+    async with async_connection() as conn:
+        async with conn.transaction(readonly=True):
+            await set_statement_timeout(conn)
+            plan = await _explain(conn, sql)
+            if warmup:
+                await _explain(conn, sql, analyze=True)
+
+            samples = []
+            start = time.monotonic()
+            for _ in range(max(1, runs)):
+                samples.append((await _explain(conn, sql, analyze=True))["Execution Time"])
+                if time.monotonic() - start > budget_sec:
+                    break
+
+    return {
+        "plan": summarize_plan(plan),
+        "total_cost": plan["Plan"]["Total Cost"],
+        "median": statistics.median(samples),
+        "samples": samples,
+    }
+
+
+def compare_timings(original, rewritten):
+    """
+    compare_plans-shaped result from two separately timed queries (time_plan),
+    e.g. one timing of the original reused against several rewrites.
+    """
+    return {
+        "original_plan": original["plan"],
+        "rewritten_plan": rewritten["plan"],
+        "cost_ratio": round(original["total_cost"] / rewritten["total_cost"], 4) if rewritten["total_cost"] else None,
+        "original_ms": {"median": original["median"], "samples": original["samples"]},
+        "rewritten_ms": {"median": rewritten["median"], "samples": rewritten["samples"]},
+        "speedup": speedup_interval(original["samples"], rewritten["samples"]),
+    }
+
+
+def accept_rewrite(performance, min_speedup: float = REWRITE_MIN_SPEEDUP):
+    """
+    Decide whether the measured rewrite is "not slower".
+    Falls back to the planner cost ratio when nothing could be timed.
+    Returns (accepted, reason).
+    """
+    speedup = performance.get("speedup")
+    if speedup:
+        if speedup["upper"] is not None and speedup["upper"] < 1.0:
+            return False, f"rewrite is slower (speedup interval {speedup['lower']}–{speedup['upper']})"
+        if speedup["speedup"] < min_speedup:
+            return False, f"speedup {speedup['speedup']} below required {min_speedup}"
+        return True, f"speedup {speedup['speedup']}"
+
+    cost_ratio = performance.get("cost_ratio")
+    if cost_ratio is not None:
+        return cost_ratio >= 1.0, f"planner cost ratio {cost_ratio}"
+
+    return False, "no performance data"
@@ -1,38 +1,154 @@
-from utils.db import get_connection
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from utils.db import connection
 
-def get_schema_text():
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # Get all table names
-    cur.execute("""
-        SELECT table_name
-        FROM information_schema.tables
-        WHERE table_schema = 'public';
-    """)
-    tables = [t["table_name"] for t in cur.fetchall()]
-
-    schema_info = []
-
-    for table in tables:
-        cur.execute("""
-            SELECT column_name, data_type
-            FROM information_schema.columns
-            WHERE table_name = %s
-            ORDER BY ordinal_position;
-        """, (table,))
-
-        columns = cur.fetchall()
-
-        column_lines = [
-            f"- {col['column_name']} ({col['data_type']})"
-            for col in columns
-        ]
-
-        schema_info.append(
-            f"Table: {table}\n" + "\n".join(column_lines)
+# Rendered schema is served from memory. Every SCHEMA_CHECK_SEC we run one cheap
+# catalog-version query; the full catalog is only reloaded when that version
+# changes or when SCHEMA_TTL_SEC has passed (safety net for missed changes).
+SCHEMA_CHECK_SEC = float(os.getenv("SCHEMA_CHECK_SEC", "10"))
+SCHEMA_TTL_SEC = float(os.getenv("SCHEMA_TTL_SEC", "600"))
+
+# The app's own bookkeeping tables; kept out of the schema sent to the LLM
+SCHEMA_EXCLUDED_TABLES = frozenset(
+    t.strip()
+    for t in os.getenv(
+        "SCHEMA_EXCLUDED_TABLES",
+        "app_cache,rate_limit_counters,llm_usage,stats_totals,stats_daily,schema_migrations"
+    ).split(",")
+    if t.strip()
+)
+
+# All public tables/views and their columns in one round trip
+CATALOG_QUERY = """
+    SELECT c.table_name, c.column_name, c.data_type
+    FROM information_schema.columns c
+    JOIN information_schema.tables t
+      ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+    WHERE c.table_schema = 'public'
+    ORDER BY c.table_name, c.ordinal_position;
+"""
+
+# Changes whenever a relation or column in `public` is created, dropped,
+# renamed or retyped (DDL rewrites the pg_class / pg_attribute tuples).
+CATALOG_VERSION_QUERY = """
+    SELECT md5(COALESCE(string_agg(
+        c.oid::text || ':' || c.xmin::text || ':' || a.attname || ':' || a.atttypid::text,
+        ',' ORDER BY c.oid, a.attnum
+    ), '')) AS version
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'v', 'm', 'p', 'f');
+"""
+
+# One lock for every writer (sync and async callers alike). Text and
+# fingerprint are swapped together as one tuple, so readers never see a
+# fingerprint for different text.
+_lock = threading.Lock()
+_cache = {
+    "snapshot": None,       # (text, fingerprint)
+    "version": None,
+    "loaded_at": 0.0,
+    "checked_at": 0.0,
+}
+
+
+def _fetch_version(cur):
+    cur.execute(CATALOG_VERSION_QUERY)
+    return cur.fetchone()["version"]
+
+
+def _render(rows):
+    tables = {}
+    for r in rows:
+        if r["table_name"] in SCHEMA_EXCLUDED_TABLES:
+            continue
+        tables.setdefault(r["table_name"], []).append(
+            f"- {r['column_name']} ({r['data_type']})"
         )
 
-    conn.close()
+    return "\n\n".join(
+        f"Table: {table}\n" + "\n".join(column_lines)
+        for table, column_lines in tables.items()
+    )
+
+
+def _needs_reload(version, now):
+    return (
+        _cache["snapshot"] is None
+        or version != _cache["version"]
+        or now - _cache["loaded_at"] >= SCHEMA_TTL_SEC
+    )
+
+
+def _store(rows, version, now):
+    text = _render(rows)
+    _cache["snapshot"] = (text, hashlib.sha256(text.encode()).hexdigest())
+    _cache["version"] = version
+    _cache["loaded_at"] = now
+
+
+def _is_fresh(now):
+    return (
+        _cache["snapshot"] is not None
+        and now - _cache["checked_at"] < SCHEMA_CHECK_SEC
+        and now - _cache["loaded_at"] < SCHEMA_TTL_SEC
+    )
+
+
+def _refresh():
+    """Revalidate the cached schema, reloading the catalog only if it changed."""
+    now = time.monotonic()
+
+    with connection() as conn:
+        cur = conn.cursor()
+        version = _fetch_version(cur)
+
+        if _needs_reload(version, now):
+            cur.execute(CATALOG_QUERY)
+            _store(cur.fetchall(), version, now)
+
+        cur.close()
+
+    _cache["checked_at"] = now
+
+
+def get_schema_snapshot():
+    """Return (schema_text, fingerprint) for the current public schema."""
+    snapshot = _cache["snapshot"]
+    if snapshot is not None and _is_fresh(time.monotonic()):
+        return snapshot
+
+    with _lock:
+        if not _is_fresh(time.monotonic()):
+            _refresh()
+        return _cache["snapshot"]
+
+
+async def get_schema_snapshot_async():
+    """
+    Async variant of get_schema_snapshot. The fresh path does no I/O; a
+    revalidation runs in a thread under the same lock as sync callers.
+    """
+    snapshot = _cache["snapshot"]
+    if snapshot is not None and _is_fresh(time.monotonic()):
+        return snapshot
+    return await asyncio.to_thread(get_schema_snapshot)
+
+
+def get_schema_text():
+    return get_schema_snapshot()[0]
+
+
+def get_schema_fingerprint():
+    return get_schema_snapshot()[1]
+
 
-    return "\n\n".join(schema_info)
+def invalidate_schema_cache():
+    """Force the next caller to reload the catalog (e.g. after running migrations)."""
+    with _lock:
+        _cache["snapshot"] = None
+        _cache["checked_at"] = 0.0
@@ -0,0 +1,169 @@
+import os
+import time
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+
+from utils.db import connection
+from services.llm_providers import add_call_listener
+
+# Dashboard counters, maintained incrementally instead of COUNT(*) scans.
+#
+# Row counts (users, chats, messages) are kept by statement-level triggers
+# (migration 6). Events that aren't rows, like LLM calls, are accumulated
+# here per worker and flushed as deltas into the same tables every
+# STATS_FLUSH_SEC, so the request path never touches the database for them.
+
+STATS_FLUSH_SEC = float(os.getenv("STATS_FLUSH_SEC", "5"))
+STATS_MAX_DAYS = int(os.getenv("STATS_MAX_DAYS", "365"))
+
+# Must match the shard count in stats_count_rows()
+STATS_SHARDS = 8
+
+ROW_METRICS = ("users", "chats", "messages")
+EVENT_METRICS = ("llm_calls", "llm_errors")
+
+_pending = defaultdict(int)     # (day, metric) → delta not yet flushed
+_lock = threading.Lock()
+_flusher = None
+_stop = threading.Event()
+_flushes = 0
+_flush_errors = 0
+
+
+def incr(metric: str, n: int = 1):
+    """Count an event for today; written to Postgres by the background flusher."""
+    with _lock:
+        _pending[(date.today(), metric)] += n
+    if _flusher is None:
+        _start_flusher()
+
+
+def _start_flusher():
+    global _flusher
+    with _lock:
+        if _flusher is not None:
+            return
+        _stop.clear()
+        _flusher = threading.Thread(target=_flush_loop, name="stats-flusher", daemon=True)
+        _flusher.start()
+
+
+def _flush_loop():
+    while not _stop.wait(STATS_FLUSH_SEC):
+        flush()
+
+
+def flush():
+    """Write accumulated deltas; on failure they are kept for the next attempt."""
+    global _flushes, _flush_errors
+
+    with _lock:
+        batch = dict(_pending)
+        _pending.clear()
+    if not batch:
+        return 0
+
+    shard = os.getpid() % STATS_SHARDS
+    totals = defaultdict(int)
+    for (_, metric), n in batch.items():
+        totals[metric] += n
+
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                """
+                INSERT INTO stats_daily (day, metric, shard, count) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (day, metric, shard) DO UPDATE SET count = stats_daily.count + EXCLUDED.count
+                """,
+                [(day, metric, shard, n) for (day, metric), n in batch.items()]
+            )
+            cur.executemany(
+                """
+                INSERT INTO stats_totals (metric, shard, count) VALUES (%s, %s, %s)
+                ON CONFLICT (metric, shard) DO UPDATE SET count = stats_totals.count + EXCLUDED.count
+                """,
+                [(metric, shard, n) for metric, n in totals.items()]
+            )
+            conn.commit()
+            cur.close()
+    except Exception:
+        with _lock:
+            for key, n in batch.items():
+                _pending[key] += n
+            _flush_errors += 1
+        return 0
+
+    _flushes += 1
+    return len(batch)
+
+
+def stop_flusher():
+    """Stop the background flusher and write what is left (call at shutdown)."""
+    global _flusher
+    _stop.set()
+    if _flusher is not None:
+        _flusher.join(timeout=STATS_FLUSH_SEC)
+        _flusher = None
+    flush()
+
+
+def _count_llm_call(provider, call):
+    incr("llm_calls")
+    if call["error"] is not None:
+        incr("llm_errors")
+
+
+add_call_listener(_count_llm_call)
+
+
+def analytics_snapshot(days: int = 30):
+    """
+    Totals and per-day series for the admin dashboard. Reads a fixed number
+    of counter rows (metrics x shards, plus days x metrics x shards), never
+    the tables being counted.
+    """
+    days = max(1, min(days, STATS_MAX_DAYS))
+    since = date.today() - timedelta(days=days - 1)
+    start = time.perf_counter()
+
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT metric, SUM(count) AS count FROM stats_totals GROUP BY metric")
+        totals = {row["metric"]: int(row["count"]) for row in cur.fetchall()}
+        cur.execute(
+            """
+            SELECT day, metric, SUM(count) AS count
+            FROM stats_daily
+            WHERE day >= %s
+            GROUP BY day, metric
+            """,
+            (since,)
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+
+    metrics = ROW_METRICS + EVENT_METRICS
+    by_day = {since + timedelta(days=i): dict.fromkeys(metrics, 0) for i in range(days)}
+    for row in rows:
+        if row["day"] in by_day and row["metric"] in by_day[row["day"]]:
+            by_day[row["day"]][row["metric"]] = int(row["count"])
+
+    return {
+        "totals": {metric: totals.get(metric, 0) for metric in metrics},
+        "series": [{"day": day.isoformat(), **counts} for day, counts in sorted(by_day.items())],
+        "query_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+
+def stats_flusher_stats():
+    with _lock:
+        pending = sum(_pending.values())
+    return {
+        "flush_interval_sec": STATS_FLUSH_SEC,
+        "pending_events": pending,
+        "flushes": _flushes,
+        "flush_errors": _flush_errors,
+    }
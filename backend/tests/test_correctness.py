@@ -0,0 +1,32 @@
+import decimal
+
+from utils.correctness import normalize_value, row_key, compare_row_streams
+
+
+def test_float_noise_around_integer_matches_int_and_decimal():
+    values = [2, 2.0, decimal.Decimal(2), decimal.Decimal("2.000"), 2.0000000001, 1.9999999999]
+    normalized = {normalize_value(v) for v in values}
+    assert normalized == {2}
+    assert type(normalize_value(2.0000000001)) is int
+
+
+def test_non_integral_values_round_to_the_same_float():
+    assert normalize_value(0.1 + 0.2) == normalize_value(decimal.Decimal("0.3"))
+    assert normalize_value(decimal.Decimal("2.5")) == 2.5
+
+
+def test_large_numeric_and_float_values_normalize_alike():
+    values = [decimal.Decimal("1234567891"), 1234567890.9999998, 1234567891, 1234567891.0000002]
+    assert len({normalize_value(v) for v in values}) == 1
+    assert type(normalize_value(decimal.Decimal("1234567891"))) is int
+
+    big = [decimal.Decimal("98765432109876.5"), 98765432109876.52, 98765432109876]
+    assert len({normalize_value(v) for v in big}) == 1
+
+
+def test_rows_differing_only_in_numeric_type_compare_equal():
+    original = [{"total": decimal.Decimal(2), "avg": decimal.Decimal("0.3"), "sum": decimal.Decimal("1234567891")}]
+    rewritten = [{"TOTAL": 2.0000000001, "AVG": 0.1 + 0.2, "SUM": 1234567890.9999998}]
+    assert row_key(original[0]) == row_key(rewritten[0])
+    assert compare_row_streams(original, rewritten, ordered=False)["valid"]
+    assert compare_row_streams(original, rewritten, ordered=True)["valid"]
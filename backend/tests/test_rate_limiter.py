@@ -0,0 +1,72 @@
+import uuid
+
+import pytest
+
+from utils.rate_limiter import SharedRateLimiter, RatePolicy
+from utils.rate_limit_store import PostgresStore
+
+
+class DictStore:
+    """In-process store with PostgresStore.add semantics."""
+
+    blocking = False
+
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, key, window_start, window, delta):
+        slot = (repr(key), window_start)
+        if slot in self.counts:
+            self.counts[slot] = max(self.counts[slot] + delta, 0)
+        else:
+            self.counts[slot] = max(delta, 0)
+        return self.counts.get((repr(key), window_start - window), 0), self.counts[slot]
+
+    def stats(self):
+        return {}
+
+
+POLICY = RatePolicy(3, 60, "sliding_window")
+NOW = 6000.0   # start of a window, so the previous one carries no weight
+
+
+def test_exact_mode_refunds_rejected_requests():
+    store = DictStore()
+    limiter = SharedRateLimiter(store, batch=1)
+    key = ("rewrite_sql", 1)
+
+    assert all(limiter.hit(key, POLICY, now=NOW).allowed for _ in range(3))
+    assert store.counts[(repr(key), NOW)] == 3
+
+    for _ in range(5):
+        assert not limiter.hit(key, POLICY, now=NOW).allowed
+    assert store.counts[(repr(key), NOW)] == 3
+
+
+@pytest.fixture
+def pg_store():
+    store = PostgresStore(table=f"rate_limit_counters_test_{uuid.uuid4().hex[:8]}")
+    try:
+        store.add("probe", 0.0, 60, 0)
+    except Exception as e:
+        pytest.skip(f"Postgres unavailable: {e}")
+    yield store
+
+    from utils.db import connection
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {store.table}")
+        conn.commit()
+        cur.close()
+
+
+def test_postgres_store_refund_subtracts(pg_store):
+    key = ("rewrite_sql", 1)
+    assert pg_store.add(key, NOW, 60, 1) == (0, 1)
+    assert pg_store.add(key, NOW, 60, 1) == (0, 2)
+    # hit → reject → refund leaves the count where it was
+    assert pg_store.add(key, NOW, 60, 1) == (0, 3)
+    assert pg_store.add(key, NOW, 60, -1) == (0, 2)
+    # Never below zero, and a refund can't create a negative row
+    assert pg_store.add(key, NOW, 60, -5) == (0, 0)
+    assert pg_store.add(("other", 2), NOW, 60, -1) == (0, 0)
@@ -0,0 +1,81 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import asyncpg
+from fastapi import HTTPException
+
+from utils.db import (
+    DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME,
+    POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_ACQUIRE_TIMEOUT_SEC, POOL_MAX_LIFETIME_SEC,
+)
+
+# asyncpg pool used by the async request path. One pool per worker process,
+# created on startup and bound to that worker's event loop.
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def init_async_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                host=DB_HOST,
+                port=int(DB_PORT),
+                user=DB_USER,
+                password=DB_PASSWORD,
+                database=DB_NAME,
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=POOL_MAX_LIFETIME_SEC,
+            )
+    return _pool
+
+
+async def close_async_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+
+async def get_async_pool():
+    if _pool is None:
+        return await init_async_pool()
+    return _pool
+
+
+def async_pool_stats():
+    if _pool is None:
+        return None
+    return {
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+        "size": _pool.get_size(),
+        "idle": _pool.get_idle_size(),
+        "in_use": _pool.get_size() - _pool.get_idle_size(),
+    }
+
+
+@asynccontextmanager
+async def async_connection(timeout=None):
+    """Borrow an asyncpg connection for the duration of an `async with` block."""
+    pool = await get_async_pool()
+    timeout = POOL_ACQUIRE_TIMEOUT_SEC if timeout is None else timeout
+    async with pool.acquire(timeout=timeout) as conn:
+        yield conn
+
+
+async def get_async_db():
+    """FastAPI dependency: yields a pooled asyncpg connection and always returns it."""
+    pool = await get_async_pool()
+    try:
+        conn = await pool.acquire(timeout=POOL_ACQUIRE_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Database is busy, please retry")
+
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
@@ -0,0 +1,277 @@
+import json
+import sys
+import asyncio
+import time
+import threading
+from collections import OrderedDict
+
+from utils.db import connection
+
+# name → cache, so admin endpoints can report on every cache in the process
+CACHES = {}
+
+
+def _sizeof(value):
+    """Approximate in-memory footprint used for the byte bound."""
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    return len(json.dumps(value, default=str))
+
+
+class LRUCache:
+    """
+    In-process LRU cache with per-entry TTL and entry/byte bounds.
+    Thread-safe; every operation is O(1).
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=3600, sizeof=_sizeof):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+
+        self._lock = threading.Lock()
+        self._data = OrderedDict()   # key → (value, expires_at, size)
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, key):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, _ = entry
+            if expires_at <= now:
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return False
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+CACHE_TABLE_DDL = """
+    CREATE UNLOGGED TABLE IF NOT EXISTS {table} (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value JSONB NOT NULL,
+        expires_at TIMESTAMPTZ NOT NULL,
+        PRIMARY KEY (namespace, key)
+    )
+"""
+
+
+class PostgresCacheStore:
+    """
+    Shared cache store backed by a Postgres table, so several uvicorn
+    workers (or hosts) reuse each other's results. Values are JSON.
+    """
+
+    def __init__(self, namespace, table="app_cache", ttl=3600):
+        self.namespace = namespace
+        self.table = table
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._ready = False
+
+    def _ensure_table(self, cur):
+        if self._ready:
+            return
+        cur.execute(CACHE_TABLE_DDL.format(table=self.table))
+        self._ready = True
+
+    def get(self, key):
+        try:
+            with connection() as conn:
+                cur = conn.cursor()
+                self._ensure_table(cur)
+                cur.execute(
+                    f"SELECT value FROM {self.table} WHERE namespace=%s AND key=%s AND expires_at > NOW()",
+                    (self.namespace, key)
+                )
+                row = cur.fetchone()
+                conn.commit()
+                cur.close()
+        except Exception:
+            # The shared store is an optimization; never fail the request on it
+            self.errors += 1
+            return None
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row["value"]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            with connection() as conn:
+                cur = conn.cursor()
+                self._ensure_table(cur)
+                cur.execute(
+                    f"""
+                    INSERT INTO {self.table} (namespace, key, value, expires_at)
+                    VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+                    ON CONFLICT (namespace, key)
+                    DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+                    """,
+                    (self.namespace, key, json.dumps(value, default=str), ttl)
+                )
+                conn.commit()
+                cur.close()
+        except Exception:
+            self.errors += 1
+
+    def delete(self, key):
+        try:
+            with connection() as conn:
+                cur = conn.cursor()
+                self._ensure_table(cur)
+                cur.execute(f"DELETE FROM {self.table} WHERE namespace=%s AND key=%s", (self.namespace, key))
+                conn.commit()
+                cur.close()
+        except Exception:
+            self.errors += 1
+
+    def clear(self):
+        try:
+            with connection() as conn:
+                cur = conn.cursor()
+                self._ensure_table(cur)
+                cur.execute(f"DELETE FROM {self.table} WHERE namespace=%s", (self.namespace,))
+                conn.commit()
+                cur.close()
+        except Exception:
+            self.errors += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+
+class TieredCache:
+    """Local LRU in front of an optional shared store."""
+
+    def __init__(self, name, local, shared=None):
+        self.name = name
+        self.local = local
+        self.shared = shared
+        CACHES[name] = self
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+
+        value = self.shared.get(key)
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store in both tiers; True when the local tier accepted the value."""
+        stored = self.local.set(key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, ttl)
+        return stored
+
+    async def aget(self, key):
+        """Async get: the shared store's blocking I/O runs off the event loop."""
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+
+        value = await asyncio.to_thread(self.shared.get, key)
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    async def aset(self, key, value, ttl=None):
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.set, key, value, ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self, shared=False):
+        self.local.clear()
+        if shared and self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        stats = {"local": self.local.stats()}
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        return stats
+
+
+def build_cache(name, max_entries, max_bytes, ttl, backend="memory"):
+    """Create a named cache; backend is 'memory' or 'postgres'."""
+    shared = PostgresCacheStore(name, ttl=ttl) if backend == "postgres" else None
+    return TieredCache(name, LRUCache(max_entries, max_bytes, ttl), shared)
+
+
+def cache_stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
@@ -1,4 +1,18 @@
-from utils.sql_executor import run_sql
+import os
+import math
+import decimal
+import hashlib
+import sqlglot
+from sqlglot import exp
+
+# Numbers are compared after rounding to this many significant digits, so a
+# rewrite that sums in a different order still matches. Integers with more
+# digits (large ids) are rounded too; raise it if those must compare exactly.
+FLOAT_DIGITS = int(os.getenv("RESULT_FLOAT_DIGITS", "9"))
+
+_HASH_MOD = 1 << 128
+_END = object()
+
 
 def normalize_row(row):
     """
@@ -8,24 +22,163 @@ def normalize_row(row):
     return {k.lower(): v for k, v in row.items()}
 
 
-def compare_results(original, rewritten):
-    # If either query failed → invalid
-    if not original["success"]:
-        return {"valid": False, "reason": "Original SQL failed"}
-    if not rewritten["success"]:
-        return {"valid": False, "reason": "Rewritten SQL failed"}
+def normalize_value(value, digits=FLOAT_DIGITS):
+    """Canonical, hashable form of a single result value."""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, int) and -10 ** digits < value < 10 ** digits:
+        # Rounding to `digits` significant digits wouldn't change it
+        return value
+    if isinstance(value, (int, float, decimal.Decimal)):
+        # One rule for every numeric type: round to `digits` significant
+        # digits, then collapse integral values to int, so NUMERIC, float and
+        # INTEGER forms of the same number (and float noise) all agree
+        f = float(value)
+        if not math.isfinite(f):
+            return repr(f)
+        f = float(f"{f:.{digits}g}")
+        if f.is_integer() and abs(f) < 2 ** 53:
+            return int(f)
+        return f
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value)
+    return str(value) if not isinstance(value, str) else value
+
+
+def row_key(row, digits=FLOAT_DIGITS):
+    """Column-order and alias-case independent key for one row."""
+    return tuple(sorted((k.lower(), normalize_value(v, digits)) for k, v in row.items()))
+
+
+def _row_digest(key):
+    return hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+
+
+def _row_hash(key):
+    return int.from_bytes(_row_digest(key), "big")
+
+
+def is_order_sensitive(sql: str) -> bool:
+    """True when the statement has a top-level ORDER BY (row order is part of the result)."""
+    try:
+        expression = sqlglot.parse_one(sql, read="postgres")
+    except Exception:
+        # Can't tell — comparing positionally is the conservative choice
+        return True
+
+    while isinstance(expression, (exp.Subquery, exp.Paren)):
+        expression = expression.this
+    return expression.args.get("order") is not None
+
+
+class MultisetDigest:
+    """
+    Order-independent digest of a row stream: row count plus the sum of
+    128-bit row hashes. Two equal multisets always produce the same digest;
+    memory use is constant.
+    """
+
+    def __init__(self, digits=FLOAT_DIGITS):
+        self.digits = digits
+        self.count = 0
+        self.total = 0
+
+    def add(self, row):
+        self.count += 1
+        self.total = (self.total + _row_hash(row_key(row, self.digits))) % _HASH_MOD
+
+    def __eq__(self, other):
+        return self.count == other.count and self.total == other.total
+
+
+class OrderedDigest:
+    """
+    Per-row hashes of an ordered row stream, 16 bytes per row instead of the
+    rows themselves, to compare later streams against positionally.
+    """
+
+    def __init__(self, digits=FLOAT_DIGITS):
+        self.digits = digits
+        self.hashes = bytearray()
+
+    @property
+    def count(self):
+        return len(self.hashes) // 16
+
+    def add(self, row):
+        self.hashes += _row_digest(row_key(row, self.digits))
+
+    def matches(self, index, row):
+        return self.hashes[index * 16:(index + 1) * 16] == _row_digest(row_key(row, self.digits))
+
+
+def compare_row_streams(original_rows, rewritten_rows, ordered: bool, digits=FLOAT_DIGITS):
+    """
+    Compare two row iterables without materializing them.
+    Ordered: positional, stops at the first differing row.
+    Unordered: multiset digest of each side.
+    """
+    if ordered:
+        original_it, rewritten_it = iter(original_rows), iter(rewritten_rows)
+        index = 0
+        while True:
+            o_row = next(original_it, _END)
+            r_row = next(rewritten_it, _END)
+            if o_row is _END and r_row is _END:
+                return {"valid": True, "reason": "Results match in order", "rows_compared": index}
+            if o_row is _END or r_row is _END:
+                return {"valid": False, "reason": "Row count mismatch", "rows_compared": index}
+            if row_key(o_row, digits) != row_key(r_row, digits):
+                return {"valid": False, "reason": f"Row value mismatch at row {index}", "rows_compared": index}
+            index += 1
+
+    original_digest, rewritten_digest = MultisetDigest(digits), MultisetDigest(digits)
+    for row in original_rows:
+        original_digest.add(row)
+    for row in rewritten_rows:
+        rewritten_digest.add(row)
+    return digest_verdict(original_digest, rewritten_digest)
+
+
+def digest_verdict(original_digest, rewritten_digest):
+    if original_digest.count != rewritten_digest.count:
+        return {"valid": False, "reason": "Row count mismatch", "rows_compared": original_digest.count}
+    if original_digest != rewritten_digest:
+        return {"valid": False, "reason": "Row value mismatch", "rows_compared": original_digest.count}
+    return {"valid": True, "reason": "Results match (row order ignored)", "rows_compared": original_digest.count}
+
+
+async def compare_ordered_streams_async(original_rows, rewritten_rows, digits=FLOAT_DIGITS):
+    """Positional comparison of two async row streams, stopping at the first divergence."""
+    index = 0
+    while True:
+        o_row = await anext(original_rows, _END)
+        r_row = await anext(rewritten_rows, _END)
+        if o_row is _END and r_row is _END:
+            return {"valid": True, "reason": "Results match in order", "rows_compared": index}
+        if o_row is _END or r_row is _END:
+            return {"valid": False, "reason": "Row count mismatch", "rows_compared": index}
+        if row_key(o_row, digits) != row_key(r_row, digits):
+            return {"valid": False, "reason": f"Row value mismatch at row {index}", "rows_compared": index}
+        index += 1
 
-    # Number of rows must match
-    if len(original["rows"]) != len(rewritten["rows"]):
-        return {"valid": False, "reason": "Row count mismatch"}
 
-    # Normalize rows to ignore alias differences
-    original_norm = [normalize_row(r) for r in original["rows"]]
-    rewritten_norm = [normalize_row(r) for r in rewritten["rows"]]
+async def compare_to_ordered_digest_async(reference: OrderedDigest, rows):
+    """Positional comparison of an async row stream against an OrderedDigest, stopping at the first divergence."""
+    index = 0
+    async for row in rows:
+        if index >= reference.count:
+            return {"valid": False, "reason": "Row count mismatch", "rows_compared": index}
+        if not reference.matches(index, row):
+            return {"valid": False, "reason": f"Row value mismatch at row {index}", "rows_compared": index}
+        index += 1
+    if index != reference.count:
+        return {"valid": False, "reason": "Row count mismatch", "rows_compared": index}
+    return {"valid": True, "reason": "Results match in order", "rows_compared": index}
 
-    # Compare each row's values
-    for o_row, r_row in zip(original_norm, rewritten_norm):
-        if o_row != r_row:
-            return {"valid": False, "reason": "Row value mismatch"}
 
-    return {"valid": True, "reason": "Results match (alias differences ignored)"}
+async def digest_stream_async(rows, digits=FLOAT_DIGITS):
+    digest = MultisetDigest(digits)
+    async for row in rows:
+        digest.add(row)
+    return digest
@@ -1,7 +1,13 @@
 import os
+import time
+import threading
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from fastapi import HTTPException
 
 load_dotenv()
 
@@ -11,7 +17,19 @@ DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 DB_NAME = os.getenv("DB_NAME", "postgres")
 
-def get_connection():
+# Pool sizing / behaviour
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", "2"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", "20"))
+POOL_ACQUIRE_TIMEOUT_SEC = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+POOL_HEALTHCHECK_IDLE_SEC = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))
+POOL_MAX_LIFETIME_SEC = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+def _connect():
     return psycopg2.connect(
         host=DB_HOST,
         port=DB_PORT,
@@ -19,4 +37,277 @@ def get_connection():
         password=DB_PASSWORD,
         database=DB_NAME,
         cursor_factory=RealDictCursor
-    )
\ No newline at end of file
+    )
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    - keeps between min_size and max_size physical connections
+    - blocks up to `timeout` seconds when every connection is checked out
+    - pings connections that sat idle too long before handing them out
+    - recycles connections older than max_lifetime
+    """
+
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 timeout=POOL_ACQUIRE_TIMEOUT_SEC,
+                 healthcheck_idle=POOL_HEALTHCHECK_IDLE_SEC,
+                 max_lifetime=POOL_MAX_LIFETIME_SEC,
+                 connect=_connect):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("invalid pool size")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self.max_lifetime = max_lifetime
+        self._connect = connect
+
+        self._cond = threading.Condition()
+        self._idle = []        # [(conn, created_at, last_used)]
+        self._in_use = {}      # id(conn) → created_at
+        self._waiting = 0
+        self._closed = False
+
+        self._stats = {
+            "acquired": 0,
+            "released": 0,
+            "created": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "healthcheck_failures": 0,
+            "wait_ms_total": 0.0,
+        }
+
+        for _ in range(min_size):
+            try:
+                self._idle.append(self._new_entry())
+            except psycopg2.Error:
+                # DB not reachable yet — connections are created on demand
+                break
+
+    # ------------------------
+    # internals
+    # ------------------------
+    def _new_entry(self):
+        conn = self._connect()
+        self._stats["created"] += 1
+        now = time.monotonic()
+        return conn, now, now
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use)
+
+    def _discard(self, conn):
+        # Called with or without the (reentrant) lock held
+        with self._cond:
+            self._stats["discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, created_at, last_used):
+        if conn.closed:
+            return False
+
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            return False
+
+        if now - last_used > self.healthcheck_idle:
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.fetchone()
+                cur.close()
+                conn.rollback()
+            except Exception:
+                with self._cond:
+                    self._stats["healthcheck_failures"] += 1
+                return False
+
+        return True
+
+    # ------------------------
+    # public API
+    # ------------------------
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                    # Counted as in use while it is probed outside the lock,
+                    # so a slow connection doesn't hold up other callers
+                    self._in_use[id(conn)] = created_at
+                    self._cond.release()
+                    try:
+                        healthy = self._is_healthy(conn, created_at, last_used)
+                        if not healthy:
+                            self._discard(conn)
+                    finally:
+                        self._cond.acquire()
+                    if not healthy:
+                        del self._in_use[id(conn)]
+                        self._cond.notify()
+                        continue
+                    break
+
+                if self._size() < self.max_size:
+                    # reserve the slot, connect outside the lock
+                    placeholder = object()
+                    self._in_use[id(placeholder)] = None
+                    self._cond.release()
+                    try:
+                        conn, created_at, _ = self._new_entry()
+                    except Exception:
+                        self._cond.acquire()
+                        del self._in_use[id(placeholder)]
+                        self._cond.notify()
+                        raise
+                    self._cond.acquire()
+                    del self._in_use[id(placeholder)]
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No database connection available within {timeout}s"
+                    )
+
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_use[id(conn)] = created_at
+            self._stats["acquired"] += 1
+            self._stats["wait_ms_total"] += (time.monotonic() - start) * 1000
+
+        return conn
+
+    def putconn(self, conn, discard=False):
+        # Roll back outside the lock; the connection still counts as in use
+        if not discard and not conn.closed and not self._closed:
+            try:
+                # Never hand out a connection with an open transaction
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        else:
+            discard = True
+
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+            self._stats["released"] += 1
+            keep = not discard and created_at is not None and not self._closed
+            if keep:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+        if not keep:
+            self._discard(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for conn, _, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            acquired = self._stats["acquired"]
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size(),
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "waiting": self._waiting,
+                **{k: v for k, v in self._stats.items() if k != "wait_ms_total"},
+                "avg_wait_ms": round(self._stats["wait_ms_total"] / acquired, 3) if acquired else 0.0,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def get_connection(timeout=None):
+    """
+    Check a connection out of the pool.
+    Callers MUST hand it back with release_connection(); prefer `connection()`.
+    """
+    return get_pool().getconn(timeout)
+
+
+def release_connection(conn, discard=False):
+    get_pool().putconn(conn, discard=discard)
+
+
+@contextmanager
+def connection(timeout=None):
+    """Borrow a pooled connection for the duration of a `with` block."""
+    conn = get_connection(timeout)
+    broken = False
+    try:
+        yield conn
+    except psycopg2.InterfaceError:
+        broken = True
+        raise
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
+        raise
+    finally:
+        release_connection(conn, discard=broken or conn.closed)
+
+
+def get_db():
+    """FastAPI dependency: yields a pooled connection and always returns it."""
+    try:
+        conn = get_connection()
+    except PoolTimeout:
+        raise HTTPException(status_code=503, detail="Database is busy, please retry")
+
+    try:
+        yield conn
+    finally:
+        release_connection(conn, discard=bool(conn.closed))
@@ -1,7 +1,12 @@
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 import base64
+import binascii
+import hashlib
+import hmac
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # 32-byte key for AES-256
 AES_KEY = os.environ.get("AES_SECRET_KEY")
@@ -12,6 +17,19 @@ if AES_KEY is None:
 AES_KEY = AES_KEY.encode()  # convert to bytes
 BLOCK_SIZE = AES.block_size  # 16 bytes
 
+# Batches at least this large are split across a worker pool; the AES
+# calls are native and release the GIL.
+ENCRYPTION_WORKERS = int(os.environ.get("ENCRYPTION_WORKERS", str(min(8, os.cpu_count() or 1))))
+ENCRYPTION_PARALLEL_MIN = int(os.environ.get("ENCRYPTION_PARALLEL_MIN", "4096"))
+
+# Key for blind indexes (searchable hashes of encrypted columns).
+# Falls back to a key derived from AES_KEY so existing deployments keep working.
+BLIND_INDEX_KEY = os.environ.get("BLIND_INDEX_KEY")
+if BLIND_INDEX_KEY:
+    BLIND_INDEX_KEY = BLIND_INDEX_KEY.encode()
+else:
+    BLIND_INDEX_KEY = hmac.new(AES_KEY, b"promptsmith-blind-index", hashlib.sha256).digest()
+
 
 def pad(data: bytes):
     padding = BLOCK_SIZE - len(data) % BLOCK_SIZE
@@ -35,3 +53,134 @@ def decrypt_text(encoded: str) -> str:
     ct = raw[BLOCK_SIZE:]
     cipher = AES.new(AES_KEY, AES.MODE_CBC, iv=iv)
     return unpad(cipher.decrypt(ct)).decode()
+
+
+# ---------------------
+# BATCH API
+# ---------------------
+#
+# Same AES-256-CBC format as encrypt_text/decrypt_text (base64 of iv + ct).
+# Encryption draws every IV of a batch with one RNG call; decryption needs
+# a single cipher object (key schedule) per batch. Large batches are split
+# across a worker pool.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _encrypt_batch(texts):
+    ivs = get_random_bytes(BLOCK_SIZE * len(texts))
+    result = []
+    for i, text in enumerate(texts):
+        iv = ivs[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE]
+        ct = AES.new(AES_KEY, AES.MODE_CBC, iv=iv).encrypt(pad(text.encode()))
+        result.append(binascii.b2a_base64(iv + ct, newline=False).decode())
+    return result
+
+
+def _decrypt_chunk(values, fallback):
+    """
+    The raw iv + ct of every value are concatenated and decrypted by one CBC
+    cipher. In CBC each plaintext block depends only on its own ciphertext
+    block and the one before it, so every value's blocks come out right
+    (its IV is the block before its first one); the blocks decrypted at the
+    IV positions are discarded.
+    """
+    raws = []
+    for v in values:
+        try:
+            raw = binascii.a2b_base64(v)
+        except (binascii.Error, TypeError, ValueError):
+            raw = None
+        if raw is not None and (len(raw) < 2 * BLOCK_SIZE or len(raw) % BLOCK_SIZE):
+            raw = None
+        raws.append(raw)
+
+    stream = b"".join([r for r in raws if r is not None])
+    if stream:
+        plain = AES.new(AES_KEY, AES.MODE_CBC, iv=bytes(BLOCK_SIZE)).decrypt(stream)
+
+    result = []
+    offset = 0
+    for value, raw in zip(values, raws):
+        text = None
+        if raw is not None:
+            data = plain[offset + BLOCK_SIZE:offset + len(raw)]
+            offset += len(raw)
+            padding = data[-1]
+            if 1 <= padding <= BLOCK_SIZE:
+                try:
+                    text = data[:-padding].decode()
+                except UnicodeDecodeError:
+                    pass
+        if text is None:
+            text = value if fallback else None
+        result.append(text)
+    return result
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=ENCRYPTION_WORKERS, thread_name_prefix="crypto")
+    return _pool
+
+
+def _run_batch(fn, values, *args):
+    if len(values) < ENCRYPTION_PARALLEL_MIN or ENCRYPTION_WORKERS <= 1:
+        return fn(values, *args)
+
+    size = -(-len(values) // ENCRYPTION_WORKERS)
+    chunks = [values[i:i + size] for i in range(0, len(values), size)]
+    result = []
+    for part in _get_pool().map(lambda chunk: fn(chunk, *args), chunks):
+        result.extend(part)
+    return result
+
+
+def encrypt_many(texts) -> list:
+    """encrypt_text over a list; None and "" are passed through unchanged."""
+    texts = list(texts)
+    todo = [i for i, t in enumerate(texts) if t]
+    encrypted = _run_batch(_encrypt_batch, [texts[i] for i in todo])
+    for i, value in zip(todo, encrypted):
+        texts[i] = value
+    return texts
+
+
+def decrypt_many(values, fallback: bool = True) -> list:
+    """
+    decrypt_text over a list; None and "" are passed through unchanged.
+    Values that don't decrypt (e.g. rows stored before encryption) are
+    returned as-is, or as None when fallback is False.
+    """
+    values = list(values)
+    todo = [i for i, v in enumerate(values) if v]
+    decrypted = _run_batch(_decrypt_chunk, [values[i] for i in todo], fallback)
+    for i, value in zip(todo, decrypted):
+        values[i] = value
+    return values
+
+
+def decrypt_rows(rows, fields):
+    """Decrypt the given fields of every row in place, as one batch."""
+    fields = list(fields)
+    cells = [(r, f) for r in rows for f in fields if r.get(f)]
+    for (r, f), value in zip(cells, decrypt_many([r[f] for r, f in cells])):
+        r[f] = value
+    return rows
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def email_blind_index(email: str) -> str:
+    """
+    Deterministic keyed hash of a normalized email.
+    Stored next to the AES ciphertext so lookups can hit an index
+    without revealing the address.
+    """
+    return hmac.new(BLIND_INDEX_KEY, normalize_email(email).encode(), hashlib.sha256).hexdigest()
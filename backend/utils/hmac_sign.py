@@ -3,11 +3,15 @@ import hashlib
 import json
 import os
 
+from utils.tracing import span
+
 SECRET_KEY = os.getenv("HMAC_SECRET_KEY", "super-secret-hmac-key")
 
 def generate_signature(data):
-    json_data = json.dumps(data, sort_keys=True, separators=(',', ':'))
-    signature = hmac.new(SECRET_KEY.encode(), json_data.encode(), hashlib.sha256).hexdigest()
+    with span("hmac.sign") as s:
+        json_data = json.dumps(data, sort_keys=True, separators=(',', ':'))
+        signature = hmac.new(SECRET_KEY.encode(), json_data.encode(), hashlib.sha256).hexdigest()
+        s.set(bytes=len(json_data))
     return signature
 
 
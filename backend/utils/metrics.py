@@ -0,0 +1,232 @@
+import time
+import bisect
+import threading
+
+# Minimal in-process metrics with Prometheus text exposition.
+#
+# Counters, gauges and histograms are updated on the request path, so each
+# update is one dict lookup for the label set plus a short locked section.
+# State that other modules already count (cache hits, pool usage, limiter
+# keys) is read only at scrape time through registered collectors.
+
+# Seconds; spans sub-millisecond cache hits up to slow LLM calls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, n=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, n=1):
+        self.inc(*labels, n=-n)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        # Per-bucket (non-cumulative) counts; render() accumulates them
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._values.get(labels)
+            if child is None:
+                child = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            child[0][i] += 1
+            child[1] += value
+            child[2] += 1
+
+    def snapshot(self, *labels):
+        """(count, sum) observed for a label set."""
+        child = self._values.get(labels)
+        return (child[2], child[1]) if child else (0, 0.0)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = [(labels, list(c[0]), c[1], c[2]) for labels, c in self._values.items()]
+        for labels, counts, total, count in items:
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                running += n
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {running}")
+            base = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{base} {_format_number(total)}")
+            lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+
+def register_collector(collect):
+    """
+    collect() → iterable of (name, kind, help, [(labels dict, value), ...]),
+    evaluated at scrape time only.
+    """
+    _collectors.append(collect)
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+
+    for collect in _collectors:
+        try:
+            families = list(collect())
+        except Exception:
+            # A broken source must not take the whole scrape down
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_number(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------
+# SHARED METRICS
+# ---------------------
+
+STAGE_SECONDS = Histogram(
+    "promptsmith_stage_seconds", "Latency of pipeline stages (see utils.timing.stage)", ["stage"]
+)
+HTTP_REQUESTS = Counter(
+    "promptsmith_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+)
+HTTP_SECONDS = Histogram(
+    "promptsmith_http_request_seconds", "HTTP request latency by route", ["method", "route"]
+)
+IN_FLIGHT = Gauge(
+    "promptsmith_requests_in_flight", "HTTP requests currently being handled"
+)
+# Stages in flight = started - finished (the histogram count), derived at
+# scrape time so stage() takes one lock on entry and one on exit
+STAGE_STARTED = Counter(
+    "promptsmith_stage_started_total", "Pipeline stages entered", ["stage"]
+)
+LLM_CALLS = Counter(
+    "promptsmith_llm_calls_total", "LLM calls by provider, operation and outcome", ["provider", "operation", "outcome"]
+)
+LLM_SECONDS = Histogram(
+    "promptsmith_llm_call_seconds", "LLM call latency", ["provider", "operation"]
+)
+RATE_LIMITED = Counter(
+    "promptsmith_rate_limited_total", "Requests refused with 429", ["endpoint"]
+)
+UNSAFE_REJECTIONS = Counter(
+    "promptsmith_unsafe_rejections_total", "Requests refused by the safety checks", ["kind"]
+)
+RESULT_CACHE_BYPASS = Counter(
+    "promptsmith_result_cache_bypass_total", "run_sql calls that skipped the result cache", ["reason"]
+)
+
+
+
+def _stage_in_flight():
+    yield "promptsmith_stage_in_flight", "gauge", "Requests currently inside each pipeline stage", [
+        ({"stage": labels[0]}, max(0, started - STAGE_SECONDS.snapshot(*labels)[0]))
+        for labels, started in list(STAGE_STARTED._values.items())
+    ]
+
+
+register_collector(_stage_in_flight)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request count, latency (until the last body
+    chunk, so streamed responses are timed in full) and in-flight requests.
+    Routes are labelled by their path template to keep label sets bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - start, scope["method"], path)
+            HTTP_REQUESTS.inc(scope["method"], path, str(status[0]))
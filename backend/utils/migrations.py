@@ -0,0 +1,394 @@
+"""
+Versioned schema migrations for the app's own tables.
+
+Each migration is (version, name, statements) and runs once; applied
+versions are recorded in schema_migrations. Statements are written to be
+idempotent as well, so databases whose tables were created by hand converge
+on the same schema. Pending migrations run in one transaction under an
+advisory lock, so workers starting together apply them exactly once.
+
+    cd backend && python -m utils.migrations            # apply pending
+    cd backend && python -m utils.migrations --status   # list versions
+    cd backend && python -m utils.migrations --check    # report missing indexes
+"""
+import os
+import sys
+import json
+import argparse
+
+from utils.db import connection
+from utils.cache import CACHE_TABLE_DDL
+from utils.rate_limit_store import COUNTERS_TABLE_DDL, PG_TABLE as RATE_LIMIT_TABLE
+
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+
+# Arbitrary application-wide id for pg_advisory_xact_lock
+MIGRATION_LOCK_ID = 48151623
+
+MIGRATIONS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+"""
+
+
+def _cascade_fk(table, column, ref_table):
+    """
+    Make table.column reference ref_table(id) ON DELETE CASCADE, replacing a
+    non-cascading foreign key if one was created by hand. Added NOT VALID so
+    existing rows aren't rescanned under lock; deletes cascade either way.
+    """
+    return f"""
+    DO $$
+    DECLARE r record;
+    BEGIN
+        FOR r IN
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = '{table}'::regclass AND confrelid = '{ref_table}'::regclass
+              AND contype = 'f' AND confdeltype <> 'c'
+        LOOP
+            EXECUTE format('ALTER TABLE {table} DROP CONSTRAINT %I', r.conname);
+        END LOOP;
+
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint
+            WHERE conrelid = '{table}'::regclass AND confrelid = '{ref_table}'::regclass AND contype = 'f'
+        ) THEN
+            ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey
+                FOREIGN KEY ({column}) REFERENCES {ref_table}(id) ON DELETE CASCADE NOT VALID;
+        END IF;
+    END $$
+    """
+
+
+MIGRATIONS = [
+    (1, "core tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            role VARCHAR(20) NOT NULL DEFAULT 'user',
+            bio TEXT,
+            avatar_emoji TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            title TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id SERIAL PRIMARY KEY,
+            chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+            user_message TEXT,
+            ai_response TEXT,
+            raw_sql TEXT,
+            final_sql TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        # Hand-made tables may predate these columns; existing rows keep NULL
+        # rather than claiming the migration time as their creation time
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ",
+        "ALTER TABLE users ALTER COLUMN created_at SET DEFAULT NOW()",
+        "ALTER TABLE chats ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ",
+        "ALTER TABLE chats ALTER COLUMN created_at SET DEFAULT NOW()",
+        "ALTER TABLE chats ALTER COLUMN updated_at SET DEFAULT NOW()",
+        "ALTER TABLE chat_messages ALTER COLUMN created_at SET DEFAULT NOW()",
+    ]),
+    (2, "email blind index", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS email_hash VARCHAR(64)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS users_email_hash_key ON users (email_hash)",
+        # Keeps the "rows still missing a hash" scan cheap once the backfill has run
+        "CREATE INDEX IF NOT EXISTS users_email_hash_missing_idx ON users (id) WHERE email_hash IS NULL",
+    ]),
+    (3, "chat keyset indexes", [
+        # Also serve the ON DELETE CASCADE lookups from users and chats
+        "CREATE INDEX IF NOT EXISTS chats_user_updated_idx ON chats (user_id, updated_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS chat_messages_chat_created_idx ON chat_messages (chat_id, created_at DESC, id DESC)",
+    ]),
+    (4, "cascading deletes", [
+        _cascade_fk("chats", "user_id", "users"),
+        _cascade_fk("chat_messages", "chat_id", "chats"),
+    ]),
+    (5, "shared cache and rate limit tables", [
+        CACHE_TABLE_DDL.format(table="app_cache"),
+        COUNTERS_TABLE_DDL.format(table=RATE_LIMIT_TABLE),
+    ]),
+
+    (6, "incremental analytics counters", [
+        # Counts are split over 8 shard rows per metric so concurrent writers
+        # rarely queue on the same row lock; readers sum the shards
+        """
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            metric TEXT NOT NULL,
+            shard SMALLINT NOT NULL,
+            count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (metric, shard)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day DATE NOT NULL,
+            metric TEXT NOT NULL,
+            shard SMALLINT NOT NULL,
+            count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, metric, shard)
+        )
+        """,
+        # Statement-level with transition tables: one counter update per
+        # statement, including each cascade step of a user/chat delete
+        """
+        CREATE OR REPLACE FUNCTION stats_count_rows() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            n BIGINT;
+            s SMALLINT := pg_backend_pid() % 8;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT count(*) INTO n FROM new_rows;
+            ELSE
+                SELECT -count(*) INTO n FROM old_rows;
+            END IF;
+            IF n = 0 THEN
+                RETURN NULL;
+            END IF;
+
+            INSERT INTO stats_totals (metric, shard, count) VALUES (TG_ARGV[0], s, n)
+            ON CONFLICT (metric, shard) DO UPDATE SET count = stats_totals.count + EXCLUDED.count;
+
+            -- The daily series counts rows created per day; deletes don't rewrite history
+            IF n > 0 THEN
+                INSERT INTO stats_daily (day, metric, shard, count) VALUES (CURRENT_DATE, TG_ARGV[0], s, n)
+                ON CONFLICT (day, metric, shard) DO UPDATE SET count = stats_daily.count + EXCLUDED.count;
+            END IF;
+            RETURN NULL;
+        END $$
+        """,
+        # Seed from the existing rows with writers held off, so nothing is
+        # counted twice or missed between the seed and the triggers
+        "LOCK TABLE users, chats, chat_messages IN SHARE ROW EXCLUSIVE MODE",
+        *[
+            stmt
+            for table, metric in (("users", "users"), ("chats", "chats"), ("chat_messages", "messages"))
+            for stmt in (
+                f"""
+                INSERT INTO stats_totals (metric, shard, count)
+                SELECT '{metric}', 0, count(*) FROM {table}
+                ON CONFLICT (metric, shard) DO UPDATE SET count = EXCLUDED.count
+                """,
+                f"""
+                INSERT INTO stats_daily (day, metric, shard, count)
+                SELECT created_at::date, '{metric}', 0, count(*) FROM {table}
+                WHERE created_at IS NOT NULL GROUP BY 1
+                ON CONFLICT (day, metric, shard) DO UPDATE SET count = EXCLUDED.count
+                """,
+                f"DROP TRIGGER IF EXISTS {table}_stats_insert ON {table}",
+                f"""
+                CREATE TRIGGER {table}_stats_insert AFTER INSERT ON {table}
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION stats_count_rows('{metric}')
+                """,
+                f"DROP TRIGGER IF EXISTS {table}_stats_delete ON {table}",
+                f"""
+                CREATE TRIGGER {table}_stats_delete AFTER DELETE ON {table}
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION stats_count_rows('{metric}')
+                """,
+            )
+        ],
+    ]),
+    (7, "llm usage telemetry", [
+        # No foreign key on user_id: telemetry outlives deleted users and
+        # inserts shouldn't pay for FK checks
+        """
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            user_id INTEGER,
+            endpoint TEXT,
+            operation TEXT,
+            provider TEXT NOT NULL,
+            model TEXT,
+            prompt_chars INTEGER,
+            response_chars INTEGER,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            latency_ms DOUBLE PRECISION NOT NULL,
+            outcome TEXT NOT NULL,
+            error TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS llm_usage_created_idx ON llm_usage (created_at)",
+        "CREATE INDEX IF NOT EXISTS llm_usage_user_created_idx ON llm_usage (user_id, created_at)",
+    ]),
+    (8, "profile columns", [
+        # Read and written by /profile; hand-made users tables may also lack
+        # the other optional profile fields
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_image TEXT",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS bio TEXT",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_emoji TEXT",
+    ]),
+]
+
+# Access paths of the hot queries: (table, leading index columns, query)
+HOT_QUERIES = [
+    ("users", ["email_hash"], "login / register lookup by email"),
+    ("chats", ["user_id", "updated_at"], "/chats/list keyset page"),
+    ("chat_messages", ["chat_id", "created_at"], "/chats/{id}/messages keyset page"),
+    ("llm_usage", ["created_at"], "/admin/llm-usage rollups and retention"),
+]
+
+# Foreign keys the delete endpoints rely on to cascade: (table, referenced table)
+CASCADES = [
+    ("chats", "users"),
+    ("chat_messages", "chats"),
+]
+
+
+def _applied_versions(cur):
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row["version"] for row in cur.fetchall()}
+
+
+def apply_migrations(target: int = None, dry_run: bool = False):
+    """Apply pending migrations (up to `target`) in a single transaction."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        cur.execute(MIGRATIONS_TABLE_DDL)
+        applied = _applied_versions(cur)
+
+        ran = []
+        for version, name, statements in MIGRATIONS:
+            if version in applied or (target is not None and version > target):
+                continue
+            for stmt in statements:
+                cur.execute(stmt)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            ran.append({"version": version, "name": name})
+
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+        cur.close()
+
+    return {
+        "success": True,
+        "applied": ran,
+        "dry_run": dry_run,
+        "current": max(applied | {m["version"] for m in ran}, default=0),
+    }
+
+
+def migration_status():
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(MIGRATIONS_TABLE_DDL)
+        cur.execute("SELECT version, applied_at FROM schema_migrations")
+        applied = {row["version"]: row["applied_at"] for row in cur.fetchall()}
+        conn.commit()
+        cur.close()
+
+    return [
+        {"version": version, "name": name, "applied_at": applied.get(version)}
+        for version, name, _ in MIGRATIONS
+    ]
+
+
+def _index_columns(cur, table):
+    """Key columns of every valid, non-partial index on `table`, in order."""
+    cur.execute(
+        """
+        SELECT i.relname AS index_name,
+               array_agg(a.attname ORDER BY k.ord) AS columns
+        FROM pg_index x
+        JOIN pg_class t ON t.oid = x.indrelid
+        JOIN pg_class i ON i.oid = x.indexrelid
+        CROSS JOIN LATERAL unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+        WHERE t.relname = %s AND t.relkind = 'r'
+          AND x.indisvalid AND x.indpred IS NULL
+          AND k.ord <= x.indnkeyatts
+        GROUP BY i.relname
+        """,
+        (table,)
+    )
+    return {row["index_name"]: list(row["columns"]) for row in cur.fetchall()}
+
+
+def check_indexes():
+    """
+    Report hot queries with no index whose leading columns match their
+    filter + sort, and foreign keys the delete endpoints expect to cascade.
+    """
+    missing = []
+    covered = []
+    non_cascading = []
+
+    with connection() as conn:
+        cur = conn.cursor()
+        for table, columns, query in HOT_QUERIES:
+            indexes = _index_columns(cur, table)
+            match = next((name for name, cols in indexes.items() if cols[:len(columns)] == columns), None)
+            entry = {"table": table, "columns": columns, "query": query}
+            if match:
+                covered.append({**entry, "index": match})
+            else:
+                missing.append(entry)
+
+        for table, ref_table in CASCADES:
+            cur.execute(
+                """
+                SELECT conname, confdeltype FROM pg_constraint
+                WHERE conrelid = to_regclass(%s) AND confrelid = to_regclass(%s) AND contype = 'f'
+                """,
+                (table, ref_table)
+            )
+            rows = cur.fetchall()
+            if not rows or any(r["confdeltype"] != "c" for r in rows):
+                non_cascading.append({"table": table, "references": ref_table,
+                                      "constraints": [r["conname"] for r in rows]})
+        conn.commit()
+        cur.close()
+
+    return {
+        "success": not missing and not non_cascading,
+        "missing_indexes": missing,
+        "covered": covered,
+        "non_cascading_foreign_keys": non_cascading,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply or inspect PromptSmith schema migrations")
+    parser.add_argument("--target", type=int, help="Apply migrations up to this version")
+    parser.add_argument("--dry-run", action="store_true", help="Run pending migrations, then roll back")
+    parser.add_argument("--status", action="store_true", help="List migrations and when they were applied")
+    parser.add_argument("--check", action="store_true", help="Report missing indexes and cascades")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        result = migration_status()
+    elif args.check:
+        result = check_indexes()
+    else:
+        result = apply_migrations(args.target, args.dry_run)
+
+    print(json.dumps(result, indent=2, default=str))
+    if isinstance(result, dict) and not result["success"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import base64
+from datetime import datetime
+
+from fastapi import HTTPException
+
+# Keyset pagination: a page is "rows strictly past (sort_value, id)" in the
+# listing order, so fetching page N costs the same as page 1 and rows
+# inserted meanwhile never shift or duplicate entries across pages.
+
+DEFAULT_PAGE_SIZE = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+MAX_PAGE_SIZE = int(os.getenv("PAGE_SIZE_MAX", "200"))
+
+# Header carrying the cursor for endpoints whose body is a bare list
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    raw = f"{sort_value.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Return (sort_value, id) from an opaque cursor, or raise 400."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, _, row_id = base64.urlsafe_b64decode(padded).decode().rpartition("|")
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+
+def clamp_limit(limit: int, cursor: str = None):
+    """
+    Page size for a request. None (no LIMIT) when neither `limit` nor
+    `cursor` was sent, so clients that don't page keep getting every row.
+    """
+    if limit is None:
+        return DEFAULT_PAGE_SIZE if cursor else None
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_fields(fields: str, allowed, default):
+    """
+    Parse a comma-separated field selection ("title", "user_message,final_sql").
+    Unknown names are a 400 so typos don't silently return empty rows.
+    """
+    if not fields:
+        return list(default)
+
+    selected = []
+    for name in fields.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in allowed:
+            raise HTTPException(400, f"Unknown field '{name}' (expected one of {', '.join(allowed)})")
+        if name not in selected:
+            selected.append(name)
+    return selected
+
+
+def split_page(rows, limit, sort_key):
+    """
+    Rows were fetched with LIMIT limit + 1; trim the extra row and return
+    (page, next_cursor), next_cursor being None on the last page or when
+    the listing is unpaginated (limit None).
+    """
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    last = page[-1]
+    return page, encode_cursor(last[sort_key], last["id"])
@@ -0,0 +1,191 @@
+import os
+import time
+import struct
+import hashlib
+import threading
+
+from utils.db import connection
+
+# Shared per-window request counters, so every uvicorn worker (or host)
+# enforces the same allowance. Both stores expose one atomic operation:
+#   add(key, window_start, window, delta) → (previous_window_count, current_window_count)
+
+SHM_NAME = os.getenv("RATE_LIMIT_SHM_NAME", "promptsmith_ratelimit")
+SHM_SLOTS = int(os.getenv("RATE_LIMIT_SHM_SLOTS", "65536"))
+SHM_LOCK_PATH = os.getenv("RATE_LIMIT_SHM_LOCK", f"/tmp/{SHM_NAME}.lock")
+
+PG_TABLE = "rate_limit_counters"
+PG_CLEANUP_SEC = float(os.getenv("RATE_LIMIT_PG_CLEANUP_SEC", "60"))
+
+COUNTERS_TABLE_DDL = """
+    CREATE UNLOGGED TABLE IF NOT EXISTS {table} (
+        key TEXT NOT NULL,
+        window_start DOUBLE PRECISION NOT NULL,
+        count INTEGER NOT NULL,
+        expires_at DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (key, window_start)
+    )
+"""
+
+
+def key_hash(key) -> int:
+    """Process-independent 64-bit hash (builtin hash() is salted per process)."""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1   # 0 marks an empty slot
+
+
+class SharedMemoryStore:
+    """
+    Counters in a shared-memory hash table for workers on one host.
+
+    The table is split into groups of GROUP_SIZE slots; a key probes only its
+    own group, and each group is guarded by an fcntl byte-range lock on a
+    lock file, so workers contend only when their keys share a group.
+    When a group is full the slot that expires first is reused.
+    """
+
+    blocking = False
+
+    SLOT = struct.Struct("<QddII")   # key hash, window_start, expires_at, previous, current
+    GROUP_SIZE = 16
+
+    def __init__(self, name=SHM_NAME, slots=SHM_SLOTS, lock_path=SHM_LOCK_PATH):
+        import fcntl
+        from multiprocessing import shared_memory
+
+        self._fcntl = fcntl
+        self.groups = max(1, slots // self.GROUP_SIZE)
+        size = self.groups * self.GROUP_SIZE * self.SLOT.size
+
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        # The segment outlives any single worker; don't let this process's
+        # resource tracker unlink it at exit
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        except Exception:
+            pass
+
+        self._buf = self._shm.buf
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        # fcntl locks are per process; threads of one worker serialize here
+        self._thread_locks = [threading.Lock() for _ in range(64)]
+        self.ops = 0
+        self.evictions = 0
+
+    def _slot_offset(self, group, index):
+        return (group * self.GROUP_SIZE + index) * self.SLOT.size
+
+    def add(self, key, window_start, window, delta):
+        h = key_hash(key)
+        group = h % self.groups
+        now = time.time()
+
+        with self._thread_locks[group % len(self._thread_locks)]:
+            self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_EX, 1, group)
+            try:
+                target, victim, victim_expires = None, None, None
+                for i in range(self.GROUP_SIZE):
+                    offset = self._slot_offset(group, i)
+                    slot_hash, _, expires_at, _, _ = self.SLOT.unpack_from(self._buf, offset)
+                    if slot_hash == h:
+                        target = offset
+                        break
+                    if slot_hash == 0 or expires_at <= now:
+                        if victim is None or victim_expires > 0:
+                            victim, victim_expires = offset, 0
+                    elif victim is None or expires_at < victim_expires:
+                        victim, victim_expires = offset, expires_at
+
+                if target is None:
+                    target = victim
+                    if victim_expires:
+                        self.evictions += 1
+                    slot = (h, window_start, 0.0, 0, 0)
+                else:
+                    slot = self.SLOT.unpack_from(self._buf, target)
+
+                _, slot_start, _, previous, current = slot
+                if slot_start != window_start:
+                    previous = current if window_start - slot_start == window else 0
+                    current = 0
+
+                current = max(0, current + delta)
+                self.SLOT.pack_into(self._buf, target, h, window_start, window_start + 2 * window, previous, current)
+                self.ops += 1
+                return previous, current
+            finally:
+                self._fcntl.lockf(self._lock_fd, self._fcntl.LOCK_UN, 1, group)
+
+    def stats(self):
+        return {"backend": "shm", "slots": self.groups * self.GROUP_SIZE, "ops": self.ops, "evictions": self.evictions}
+
+
+class PostgresStore:
+    """
+    Counters in an UNLOGGED Postgres table for workers on several hosts.
+    Each add is one atomic upsert that also reads the previous window.
+    """
+
+    blocking = True
+
+    def __init__(self, table=PG_TABLE):
+        self.table = table
+        self.ops = 0
+        self._ready = False
+        self._cleaned_at = 0.0
+
+    def _ensure_table(self, cur):
+        if self._ready:
+            return
+        cur.execute(COUNTERS_TABLE_DDL.format(table=self.table))
+        self._ready = True
+
+    def add(self, key, window_start, window, delta):
+        key = repr(key)
+        now = time.time()
+
+        with connection() as conn:
+            cur = conn.cursor()
+            self._ensure_table(cur)
+            cur.execute(
+                f"""
+                WITH up AS (
+                    INSERT INTO {self.table} (key, window_start, count, expires_at)
+                    VALUES (%s, %s, GREATEST(%s, 0), %s)
+                    ON CONFLICT (key, window_start)
+                    DO UPDATE SET count = GREATEST({self.table}.count + %s, 0)
+                    RETURNING count
+                )
+                SELECT
+                    COALESCE((SELECT count FROM {self.table} WHERE key = %s AND window_start = %s), 0) AS previous,
+                    (SELECT count FROM up) AS current
+                """,
+                # The raw delta goes to the update: a refund (-1) must subtract
+                (key, window_start, delta, window_start + 2 * window, delta, key, window_start - window)
+            )
+            row = cur.fetchone()
+
+            if now - self._cleaned_at > PG_CLEANUP_SEC:
+                cur.execute(f"DELETE FROM {self.table} WHERE expires_at < %s", (now,))
+                self._cleaned_at = now
+
+            conn.commit()
+            cur.close()
+
+        self.ops += 1
+        return row["previous"], row["current"]
+
+    def stats(self):
+        return {"backend": "postgres", "table": self.table, "ops": self.ops}
+
+
+def build_store(backend: str):
+    if backend == "shm":
+        return SharedMemoryStore()
+    if backend == "postgres":
+        return PostgresStore()
+    raise ValueError(f"Unknown rate limit backend '{backend}'")
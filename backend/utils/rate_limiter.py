@@ -1,50 +1,412 @@
+import os
+import math
+import asyncio
 import time
+import threading
 from fastapi import HTTPException
 
-# user_id → { count, reset_time }
-RATE_STATE = {}
+from utils.metrics import RATE_LIMITED
 
-MAX_REQUESTS = 5         # allowed
-WINDOW_SEC = 60          # per minute
-CLEANUP_THRESHOLD = 1000 # Clean up when this many keys exist
+# Default allowance: MAX_REQUESTS per WINDOW_SEC for every endpoint without
+# its own policy. Per-endpoint overrides come from RATE_LIMIT_POLICIES, e.g.
+#   RATE_LIMIT_POLICIES="nl_to_sql=token_bucket:5/60,rewrite_sql=sliding_window:20/60"
+MAX_REQUESTS = int(os.getenv("RATE_LIMIT_MAX_REQUESTS", "5"))
+WINDOW_SEC = float(os.getenv("RATE_LIMIT_WINDOW_SEC", "60"))
+ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
 
-def _cleanup_expired_entries(now: float):
-    """Remove expired entries from RATE_STATE to prevent memory leak"""
-    expired_keys = [
-        key for key, data in RATE_STATE.items()
-        if now >= data["reset"]
-    ]
-    for key in expired_keys:
-        del RATE_STATE[key]
+# Independent locks/state shards; a request only locks its own key's stripe
+STRIPES = int(os.getenv("RATE_LIMIT_STRIPES", "64"))
+# Expiry timing-wheel slot width
+EXPIRY_TICK_SEC = 1.0
 
-def rate_limit(user_id: int, endpoint="general"):
-    now = time.time()
-    key = f"{endpoint}:{user_id}"
-
-    # Periodic cleanup to prevent memory leak
-    if len(RATE_STATE) > CLEANUP_THRESHOLD:
-        _cleanup_expired_entries(now)
-
-    data = RATE_STATE.get(key)
-    
-    # If no data or window expired, reset
-    if data is None or now >= data["reset"]:
-        data = {
-            "count": 0,
-            "reset": now + WINDOW_SEC
+# Where counters live: "memory" (per worker), "shm" (shared by the workers of
+# one host) or "postgres" (shared across hosts). Shared backends enforce every
+# policy as a sliding window and batch increments locally: a key may grant up
+# to RATE_LIMIT_BATCH requests between syncs, but never more than
+# RATE_LIMIT_HEADROOM of its remaining allowance, and syncs at least every
+# RATE_LIMIT_SYNC_SEC. RATE_LIMIT_BATCH=1 checks the shared store on every
+# request (exact); larger values trade accuracy near the limit for latency.
+BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+BATCH = int(os.getenv("RATE_LIMIT_BATCH", "10"))
+HEADROOM = float(os.getenv("RATE_LIMIT_HEADROOM", "0.25"))
+SYNC_SEC = float(os.getenv("RATE_LIMIT_SYNC_SEC", "1.0"))
+# After a store error, decide on local counts for this long before retrying
+STORE_RETRY_SEC = float(os.getenv("RATE_LIMIT_STORE_RETRY_SEC", "5"))
+
+
+class RatePolicy:
+    """
+    token_bucket: bursts up to `limit`, refilled continuously at limit/window.
+    sliding_window: at most `limit` requests in any `window` (two-bucket
+    weighted approximation, O(1) memory per key).
+    """
+
+    KINDS = ("token_bucket", "sliding_window")
+
+    def __init__(self, limit: int, window: float, kind: str = "token_bucket"):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown rate limit policy '{kind}'")
+        self.limit = limit
+        self.window = window
+        self.kind = kind
+        self.rate = limit / window
+
+    def __repr__(self):
+        return f"{self.kind}:{self.limit}/{self.window:g}"
+
+
+def parse_policies(spec: str):
+    """'endpoint=kind:limit/window,...' → {endpoint: RatePolicy}"""
+    policies = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        endpoint, _, rule = item.partition("=")
+        kind, _, numbers = rule.partition(":")
+        limit, _, window = numbers.partition("/")
+        policies[endpoint.strip()] = RatePolicy(int(limit), float(window), kind.strip())
+    return policies
+
+
+DEFAULT_POLICY = RatePolicy(MAX_REQUESTS, WINDOW_SEC)
+POLICIES = parse_policies(os.getenv("RATE_LIMIT_POLICIES", ""))
+
+
+def _window_retry(previous, current, limit, window, start, now):
+    """Seconds until one more request fits a sliding window holding these counts."""
+    if current + 1 > limit:
+        # The current window alone is full: wait for it to end, then for
+        # enough of it (as the next "previous" window) to slide out
+        return start + window - now + window * (1 - (limit - 1) / current)
+    # Wait until enough of the previous window has slid out
+    estimated = previous * (1 - (now - start) / window) + current
+    return (estimated + 1 - limit) / previous * window
+
+
+class Decision:
+    __slots__ = ("allowed", "remaining", "retry_after")
+
+    def __init__(self, allowed, remaining, retry_after):
+        self.allowed = allowed
+        self.remaining = remaining
+        self.retry_after = retry_after
+
+
+class _Stripe:
+    """
+    One shard of limiter state. Keys are also filed in a timing wheel by the
+    tick at which their state becomes "fresh" again (bucket refilled /
+    window rolled off), so expiry costs amortized O(1) per request.
+    """
+
+    __slots__ = ("lock", "state", "wheel", "swept_tick")
+
+    def __init__(self, now_tick):
+        self.lock = threading.Lock()
+        self.state = {}    # key → [a, b, c, expires_at, wheel_tick]
+        self.wheel = {}    # tick → [keys]
+        self.swept_tick = now_tick
+
+    def sweep(self, now, now_tick):
+        if now_tick <= self.swept_tick:
+            return
+        if now_tick - self.swept_tick > len(self.wheel):
+            # Long idle gap: visiting the occupied slots is cheaper than every tick
+            due = [tick for tick in self.wheel if tick <= now_tick]
+        else:
+            due = range(self.swept_tick + 1, now_tick + 1)
+
+        for tick in due:
+            for key in self.wheel.pop(tick, ()):
+                entry = self.state.get(key)
+                # Entries refreshed since filing were re-filed under a later tick
+                if entry is not None and entry[4] == tick and entry[3] <= now:
+                    del self.state[key]
+        self.swept_tick = now_tick
+
+    def file(self, key, entry, expires_at):
+        entry[3] = expires_at
+        tick = int(expires_at // EXPIRY_TICK_SEC) + 1
+        if entry[4] != tick:
+            entry[4] = tick
+            self.wheel.setdefault(tick, []).append(key)
+
+
+class RateLimiter:
+    def __init__(self, stripes: int = STRIPES):
+        now_tick = int(time.monotonic() // EXPIRY_TICK_SEC)
+        self._stripes = [_Stripe(now_tick) for _ in range(stripes)]
+
+    def hit(self, key, policy: RatePolicy, now: float = None) -> Decision:
+        """Consume one request for `key` under `policy`."""
+        now = time.monotonic() if now is None else now
+        stripe = self._stripes[hash(key) % len(self._stripes)]
+
+        with stripe.lock:
+            stripe.sweep(now, int(now // EXPIRY_TICK_SEC))
+            if policy.kind == "token_bucket":
+                return self._token_bucket(stripe, key, policy, now)
+            return self._sliding_window(stripe, key, policy, now)
+
+    @staticmethod
+    def _token_bucket(stripe, key, policy, now):
+        entry = stripe.state.get(key)
+        if entry is None:
+            # [tokens, updated_at, unused, expires_at, wheel_tick]
+            entry = stripe.state[key] = [float(policy.limit), now, 0, 0.0, None]
+
+        tokens = min(policy.limit, entry[0] + (now - entry[1]) * policy.rate)
+        entry[1] = now
+
+        if tokens >= 1:
+            tokens -= 1
+            decision = Decision(True, int(tokens), 0.0)
+        else:
+            decision = Decision(False, 0, (1 - tokens) / policy.rate)
+
+        entry[0] = tokens
+        stripe.file(key, entry, now + (policy.limit - tokens) / policy.rate)
+        return decision
+
+    @staticmethod
+    def _sliding_window(stripe, key, policy, now):
+        window = policy.window
+        start = now - now % window
+        entry = stripe.state.get(key)
+        if entry is None:
+            # [window_start, previous_count, current_count, expires_at, wheel_tick]
+            entry = stripe.state[key] = [start, 0, 0, 0.0, None]
+
+        if entry[0] != start:
+            # Roll forward; anything older than the previous window no longer counts
+            entry[1] = entry[2] if start - entry[0] == window else 0
+            entry[2] = 0
+            entry[0] = start
+
+        previous_weight = 1 - (now - start) / window
+        estimated = entry[1] * previous_weight + entry[2]
+
+        if estimated + 1 <= policy.limit:
+            entry[2] += 1
+            decision = Decision(True, int(policy.limit - estimated - 1), 0.0)
+        else:
+            decision = Decision(False, 0, _window_retry(entry[1], entry[2], policy.limit, window, start, now))
+
+        stripe.file(key, entry, start + 2 * window)
+        return decision
+
+    def reset(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.state.clear()
+                stripe.wheel.clear()
+
+    def stats(self):
+        return {
+            "keys": sum(len(s.state) for s in self._stripes),
+            "stripes": len(self._stripes),
+            "wheel_slots": sum(len(s.wheel) for s in self._stripes),
         }
-        RATE_STATE[key] = data  # ← ADD THIS LINE - save the reset data!
-    
-    print(f"[RATE LIMIT] User: {user_id}, Endpoint: {endpoint}, Count: {data['count']}/{MAX_REQUESTS}, Reset in: {int(data['reset'] - now)}s")
-    
-    # If too many requests → reject
-    if data["count"] >= MAX_REQUESTS:
-        remaining = int(data["reset"] - now)
+
+
+class SharedRateLimiter:
+    """
+    Sliding-window limiter whose counts live in a shared store
+    (utils/rate_limit_store.py), with increments batched per key locally.
+    Store round trips run outside the stripe lock, at most one at a time per
+    key. If the store fails, decisions fall back to local counts and the
+    store is left alone for RATE_LIMIT_STORE_RETRY_SEC.
+    """
+
+    def __init__(self, store, batch: int = BATCH, headroom: float = HEADROOM,
+                 sync_sec: float = SYNC_SEC, stripes: int = STRIPES, retry_sec: float = STORE_RETRY_SEC):
+        self.store = store
+        self.batch = max(1, batch)
+        self.headroom = headroom
+        self.sync_sec = sync_sec
+        self.retry_sec = retry_sec
+        # Stores doing network I/O are called from a worker thread by async callers
+        self.blocking = getattr(store, "blocking", True)
+        now_tick = int(time.time() // EXPIRY_TICK_SEC)
+        self._stripes = [_Stripe(now_tick) for _ in range(stripes)]
+        self._store_down_until = 0.0
+        self.syncs = 0
+        self.errors = 0
+
+    def _push(self, key, window_start, window, delta):
+        """Add `delta` in the store (no lock held); the shared counts, or None if unavailable."""
+        if time.monotonic() < self._store_down_until:
+            return None
+        try:
+            counts = self.store.add(key, window_start, window, delta)
+        except Exception:
+            self.errors += 1
+            self._store_down_until = time.monotonic() + self.retry_sec
+            return None
+        self.syncs += 1
+        return counts
+
+    @staticmethod
+    def _entry(stripe, key, start, now):
+        """
+        The key's entry for the window starting at `start` (stripe lock
+        held), plus (window_start, pending) still owed to the store for the
+        window it replaced, if any.
+        """
+        stripe.sweep(now, int(now // EXPIRY_TICK_SEC))
+        entry = stripe.state.get(key)
+        owed = None
+        if entry is None:
+            # [window_start, shared_previous, shared_current, expires_at, wheel_tick, pending, synced_at, in_flight]
+            entry = stripe.state[key] = [start, 0, 0, 0.0, None, 0, float("-inf"), None]
+        elif entry[0] != start:
+            if entry[5]:
+                owed = (entry[0], entry[5])
+            entry[:3] = [start, 0, 0]
+            entry[5:] = [0, float("-inf"), None]
+        return entry, owed
+
+    @staticmethod
+    def _begin_sync(entry, now):
+        """Hand the pending increments to a sync (stripe lock held)."""
+        delta = entry[5]
+        entry[5] = 0
+        entry[6] = now
+        entry[7] = delta
+        return delta
+
+    def _sync(self, stripe, key, window_start, window, delta):
+        counts = self._push(key, window_start, window, delta)
+        with stripe.lock:
+            entry = stripe.state.get(key)
+            if entry is None or entry[0] != window_start:
+                return
+            entry[7] = None
+            if counts is None:
+                # Keep the increments for the next attempt
+                entry[5] += delta
+            else:
+                entry[1], entry[2] = counts
+
+    def _settle(self, key, window, owed):
+        if owed is not None:
+            self._push(key, owed[0], window, owed[1])
+
+    def _local_budget(self, policy, estimated):
+        return min(self.batch, max(1, int((policy.limit - estimated) * self.headroom)))
+
+    def hit(self, key, policy: RatePolicy, now: float = None) -> Decision:
+        # Wall clock: window boundaries must agree across processes
+        now = time.time() if now is None else now
+        window = policy.window
+        start = now - now % window
+        previous_weight = 1 - (now - start) / window
+        stripe = self._stripes[hash(key) % len(self._stripes)]
+
+        if self.batch == 1:
+            # Exact: reserve in the shared store first, give it back if over
+            counts = self._push(key, start, window, 1)
+            if counts is not None:
+                previous, current = counts
+                estimated = previous * previous_weight + current
+                if estimated > policy.limit:
+                    self._push(key, start, window, -1)
+                    return Decision(False, 0, _window_retry(
+                        previous, current - 1, policy.limit, window, start, now))
+                return Decision(True, int(policy.limit - estimated), 0.0)
+            # Store unavailable: fall through and count locally
+
+        # Refresh stale shared counts before deciding on them
+        with stripe.lock:
+            entry, owed = self._entry(stripe, key, start, now)
+            refresh = entry[7] is None and now - entry[6] >= self.sync_sec
+            if refresh:
+                delta = self._begin_sync(entry, now)
+        self._settle(key, window, owed)
+        if refresh:
+            self._sync(stripe, key, start, window, delta)
+
+        with stripe.lock:
+            entry, owed = self._entry(stripe, key, start, now)
+            # Shared counts only grow between syncs, so refusing on them is safe
+            estimated = entry[1] * previous_weight + entry[2] + entry[5] + (entry[7] or 0)
+            flush = False
+            if estimated + 1 <= policy.limit:
+                entry[5] += 1
+                flush = entry[7] is None and entry[5] >= self._local_budget(policy, estimated)
+                if flush:
+                    delta = self._begin_sync(entry, now)
+                decision = Decision(True, int(policy.limit - estimated - 1), 0.0)
+            else:
+                decision = Decision(False, 0, _window_retry(
+                    entry[1], entry[2] + entry[5] + (entry[7] or 0), policy.limit, window, start, now))
+            stripe.file(key, entry, start + 2 * window)
+        self._settle(key, window, owed)
+        if flush:
+            self._sync(stripe, key, start, window, delta)
+        return decision
+
+    def reset(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.state.clear()
+                stripe.wheel.clear()
+
+    def stats(self):
+        return {
+            "keys": sum(len(s.state) for s in self._stripes),
+            "stripes": len(self._stripes),
+            "batch": self.batch,
+            "headroom": self.headroom,
+            "sync_sec": self.sync_sec,
+            "syncs": self.syncs,
+            "errors": self.errors,
+            "store": self.store.stats(),
+        }
+
+
+def build_limiter(backend: str = BACKEND):
+    if backend == "memory":
+        return RateLimiter()
+    from utils.rate_limit_store import build_store
+    return SharedRateLimiter(build_store(backend))
+
+
+_limiter = build_limiter()
+
+
+def policy_for(endpoint: str) -> RatePolicy:
+    return POLICIES.get(endpoint, DEFAULT_POLICY)
+
+
+def rate_limit(user_id: int, endpoint="general"):
+    """Count one request; raises 429 with a Retry-After header when over the endpoint's policy."""
+    if not ENABLED:
+        return
+
+    decision = _limiter.hit((endpoint, user_id), policy_for(endpoint))
+    if not decision.allowed:
+        RATE_LIMITED.inc(endpoint)
+        retry_after = max(1, math.ceil(decision.retry_after))
         raise HTTPException(
             status_code=429,
-            detail=f"Rate limit exceeded. Try again in {remaining} seconds."
+            detail=f"Rate limit exceeded. Try again in {retry_after} seconds.",
+            headers={"Retry-After": str(retry_after)}
         )
-    
-    # Allow & increment
-    data["count"] += 1
-    RATE_STATE[key] = data
\ No newline at end of file
+
+
+async def rate_limit_async(user_id: int, endpoint="general"):
+    """rate_limit for async endpoints; shared-store round trips run in a worker thread."""
+    if not ENABLED:
+        return
+    if getattr(_limiter, "blocking", False):
+        await asyncio.to_thread(rate_limit, user_id, endpoint)
+    else:
+        rate_limit(user_id, endpoint)
+
+
+def rate_limit_stats():
+    return {
+        "backend": BACKEND,
+        **_limiter.stats(),
+        "default_policy": repr(DEFAULT_POLICY),
+        "policies": {endpoint: repr(p) for endpoint, p in POLICIES.items()},
+    }
@@ -0,0 +1,247 @@
+import os
+import re
+import time
+import zlib
+import pickle
+import asyncio
+import hashlib
+import threading
+from functools import lru_cache
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.optimizer.normalize_identifiers import normalize_identifiers
+
+from utils.db import connection
+from utils.cache import build_cache
+from utils.metrics import RESULT_CACHE_BYPASS
+
+# Result cache for run_sql / run_sql_async.
+#
+# The key is the normalized statement plus a version for every table it
+# reads. Versions are the tables' modification counters from
+# pg_stat_user_tables (inserts + updates + deletes), so a load into
+# `lineitem` invalidates queries on `lineitem` and nothing else, with no
+# hook in the loader. Counters are re-read at most every
+# RESULT_CACHE_VERSION_SEC, and Postgres publishes them up to ~1s after
+# commit: a result can be served for that long after a load.
+#
+# Queries touching volatile tables (the app's own tables), tables without
+# counters (views, catalogs, set-returning functions), non-deterministic
+# functions or locking clauses always go to the database.
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "4096"))
+RESULT_CACHE_MAX_RESULT_BYTES = int(os.getenv("RESULT_CACHE_MAX_RESULT_BYTES", str(4 * 1024 * 1024)))
+# Larger results are not even serialized
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "50000"))
+RESULT_CACHE_TTL_SEC = float(os.getenv("RESULT_CACHE_TTL_SEC", "86400"))
+RESULT_CACHE_VERSION_SEC = float(os.getenv("RESULT_CACHE_VERSION_SEC", "5"))
+# Payloads above this size are zlib-compressed
+RESULT_CACHE_COMPRESS_MIN = int(os.getenv("RESULT_CACHE_COMPRESS_MIN", "4096"))
+
+VOLATILE_TABLES = frozenset(
+    t.strip().lower()
+    for t in os.getenv(
+        "RESULT_CACHE_VOLATILE_TABLES",
+        "users,chats,chat_messages,llm_usage,stats_totals,stats_daily,"
+        "app_cache,rate_limit_counters,schema_migrations"
+    ).split(",")
+    if t.strip()
+)
+
+_NON_DETERMINISTIC = re.compile(
+    r"\b(random|setseed|now|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday"
+    r"|current_date|current_time|current_timestamp|localtime|localtimestamp"
+    r"|nextval|currval|lastval|setval|gen_random_uuid|uuid_generate_\w+|pg_sleep\w*|txid_\w+)\b",
+    re.IGNORECASE,
+)
+
+RESULT_CACHE = build_cache(
+    "sql_results",
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    ttl=RESULT_CACHE_TTL_SEC,
+)
+
+_versions = {}          # table → modification counter
+_versions_at = None     # monotonic time of the last read
+_versions_lock = threading.Lock()
+_epoch = 0              # bumped by bump_data_version()
+
+
+@lru_cache(maxsize=4096)
+def _analyze(query: str):
+    """
+    (normalized SQL, sorted table names) for a cacheable statement,
+    or a bypass reason string.
+    """
+    if _NON_DETERMINISTIC.search(query):
+        return "non_deterministic"
+    try:
+        statements = sqlglot.parse(query, read="postgres")
+    except Exception:
+        return "unparsed"
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        return "not_select"
+
+    expression = statements[0]
+    if expression.find(exp.Lock) or expression.find(exp.Insert, exp.Update, exp.Delete) or expression.args.get("into"):
+        return "not_select"
+
+    ctes = {cte.alias_or_name.lower() for cte in expression.find_all(exp.CTE)}
+    tables = set()
+    for table in expression.find_all(exp.Table):
+        name = table.name.lower()
+        if name in ctes and not table.db:
+            continue
+        if not name or table.db.lower() not in ("", "public"):
+            return "unversioned_table"
+        if name in VOLATILE_TABLES:
+            return "volatile_table"
+        tables.add(name)
+    if not tables:
+        return "unversioned_table"
+
+    normalized = normalize_identifiers(expression, dialect="postgres").sql(dialect="postgres", normalize=True)
+    return normalized, tuple(sorted(tables))
+
+
+def _read_versions():
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT relname, n_tup_ins + n_tup_upd + n_tup_del AS changes
+            FROM pg_stat_user_tables
+            WHERE schemaname = 'public'
+            """
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        cur.close()
+    return {r["relname"]: r["changes"] for r in rows}
+
+
+def _versions_stale():
+    return _versions_at is None or time.monotonic() - _versions_at >= RESULT_CACHE_VERSION_SEC
+
+
+def _refresh_versions():
+    global _versions, _versions_at
+    with _versions_lock:
+        if not _versions_stale():
+            return
+        try:
+            _versions = _read_versions()
+        except Exception:
+            # Keep the last snapshot; if there is none every lookup bypasses
+            pass
+        _versions_at = time.monotonic()
+
+
+def _key(query: str):
+    analyzed = _analyze(query)
+    if isinstance(analyzed, str):
+        RESULT_CACHE_BYPASS.inc(analyzed)
+        return None
+
+    normalized, tables = analyzed
+    versions = []
+    for table in tables:
+        version = _versions.get(table)
+        if version is None:
+            RESULT_CACHE_BYPASS.inc("unversioned_table")
+            return None
+        versions.append(f"{table}={version}")
+
+    material = f"{_epoch}|{','.join(versions)}|{normalized}"
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def cache_key(query: str):
+    """
+    Cache key for `query` at the current data version, or None when the
+    query must not be cached. Take the key before executing the query, so a
+    result is never stored under a version newer than the data it read.
+    """
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if _versions_stale():
+        _refresh_versions()
+    return _key(query)
+
+
+async def acache_key(query: str):
+    """cache_key for async callers; the counter refresh runs off the event loop."""
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if _versions_stale():
+        await asyncio.to_thread(_refresh_versions)
+    return _key(query)
+
+
+def _pack(result):
+    columns = result["columns"]
+    rows = [tuple(row[c] for c in columns) for row in result["rows"]]
+    data = pickle.dumps((columns, rows, result["time_ms"]), protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) >= RESULT_CACHE_COMPRESS_MIN:
+        return b"z" + zlib.compress(data, 1)
+    return b"p" + data
+
+
+def _unpack(blob):
+    data = zlib.decompress(blob[1:]) if blob[:1] == b"z" else blob[1:]
+    columns, rows, time_ms = pickle.loads(data)
+    return {
+        "success": True,
+        # Fresh dicts on every hit, so callers can't mutate the cached copy
+        "rows": [dict(zip(columns, row)) for row in rows],
+        "columns": columns,
+        "time_ms": time_ms,
+    }
+
+
+def get(key):
+    blob = RESULT_CACHE.get(key)
+    return _unpack(blob) if blob is not None else None
+
+
+def put(key, result):
+    """
+    Store a successful result. Returns True if it was stored, False if it
+    was skipped as too large.
+    """
+    if len(result["rows"]) > RESULT_CACHE_MAX_ROWS:
+        RESULT_CACHE_BYPASS.inc("too_large")
+        return False
+    blob = _pack(result)
+    if len(blob) > RESULT_CACHE_MAX_RESULT_BYTES:
+        RESULT_CACHE_BYPASS.inc("too_large")
+        return False
+    if not RESULT_CACHE.set(key, blob):
+        RESULT_CACHE_BYPASS.inc("too_large")
+        return False
+    return True
+
+
+def bump_data_version():
+    """
+    Invalidate every cached result now (e.g. at the end of a data load)
+    instead of waiting for the modification counters to be re-read.
+    """
+    global _epoch, _versions_at
+    _epoch += 1
+    _versions_at = None
+    RESULT_CACHE.clear()
+
+
+def result_cache_stats():
+    return {
+        "enabled": RESULT_CACHE_ENABLED,
+        "epoch": _epoch,
+        "versioned_tables": len(_versions),
+        "versions_age_sec": round(time.monotonic() - _versions_at, 3) if _versions_at is not None else None,
+        **RESULT_CACHE.stats(),
+    }
@@ -1,39 +1,348 @@
+import os
+import json
 import time
-from utils.db import get_connection
+import hashlib
+import datetime
+import decimal
+import asyncio
+import contextvars
+from utils.db import connection
+from utils.async_db import async_connection
+from utils.tracing import span
+from utils import result_cache
 
-def run_sql(query: str):
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
+# Rows pulled from the server-side cursor per round trip when streaming
+STREAM_FETCH_SIZE = int(os.getenv("STREAM_FETCH_SIZE", "500"))
+
+# Resource limits for (LLM-generated) SQL. Every query runs in a read-only
+# transaction with a statement_timeout; run_sql results stop at
+# SQL_MAX_ROWS rows / ~SQL_MAX_BYTES bytes and say so ("truncated").
+# Per endpoint / role timeouts override the default, most specific first:
+#   SQL_STATEMENT_TIMEOUTS="rewrite_sql=30000,admin=60000,nl_to_sql:admin=120000"
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "15000"))
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "10000"))
+SQL_MAX_BYTES = int(os.getenv("SQL_MAX_BYTES", str(8 * 1024 * 1024)))
+# Streamed results are memory-bounded already; this only stops runaway ones
+SQL_STREAM_MAX_ROWS = int(os.getenv("SQL_STREAM_MAX_ROWS", "1000000"))
+# Whole-request budget; later queries get whatever is left of it
+SQL_REQUEST_DEADLINE_SEC = float(os.getenv("SQL_REQUEST_DEADLINE_SEC", "120"))
+SQL_FETCH_SIZE = int(os.getenv("SQL_FETCH_SIZE", "1000"))
+# How often a waiting request checks whether its client is still there
+SQL_DISCONNECT_POLL_SEC = float(os.getenv("SQL_DISCONNECT_POLL_SEC", "0.5"))
+
+
+def parse_timeouts(spec: str):
+    """'key=ms,...' → {key: ms}; keys are endpoints, roles or 'endpoint:role'."""
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, ms = item.partition("=")
+        timeouts[key.strip()] = int(ms)
+    return timeouts
+
+
+SQL_STATEMENT_TIMEOUTS = parse_timeouts(os.getenv("SQL_STATEMENT_TIMEOUTS", ""))
+
+
+class QueryLimits:
+    __slots__ = ("timeout_ms", "max_rows", "max_bytes", "deadline")
+
+    def __init__(self, timeout_ms=SQL_STATEMENT_TIMEOUT_MS, max_rows=SQL_MAX_ROWS,
+                 max_bytes=SQL_MAX_BYTES, deadline=None):
+        self.timeout_ms = timeout_ms
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.deadline = deadline    # time.monotonic() value, or None
+
+    def statement_timeout_ms(self) -> int:
+        """The statement timeout, cut to what is left of the deadline (<= 0: expired)."""
+        if self.deadline is None:
+            return self.timeout_ms
+        return min(self.timeout_ms, int((self.deadline - time.monotonic()) * 1000))
+
+
+DEFAULT_LIMITS = QueryLimits()
+_limits = contextvars.ContextVar("sql_limits", default=None)
+
+
+def timeout_for(endpoint: str, role: str = None) -> int:
+    for key in (f"{endpoint}:{role}", endpoint, role):
+        if key in SQL_STATEMENT_TIMEOUTS:
+            return SQL_STATEMENT_TIMEOUTS[key]
+    return SQL_STATEMENT_TIMEOUT_MS
+
+
+def set_query_limits(endpoint: str, role: str = None, deadline_sec: float = SQL_REQUEST_DEADLINE_SEC):
+    """Apply the endpoint's / role's limits to SQL run while handling the current request."""
+    _limits.set(QueryLimits(
+        timeout_ms=timeout_for(endpoint, role),
+        deadline=time.monotonic() + deadline_sec,
+    ))
+
+
+def current_limits() -> QueryLimits:
+    return _limits.get() or DEFAULT_LIMITS
 
-        start = time.time()
-        if not query.strip().endswith(";"):
-            query = query.strip() + ";"
-        cur.execute(query)
-        
-        # Convert rows to normal Python dicts
-        rows = [dict(r) for r in cur.fetchall()]
-        
-        end = time.time()
 
-        columns = [desc[0] for desc in cur.description]
+def _row_bytes(row) -> int:
+    # Rough JSON size: text by length, everything else as a short scalar
+    size = 2
+    for key, value in row.items():
+        size += len(key) + 4 + (len(value) if isinstance(value, (str, bytes)) else 8)
+    return size
 
-        conn.commit()
-        conn.close()
 
+class RowCap:
+    """Collects rows until max_rows or (approximately) max_bytes is reached."""
+
+    __slots__ = ("limits", "rows", "bytes", "truncated_by")
+
+    def __init__(self, limits: QueryLimits):
+        self.limits = limits
+        self.rows = []
+        self.bytes = 0
+        self.truncated_by = None
+
+    def wanted(self, batch_size: int) -> int:
+        # One row past the cap tells "exactly max_rows" from "truncated"
+        return max(1, min(batch_size, self.limits.max_rows + 1 - len(self.rows)))
+
+    def add(self, batch) -> bool:
+        """Add a batch of row dicts; False once a cap is hit (stop fetching)."""
+        for row in batch:
+            if len(self.rows) >= self.limits.max_rows:
+                self.truncated_by = "max_rows"
+                return False
+            self.bytes += _row_bytes(row)
+            if self.bytes > self.limits.max_bytes:
+                self.truncated_by = "max_bytes"
+                return False
+            self.rows.append(row)
+        return True
+
+    def result(self, columns, time_ms):
         return {
             "success": True,
-            "rows": rows,
+            "rows": self.rows,
             "columns": columns,
-            "time_ms": round((end - start) * 1000, 3)
+            "time_ms": time_ms,
+            "truncated": self.truncated_by is not None,
+            "truncated_by": self.truncated_by,
         }
 
+
+def _capped(result, limits: QueryLimits):
+    """Apply the caller's caps to a complete (cached) result."""
+    cap = RowCap(limits)
+    cap.add(result["rows"])
+    return cap.result(result["columns"], result["time_ms"])
+
+
+def _error(message):
+    return {
+        "success": False,
+        "error": message,
+        "rows": [],
+        "columns": [],
+        "time_ms": None
+    }
+
+
+def _describe_error(e, timeout_ms):
+    if "statement timeout" in str(e):
+        return f"Query exceeded the {timeout_ms} ms statement timeout and was cancelled"
+    return str(e)
+
+
+def _trace_result(s, query, result):
+    # Hash and size are computed lazily, only for traces that get exported
+    s.set(sql_hash=lambda: sql_hash(query), success=result["success"], cached=result["cached"])
+    if result["success"]:
+        rows = result["rows"]
+        s.set(rows=len(rows), truncated=result["truncated"],
+              bytes=lambda: len(json.dumps(rows, default=json_default)))
+    else:
+        s.fail(result["error"])
+    return result
+
+
+def sql_hash(query: str) -> str:
+    """Short stable id for a statement, for correlating traces and logs."""
+    return hashlib.sha256(query.strip().rstrip(";").encode()).hexdigest()[:16]
+
+
+def run_sql(query: str, use_cache: bool = True):
+    """
+    Execute `query` in a read-only transaction under the current request's
+    limits (see set_query_limits). Read-only queries on versioned tables are
+    served from the result cache (see utils.result_cache) unless use_cache
+    is False.
+    """
+    limits = current_limits()
+    with span("sql.run") as s:
+        key = result_cache.cache_key(query) if use_cache else None
+        cached = result_cache.get(key) if key is not None else None
+        if cached is not None:
+            return _trace_result(s, query, {**_capped(cached, limits), "cached": True})
+
+        result = _run_sql(query, limits)
+        # Only complete results are cached; callers' caps differ
+        if key is not None and result["success"] and not result["truncated"]:
+            result_cache.put(key, result)
+        return _trace_result(s, query, {**result, "cached": False})
+
+
+def _run_sql(query: str, limits: "QueryLimits" = None):
+    limits = limits or current_limits()
+    timeout_ms = limits.statement_timeout_ms()
+    if timeout_ms <= 0:
+        return _error("Request deadline exceeded")
+
+    try:
+        with connection() as conn:
+            start = time.time()
+            # Read-only transaction; SET LOCAL ends with it, so the pooled
+            # connection keeps its defaults
+            control = conn.cursor()
+            control.execute("SET TRANSACTION READ ONLY")
+            control.execute(f"SET LOCAL statement_timeout = {timeout_ms}")
+
+            # Server-side cursor: rows past the cap are never sent over
+            cur = conn.cursor(name="run_sql")
+            cap = RowCap(limits)
+
+            cur.execute(query.strip().rstrip(";"))
+            while True:
+                batch = cur.fetchmany(cap.wanted(SQL_FETCH_SIZE))
+                if not batch or not cap.add(batch):
+                    break
+                # Each FETCH is its own statement: keep the whole query
+                # within the original timeout
+                remaining = timeout_ms - int((time.time() - start) * 1000)
+                if remaining <= 0:
+                    raise TimeoutError("canceling statement due to statement timeout")
+                control.execute(f"SET LOCAL statement_timeout = {remaining}")
+
+            end = time.time()
+
+            columns = [desc[0] for desc in cur.description] if cur.description else []
+
+            cur.close()
+            control.close()
+            conn.rollback()
+
+        return cap.result(columns, round((end - start) * 1000, 3))
+
     except Exception as e:
-        return {
-            "success": False,
-            "error": str(e),
-            "rows": [],
-            "columns": [],
-            "time_ms": None
-        }
+        return _error(_describe_error(e, timeout_ms))
+
+
+async def run_sql_async(query: str, use_cache: bool = True):
+    """
+    asyncpg counterpart of run_sql, same result shape.
+    Cancelling the awaiting task cancels the query on the Postgres side.
+    """
+    limits = current_limits()
+    with span("sql.run") as s:
+        key = await result_cache.acache_key(query) if use_cache else None
+        cached = result_cache.get(key) if key is not None else None
+        if cached is not None:
+            return _trace_result(s, query, {**_capped(cached, limits), "cached": True})
+
+        result = await _run_sql_async(query, limits)
+        if key is not None and result["success"] and not result["truncated"]:
+            result_cache.put(key, result)
+        return _trace_result(s, query, {**result, "cached": False})
+
+
+async def _run_sql_async(query: str, limits: "QueryLimits" = None):
+    limits = limits or current_limits()
+    timeout_ms = limits.statement_timeout_ms()
+    if timeout_ms <= 0:
+        return _error("Request deadline exceeded")
+
+    try:
+        async with async_connection() as conn:
+            async with conn.transaction(readonly=True):
+                start = time.time()
+                await conn.execute(f"SET LOCAL statement_timeout = {timeout_ms}")
+
+                stmt = await conn.prepare(query.strip().rstrip(";"))
+                cursor = await stmt.cursor()
+                cap = RowCap(limits)
+                while True:
+                    # Convert records to normal Python dicts
+                    batch = [dict(r) for r in await cursor.fetch(cap.wanted(SQL_FETCH_SIZE))]
+                    if not batch or not cap.add(batch):
+                        break
+                    remaining = timeout_ms - int((time.time() - start) * 1000)
+                    if remaining <= 0:
+                        raise TimeoutError("canceling statement due to statement timeout")
+                    await conn.execute(f"SET LOCAL statement_timeout = {remaining}")
+
+                end = time.time()
+
+                columns = [attr.name for attr in stmt.get_attributes()]
+
+        return cap.result(columns, round((end - start) * 1000, 3))
+
+    except Exception as e:
+        return _error(_describe_error(e, timeout_ms))
+
+
+async def stream_sql_async(query: str, fetch_size: int = STREAM_FETCH_SIZE):
+    """
+    Execute `query` through a server-side cursor and yield results lazily:
+    the first item is the column list, every following item is one row dict.
+    At most `fetch_size` rows are held in memory at a time.
+    """
+    async with async_connection() as conn:
+        async with conn.transaction(readonly=True):
+            # Bounds each FETCH; the client reading slowly doesn't count
+            await set_statement_timeout(conn)
+            stmt = await conn.prepare(query.strip().rstrip(";"))
+            yield [attr.name for attr in stmt.get_attributes()]
+
+            async for record in stmt.cursor(prefetch=fetch_size):
+                yield dict(record)
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away while its request was still working."""
+
+
+async def until_disconnect(request, awaitable, poll_sec: float = SQL_DISCONNECT_POLL_SEC):
+    """
+    Await `awaitable`, cancelling it if the HTTP client disconnects first.
+    Cancellation reaches asyncpg, which cancels the running query on the
+    Postgres side.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_sec)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def set_statement_timeout(conn, timeout_ms: int = None):
+    """SET LOCAL statement_timeout for an open asyncpg transaction (current request's limits by default)."""
+    if timeout_ms is None:
+        timeout_ms = current_limits().statement_timeout_ms()
+    if timeout_ms <= 0:
+        raise TimeoutError("Request deadline exceeded")
+    await conn.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
 
+def json_default(value):
+    """json.dumps fallback for DB values (NUMERIC, DATE, TIMESTAMP, ...)."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    return str(value)
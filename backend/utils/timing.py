@@ -0,0 +1,51 @@
+import time
+import contextvars
+from contextlib import contextmanager
+
+from utils.metrics import STAGE_SECONDS, STAGE_STARTED
+from utils.tracing import span
+
+# Per-request stage durations (ms). Only populated inside collect_stages();
+# every stage also lands in the promptsmith_stage_seconds histogram.
+_stages = contextvars.ContextVar("stage_timings", default=None)
+
+
+class stage:
+    """
+    Time a pipeline stage; durations of repeated stages are summed.
+    Inside a request trace the stage is also a span, so everything
+    traced within it (LLM calls, SQL) nests under it.
+    A plain class rather than @contextmanager: it is on every request path
+    and skips the generator machinery.
+    """
+
+    __slots__ = ("name", "start", "span")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        STAGE_STARTED.inc(self.name)
+        self.span = span(self.name).__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.span.__exit__(*exc)
+        STAGE_SECONDS.observe(elapsed, self.name)
+        timings = _stages.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed * 1000
+        return False
+
+
+@contextmanager
+def collect_stages():
+    """Collect stage timings for everything run in this context (including child tasks)."""
+    timings = {}
+    token = _stages.set(timings)
+    try:
+        yield timings
+    finally:
+        _stages.reset(token)
@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import queue
+import random
+import threading
+import contextvars
+
+# Request-scoped tracing.
+#
+# Every HTTP request gets a trace; span() blocks inside it (pipeline stages,
+# LLM calls, SQL runs, persistence, signing) become nested spans. Spans are
+# kept in memory until the request ends, then the whole trace is either
+# dropped or handed to a background exporter that appends one JSON object
+# per span (OTLP-style field names) to a size-rotated JSONL file.
+#
+# A trace is kept when it was sampled at the start (TRACE_SAMPLE_RATE), when
+# it took at least TRACE_SLOW_MS, or when it ended in an error, so slow and
+# failing requests are always captured.
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") == "1"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/spans.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "512"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "promptsmith-backend")
+
+TRACE_ID_HEADER = "X-Trace-Id"
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class _Trace:
+    __slots__ = ("trace_id", "sampled", "spans", "dropped")
+
+    def __init__(self, sampled):
+        self.trace_id = _new_id(128)
+        self.sampled = sampled
+        self.spans = []
+        self.dropped = 0
+
+
+class _Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace, parent_id, name, attributes):
+        self.trace = trace
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def finish(self, error=None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"[:500]
+        trace = self.trace
+        if len(trace.spans) < TRACE_MAX_SPANS:
+            trace.spans.append(self)
+        else:
+            trace.dropped += 1
+
+    def to_record(self):
+        attributes = {}
+        for key, value in self.attributes.items():
+            # Expensive attributes are passed as callables and only
+            # evaluated for traces that are actually exported
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    continue
+            attributes[key] = value
+        return {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "ERROR" if self.error else "OK",
+            "error": self.error,
+            "attributes": attributes,
+            "resource": {"service.name": SERVICE_NAME, "process.pid": os.getpid()},
+        }
+
+
+class span:
+    """
+    Time a block as a child of the current span. Outside a trace this costs
+    one ContextVar lookup and records nothing.
+
+        with span("sql.execute", sql_hash=h) as s:
+            ...
+            s.set(rows=len(rows))
+    """
+
+    __slots__ = ("name", "attributes", "_span", "_token")
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self._span = None
+
+    def __enter__(self):
+        parent = _current.get()
+        if parent is not None:
+            self._span = _Span(parent.trace, parent.span_id, self.name, self.attributes)
+            self._token = _current.set(self._span)
+        return self
+
+    def set(self, **attributes):
+        if self._span is not None:
+            self._span.attributes.update(attributes)
+
+    def fail(self, reason: str):
+        """Mark the span failed without raising (error results, 5xx responses)."""
+        if self._span is not None:
+            self._span.error = str(reason)[:500]
+
+    @property
+    def recording(self):
+        return self._span is not None
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is not None:
+            _current.reset(self._token)
+            self._span.finish(exc)
+        return False
+
+
+class trace(span):
+    """
+    Root span of a new trace (one per request). When the block ends the
+    trace is exported if it was sampled, slow or failed.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        if not TRACE_ENABLED:
+            return self
+        root = _Trace(random.random() < TRACE_SAMPLE_RATE)
+        self._span = _Span(root, None, self.name, self.attributes)
+        self._token = _current.set(self._span)
+        return self
+
+    @property
+    def trace_id(self):
+        return self._span.trace.trace_id if self._span is not None else None
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is None:
+            return False
+        _current.reset(self._token)
+        root = self._span
+        root.finish(exc)
+
+        duration_ms = (root.end_ns - root.start_ns) / 1e6
+        keep = root.trace.sampled or duration_ms >= TRACE_SLOW_MS or root.error is not None
+        if keep:
+            root.attributes["trace.kept_because"] = (
+                "error" if root.error else "slow" if duration_ms >= TRACE_SLOW_MS else "sampled"
+            )
+            if root.trace.dropped:
+                root.attributes["trace.dropped_spans"] = root.trace.dropped
+            _exporter.submit(root.trace)
+        return False
+
+
+def annotate(**attributes):
+    """Add attributes to the innermost open span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def current_trace_id():
+    current = _current.get()
+    return current.trace.trace_id if current is not None else None
+
+
+class JsonlExporter:
+    """
+    Appends spans to `path` from a background thread, rotating to
+    path.1 ... path.N once the file exceeds max_bytes. If the queue is
+    full the trace is dropped rather than blocking a request.
+    """
+
+    def __init__(self, path=TRACE_FILE, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS,
+                 queue_size=TRACE_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def submit(self, trace_):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(trace_)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            trace_ = self._queue.get()
+            if trace_ is None:
+                break
+            batch = [trace_]
+            # Drain whatever else is waiting into the same write
+            while len(batch) < 100:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._write(batch)
+                    return
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            lines = "".join(
+                json.dumps(s.to_record(), default=str, separators=(",", ":")) + "\n"
+                for t in batch
+                for s in sorted(t.spans, key=lambda s: s.start_ns)
+            )
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._rotate_if_needed(len(lines))
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            self.exported += len(batch)
+        except Exception:
+            self.errors += 1
+
+    def _rotate_if_needed(self, incoming):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size + incoming <= self.max_bytes:
+            return
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self, timeout=5.0):
+        """Flush queued traces and stop the thread (app shutdown)."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+
+_exporter = JsonlExporter()
+
+
+def close_tracing():
+    _exporter.close()
+
+
+def tracing_stats():
+    return {
+        "enabled": TRACE_ENABLED,
+        "sample_rate": TRACE_SAMPLE_RATE,
+        "slow_ms": TRACE_SLOW_MS,
+        **_exporter.stats(),
+    }
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a trace per HTTP request (until the last body
+    chunk) and returning its id in the X-Trace-Id header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACE_ENABLED:
+            return await self.app(scope, receive, send)
+
+        with trace("http.request", method=scope["method"], path=scope["path"]) as root:
+            header = (TRACE_ID_HEADER.lower().encode(), root.trace_id.encode())
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [header]
+                    root.set(status=message["status"])
+                    if message["status"] >= 500:
+                        root.fail(f"HTTP {message['status']}")
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                root.set(route=getattr(route, "path", None))
@@ -0,0 +1,2 @@
+-- Schema is managed by the backend migration runner (backend/utils/migrations.py),
+-- which applies pending migrations at startup or via: python -m utils.migrations